@@ -2,19 +2,40 @@
 小红书短链解析后端服务
 使用Flask提供API接口，解析小红书短链并返回无水印原图URL
 """
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, send_file, g
 from flask_cors import CORS
-import requests
 import re
 import json
 import logging
-import base64
+import hashlib
 import html as _html
-from urllib.parse import unquote, unquote_plus
 from urllib.parse import urlparse, urljoin
 import time
 import os
-import uuid
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+from archive_export import ARCHIVE_FORMATS, image_extension, iter_archive
+from browser_pool import BrowserPoolBusy, browser_pool_stats, get_browser_pool
+from image_cache import ImageCache, image_cache_key
+from image_hedge import ImageHedger
+from image_identity import FINGERPRINT_BYTES, content_fingerprint, dedupe_images, image_identity_key
+from cookie_store import create_cookie_store
+from image_transcode import (IMAGE_TRANSCODE_MAX_SOURCE_MB, parse_transcode_params, transcode_available,
+                             transcode_in_pool)
+from extractors import extract_doubao_images_from_html, extract_images_from_html
+from job_scheduler import CHEAP, EXPENSIVE, JobScheduler, JobStore, SchedulerBusy, WaiterLimit
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from metrics import (EXTRACTION_TIER, HTTP_REQUEST_SECONDS, HTTP_REQUESTS, HTTP_REQUESTS_IN_FLIGHT, IMAGE_DEDUPE,
+                     STAGE_SECONDS, observe_stage, render_all as render_metrics)
+from page_fetch import DOUBAO_STATE_MARKERS, XHS_STATE_MARKERS, PageReader
+from parse_cache import FRESH, STALE, ParseCache
+from prefetch import ImagePrefetcher
+from single_flight import FlightTimeout, SingleFlight
+from settings import env_bool, env_float, env_int, env_str
+from upstream import guard_stats, host_group, http_get, http_head
+from upstream_guard import UpstreamRejected
 
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
@@ -24,29 +45,24 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # 简易会话：用短 token 保存豆包 Cookie（避免把超长Cookie放在URL里被截断/泄漏）
-COOKIE_SESSIONS = {}  # sid -> {"cookie": str, "ts": float}
 COOKIE_SESSION_TTL_SECONDS = 60 * 30  # 30分钟
-
-
-def _cleanup_cookie_sessions():
-    now = time.time()
-    expired = [sid for sid, v in COOKIE_SESSIONS.items() if now - v.get("ts", 0) > COOKIE_SESSION_TTL_SECONDS]
-    for sid in expired:
-        COOKIE_SESSIONS.pop(sid, None)
+COOKIE_SESSIONS = create_cookie_store(
+    ttl_seconds=COOKIE_SESSION_TTL_SECONDS,
+    max_entries=env_int('COOKIE_SESSION_MAX_ENTRIES', 10000),
+    db_path=env_str('COOKIE_SESSION_DB'),  # 设置后多个 worker 共享 sid
+)
 
 
 @app.route('/api/doubao_cookie', methods=['POST'])
 def doubao_cookie():
     """把豆包Cookie保存到后端，返回短 sid，供 image_proxy 使用（避免cookie放URL里）"""
     try:
-        _cleanup_cookie_sessions()
         data = request.get_json() or {}
         cookie = (data.get('cookie') or '').strip()
         if not cookie:
             return jsonify({'success': False, 'error': 'cookie 不能为空'}), 400
 
-        sid = uuid.uuid4().hex
-        COOKIE_SESSIONS[sid] = {"cookie": cookie, "ts": time.time()}
+        sid = COOKIE_SESSIONS.create(cookie)
         return jsonify({'success': True, 'data': {'sid': sid, 'ttl_seconds': COOKIE_SESSION_TTL_SECONDS}})
     except Exception as e:
         logger.error("doubao_cookie失败: %s", str(e), exc_info=True)
@@ -95,28 +111,73 @@ def extract_url_from_text(text):
     return general_match.group(1).strip() if general_match else ''
 
 
+# 短链域名：只有这些域名需要逐跳解析重定向
+SHORT_LINK_HOSTS = ('xhslink.com',)
+_REDIRECT_STATUS = (301, 302, 303, 307, 308)
+SHORT_LINK_MAX_HOPS = 5
+
+# 短链 -> 跳转目标 缓存（只缓存跳转结果，不缓存页面）
+REDIRECT_CACHE = ParseCache(
+    max_entries=env_int('REDIRECT_CACHE_MAX_ENTRIES', 4096),
+    ttl_seconds=env_int('REDIRECT_CACHE_TTL_SECONDS', 6 * 3600),
+    stale_seconds=0,
+)
+
+
+def _is_short_link(url):
+    host = (urlparse(url).hostname or '').lower()
+    return any(host == h or host.endswith('.' + h) for h in SHORT_LINK_HOSTS)
+
+
+def _follow_short_link_redirects(short_link, timeout=5):
+    """用 HEAD 逐跳跟随短链重定向（不下载响应体），一旦离开短链域名就停止"""
+    current = short_link
+    for _ in range(SHORT_LINK_MAX_HOPS):
+        if not _is_short_link(current):
+            break
+        resp = http_head(current, headers=HEADERS, timeout=timeout)
+        resp.close()
+        location = resp.headers.get('Location')
+        if resp.status_code not in _REDIRECT_STATUS or not location:
+            break
+        current = urljoin(current, location)
+    return current
+
+
 def resolve_short_link(short_link):
-    """解析短链，获取真实跳转地址"""
+    """解析短链，获取真实跳转地址（只跟随重定向，不下载目标页面正文）"""
     try:
-        logger.info(f"开始解析短链: {short_link}")
-        
-        # 发送请求，跟随重定向，减少超时时间
-        response = requests.get(
-            short_link,
-            headers=HEADERS,
-            allow_redirects=True,
-            timeout=5  # 减少超时时间从10秒到5秒
-        )
-        
-        final_url = response.url
-        logger.info(f"短链跳转完成: {final_url}")
-        
+        logger.info("开始解析短链: %s", short_link)
+
+        cache_key = 'redirect:' + _canonical_link(short_link)
+        cached, state = REDIRECT_CACHE.get(cache_key)
+        if state is not None:
+            logger.info("短链跳转命中缓存: %s", cached)
+            return cached
+
+        with observe_stage('resolve_short_link'):
+            final_url = _follow_short_link_redirects(short_link)
+            if _is_short_link(final_url):
+                # 短链服务不支持 HEAD 时回退为 GET：只读响应头拿到最终地址，不读取正文
+                response = http_get(final_url, headers=HEADERS, allow_redirects=True, timeout=5, stream=True)
+                response.close()
+                final_url = response.url
+
+        if final_url != short_link:
+            REDIRECT_CACHE.set([cache_key], final_url)
+        logger.info("短链跳转完成: %s", final_url)
+
         return final_url
     except Exception as e:
-        logger.error(f"解析短链失败: {str(e)}")
+        logger.error("解析短链失败: %s", str(e))
         raise
 
 
+def fetch_note_page(target_url):
+    """请求笔记页面，返回尚未读取正文的响应（stream），由调用方决定是否读取"""
+    return http_get(target_url, headers=HEADERS, timeout=8, stream=True)  # 减少超时时间
+
+
 def extract_note_id_from_url(url):
     """从URL中提取笔记ID"""
     patterns = [
@@ -139,266 +200,6 @@ def extract_note_id_from_url(url):
 #     pass
 
 
-def extract_images_from_html(html):
-    """从HTML中提取图片URL"""
-    if not html:
-        return []
-    
-    images = []
-    
-    # 1. 尝试提取 __INITIAL_STATE__ 中的图片（改进版）
-    try:
-        # 尝试多种匹配模式
-        state_patterns = [
-            r'__INITIAL_STATE__\s*=\s*(\{[\s\S]*?\})\s*</script>',
-            r'window\.__INITIAL_STATE__\s*=\s*(\{[\s\S]*?\})\s*</script>',
-            r'__INITIAL_STATE__\s*=\s*(\{[\s\S]*?\});',
-        ]
-        
-        json_text = None
-        for pattern in state_patterns:
-            state_match = re.search(pattern, html, re.IGNORECASE)
-            if state_match:
-                json_text = state_match.group(1)
-                logger.info(f"找到__INITIAL_STATE__，长度: {len(json_text)}")
-                break
-        
-        if json_text:
-            # 清理JSON文本
-            json_text = json_text.replace('\\u002F', '/')
-            json_text = json_text.replace('\\/', '/')
-            
-            # 尝试解析JSON（可能需要处理不完整的JSON）
-            try:
-                state_obj = json.loads(json_text)
-                
-                # 查找图片列表（尝试多种路径）
-                note_data = state_obj.get('note', {}).get('note', {})
-                if not note_data:
-                    note_data = state_obj.get('note', {})
-                
-                image_list = note_data.get('imageList', [])
-                if not image_list:
-                    image_list = note_data.get('images', [])
-                
-                for img in image_list:
-                    url = img.get('url') or img.get('originalUrl') or img.get('originUrl') or img.get('info', {}).get('url', '')
-                    if url and url.startswith('http'):
-                        images.append(url)
-                
-                if images:
-                    logger.info(f"从__INITIAL_STATE__提取到 {len(images)} 张图片")
-                    return images
-            except json.JSONDecodeError as e:
-                logger.warning(f"JSON解析失败，尝试部分提取: {str(e)}")
-                # JSON解析失败，尝试直接从文本中提取图片URL
-                # 继续执行下面的正则匹配
-    except Exception as e:
-        logger.warning(f"解析__INITIAL_STATE__失败: {str(e)}")
-    
-    # 2. 尝试正则匹配常见的图片URL模式（优化：优先匹配最可能成功的模式）
-    # 优先匹配小红书CDN图片URL（最常见）
-    patterns = [
-        # 优先：直接匹配小红书CDN图片URL（最快最准确）
-        r'https?://sns-webpic-[^"\'<>\s]+',
-        r'https?://sns-img-[^"\'<>\s]+',
-        # JSON格式的图片URL（需要捕获组）
-        r'"url":"(https?://sns-[^"]+)"',
-        r'"originalUrl":"(https?://[^"]+)"',
-        r'"originUrl":"(https?://[^"]+)"',
-        r'"imageList":\s*\[\s*{\s*"url":"(https?://[^"]+)"',
-        # 其他图片URL模式
-        r'https?://ci\.xiaohongshu\.com/[^"\'<>\s]+',
-        r'https?://qimg\.xiaohongshu\.com/[^"\'<>\s]+',
-        r'https?://img\.xiaohongshu\.com/[^"\'<>\s]+',
-        r'"url":"(https?://[^"]+)"\s*,\s*"width"',
-        # Meta标签
-        r'property="og:image"\s+content="(https?://[^"]+)"',
-        r'name="og:image"\s+content="(https?://[^"]+)"',
-    ]
-    
-    for pattern in patterns:
-        matches = re.findall(pattern, html, re.IGNORECASE)
-        if matches:
-            # 如果pattern有捕获组，matches是元组列表，否则是字符串列表
-            if matches and isinstance(matches[0], tuple):
-                matches = [m[0] if m[0] else m for m in matches]
-            
-            # 过滤掉非图片URL
-            valid_matches = [m for m in matches if ('sns-' in m or 'xiaohongshu.com' in m or 'xhscdn.com' in m) and m.startswith('http')]
-            if valid_matches:
-                images.extend(valid_matches)
-                logger.info(f"通过正则匹配提取到 {len(valid_matches)} 个URL")
-                break  # 找到就立即返回，不再尝试其他模式
-    
-    # 保序去重并过滤（不能用 set，set 会打乱小红书原始顺序）
-    ordered_images = []
-    seen = set()
-    for img in images:
-        if not (img and img.startswith('http') and ('sns-img' in img or 'xiaohongshu.com' in img or 'xhscdn.com' in img)):
-            continue
-        # 排除纯域名根路径、样式拼接串等“非真实图片URL”
-        if re.match(r'^https?://[^/]+/?$', img.strip()) or ');background' in img:
-            continue
-        if img in seen:
-            continue
-        seen.add(img)
-        ordered_images.append(img)
-    images = ordered_images
-    
-    if images:
-        logger.info(f"总共提取到 {len(images)} 张图片")
-    
-    return images
-
-
-def _extract_urls_from_json(obj, domains):
-    """递归从JSON对象中提取指定域名的图片URL"""
-    urls = []
-    if isinstance(obj, dict):
-        for k, v in obj.items():
-            if isinstance(v, str):
-                if v.startswith('http') and any(d in v for d in domains):
-                    urls.append(v)
-            else:
-                urls.extend(_extract_urls_from_json(v, domains))
-    elif isinstance(obj, list):
-        for item in obj:
-            urls.extend(_extract_urls_from_json(item, domains))
-    return urls
-
-
-def _try_parse_json_loose(text):
-    """尽可能从脚本文本中解析JSON（支持URL编码/转义/base64等常见形式）"""
-    if not text:
-        return None
-
-    candidates = [text.strip()]
-
-    # 去掉可能包裹的引号
-    if (candidates[0].startswith('"') and candidates[0].endswith('"')) or (
-        candidates[0].startswith("'") and candidates[0].endswith("'")
-    ):
-        candidates.append(candidates[0][1:-1])
-
-    # URL 编码/加号空格
-    candidates.append(unquote(candidates[0]))
-    candidates.append(unquote_plus(candidates[0]))
-
-    # 反斜杠转义（常见于内嵌字符串）
-    candidates.append(candidates[0].encode('utf-8', errors='ignore').decode('unicode_escape', errors='ignore'))
-
-    # base64（如果看起来像 base64）
-    base = re.sub(r'\s+', '', candidates[0])
-    if re.fullmatch(r'[A-Za-z0-9+/=]+', base or '') and len(base) > 100:
-        try:
-            decoded = base64.b64decode(base + '===')  # 容错 padding
-            candidates.append(decoded.decode('utf-8', errors='ignore'))
-        except Exception:
-            pass
-
-    seen = set()
-    for c in candidates:
-        if not c or c in seen:
-            continue
-        seen.add(c)
-        try:
-            return json.loads(c)
-        except Exception:
-            continue
-    return None
-
-
-def extract_doubao_images_from_html(html):
-    """从豆包thread页面HTML中提取图片URL（尽量获取无水印原图）"""
-    if not html:
-        return []
-
-    images = []
-
-    # 先把HTML实体解码（非常关键：豆包页面里常见 &amp; 会破坏签名参数）
-    try:
-        html = _html.unescape(html)
-    except Exception:
-        pass
-
-    # 1. 先尝试从页面中的 JSON 状态脚本中提取（类似小红书 __INITIAL_STATE__）
-    try:
-        script_patterns = [
-            r'<script[^>]+id="__RENDER_DATA__"[^>]*>([\s\S]*?)</script>',
-            r'<script[^>]+id="__NEXT_DATA__"[^>]*>([\s\S]*?)</script>',
-        ]
-        json_text = None
-        for pattern in script_patterns:
-            m = re.search(pattern, html, re.IGNORECASE)
-            if m:
-                json_text = m.group(1).strip()
-                logger.info(f"豆包页面找到JSON脚本，长度: {len(json_text)}")
-                break
-
-        domains = ['byteimg.com', 'byteadapters.cn', 'doubaoimg.com']
-
-        if json_text:
-            state_obj = _try_parse_json_loose(json_text)
-            if state_obj is None:
-                logger.warning("豆包JSON解析失败（多种解码方式均失败），将使用正则继续提取")
-            else:
-                images.extend(_extract_urls_from_json(state_obj, domains))
-    except Exception as e:
-        logger.warning(f"豆包JSON脚本解析异常: {str(e)}")
-
-    # 2. 直接从HTML文本中用正则匹配图片URL（兜底）
-    patterns = [
-        r'https?://[^\s"\'<>]*byteimg\.com[^\s"\'<>]*',
-        r'https?://[^\s"\'<>]*byteadapters\.cn[^\s"\'<>]*',
-        r'https?://[^\s"\'<>]*doubaoimg\.com[^\s"\'<>]*',
-    ]
-
-    for pattern in patterns:
-        matches = re.findall(pattern, html, re.IGNORECASE)
-        if matches:
-            logger.info(f"豆包页面通过正则匹配到 {len(matches)} 个候选URL")
-            images.extend(matches)
-
-    # 3. 去重、清洗（保留查询参数，避免破坏签名；仅做最小处理）
-    cleaned = []
-    for u in images:
-        if not u.startswith('http'):
-            continue
-
-        # 豆包经常返回带处理后缀的“水印/缩略图”URL，例如：
-        # ...jpeg~tplv-xxx-downsize_watermark_...png?x-signature=...
-        # 尝试生成“无水印候选”：去掉 "~tplv-..." 到 "?" 之前的部分，同时保留 query 参数（签名）。
-        q = ''
-        base = u
-        if '?' in u:
-            base, q = u.split('?', 1)
-            q = '?' + q
-
-        # 去掉处理后缀（从 ~tplv- 开始到结尾）
-        if '~tplv-' in base:
-            base_no_tplv = base.split('~tplv-', 1)[0]
-            cleaned.append(base_no_tplv + q)  # 优先加入“疑似无水印原图”
-
-        cleaned.append(u)  # 同时保留原始URL兜底
-
-    # 去重，但尽量保持顺序（先保留无水印候选）
-    seen = set()
-    ordered = []
-    for u in cleaned:
-        if u in seen:
-            continue
-        seen.add(u)
-        ordered.append(u)
-
-    cleaned = ordered
-
-    if cleaned:
-        logger.info(f"豆包页面最终提取到 {len(cleaned)} 张图片")
-
-    return cleaned
-
-
 def pick_best_doubao_image_url(urls):
     """
     选择最合适的豆包图片URL：优先不含 watermark 的候选；如果候选不可访问，则回退到可访问的URL。
@@ -431,26 +232,35 @@ def pick_best_doubao_image_url(urls):
     return no_wm, wm
 
 
+def _is_doubao_image_request(u):
+    return 'byteimg.com' in u or 'byteadapters.cn' in u or 'doubaoimg.com' in u
+
+
+def render_doubao_page(url, cookie=None):
+    """
+    通过常驻浏览器池渲染豆包页面，一次导航同时返回 (渲染后HTML, 图片请求URL列表)。
+    Playwright 未安装 / 队列已满 / 渲染失败时返回 (None, [])。
+    """
+    pool = get_browser_pool()
+    if pool is None:
+        logger.warning("Playwright未安装，跳过浏览器渲染")
+        return None, []
+    try:
+        with observe_stage('playwright_render'):
+            result = pool.render(url, cookie=cookie or '', url_filter=_is_doubao_image_request)
+        return result.html, result.image_urls
+    except BrowserPoolBusy:
+        logger.warning("浏览器渲染队列已满，跳过Playwright兜底: %s", url)
+        return None, []
+    except Exception as e:
+        logger.error("Playwright渲染失败: %s", str(e))
+        return None, []
+
+
 def fetch_page_with_playwright(url):
     """使用Playwright获取完整渲染后的页面（如果需要）"""
-    try:
-        from playwright.sync_api import sync_playwright
-        
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            page = browser.new_page()
-            page.goto(url, wait_until='networkidle', timeout=30000)
-            
-            # 等待页面加载
-            time.sleep(2)
-            
-            html = page.content()
-            browser.close()
-            
-            return html
-    except ImportError:
-        logger.warning("Playwright未安装，跳过浏览器渲染")
-        return None
+    html, _ = render_doubao_page(url)
+    return html
 
 
 def fetch_doubao_image_urls_with_playwright(url, cookie=None):
@@ -458,62 +268,61 @@ def fetch_doubao_image_urls_with_playwright(url, cookie=None):
     使用Playwright抓取页面加载过程中的图片请求URL。
     用途：很多“无水印原图”并不直接出现在HTML里，而是在网络请求里以另一条签名URL出现。
     """
-    try:
-        from playwright.sync_api import sync_playwright
-
-        collected = []
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            context = browser.new_context()
-            if cookie:
-                # cookie 字符串透传时，我们不做结构化拆分；只在请求头层面更可靠
-                context.set_extra_http_headers({"Cookie": cookie})
-
-            page = context.new_page()
-
-            def on_request(req):
-                try:
-                    u = req.url
-                    if 'byteimg.com' in u or 'byteadapters.cn' in u or 'doubaoimg.com' in u:
-                        collected.append(u)
-                except Exception:
-                    pass
-
-            page.on("request", on_request)
-            page.goto(url, wait_until='networkidle', timeout=30000)
-            time.sleep(2)
-            browser.close()
-
-        # 去重并保序
-        seen = set()
-        ordered = []
-        for u in collected:
-            if u in seen:
-                continue
-            seen.add(u)
-            ordered.append(u)
-        return ordered
-    except ImportError:
-        logger.warning("Playwright未安装，跳过网络抓取")
-        return []
-    except Exception as e:
-        logger.error(f"Playwright网络抓取失败: {str(e)}")
-        return []
+    _, image_urls = render_doubao_page(url, cookie=cookie)
+    return image_urls
+
+
+# 图片可访问性探测：结果按归一化URL短时间缓存，多个候选并发探测
+PROBE_CACHE = ParseCache(
+    max_entries=env_int('PROBE_CACHE_MAX_ENTRIES', 4096),
+    ttl_seconds=env_int('PROBE_CACHE_TTL_SECONDS', 120),
+    stale_seconds=0,
+)
+_probe_executor = ThreadPoolExecutor(max_workers=env_int('PROBE_WORKERS', 8), thread_name_prefix='probe')
 
 
 def _is_url_accessible(url, headers, timeout=12):
     """用最小代价探测URL是否可访问（206/200均算可用）"""
+    cache_key = 'probe:' + _normalize_image_url_for_compare(url)
+    cached, state = PROBE_CACHE.get(cache_key)
+    if state is not None:
+        return cached
     try:
         h = dict(headers or {})
         # Range 可以显著减少带宽，并且很多CDN支持
         h['Range'] = 'bytes=0-0'
-        resp = requests.get(url, headers=h, timeout=timeout, stream=True)
-        return resp.status_code in (200, 206)
+        with observe_stage('probe'):
+            resp = http_get(url, headers=h, timeout=timeout, stream=True)
+            try:
+                accessible = resp.status_code in (200, 206)
+            finally:
+                resp.close()  # 不读取正文，连接直接释放
+    except UpstreamRejected:
+        # 熔断/限流不代表URL不可访问：交给调用方快速失败（503），不要当作不可访问而降级到浏览器渲染
+        raise
     except Exception:
-        return False
-    except Exception as e:
-        logger.error(f"Playwright获取页面失败: {str(e)}")
-        return None
+        return False  # 网络异常不缓存，下次重新探测
+    PROBE_CACHE.set([cache_key], accessible)
+    return accessible
+
+
+def _first_accessible_url(candidates, headers, timeout=12):
+    """
+    并发探测全部候选，按候选顺序返回第一个可访问的URL；都不可访问时返回 None。
+    任一候选被上游保护拒绝时抛出 UpstreamRejected（future.result() 原样抛出）。
+    """
+    unique = []
+    for u in candidates:
+        if u and u not in unique:
+            unique.append(u)
+    if len(unique) == 1:
+        return unique[0] if _is_url_accessible(unique[0], headers, timeout) else None
+    futures = [_probe_executor.submit(_is_url_accessible, u, headers, timeout) for u in unique]
+    for u, future in zip(unique, futures):
+        # 高优先级候选先完成且可访问时立即返回，低优先级的探测在后台完成并写入缓存
+        if future.result():
+            return u
+    return None
 
 
 def _normalize_image_url_for_compare(url):
@@ -532,19 +341,511 @@ def _normalize_image_url_for_compare(url):
         return str(url).strip()
 
 
-def _remove_cover_from_images(images, cover_url):
-    """从图片列表中移除封面图，保持原顺序（移除全部匹配项）。"""
+# 图片内容指纹（URL看不出身份时用）：按归一化URL缓存，同一张图在多次解析之间只取一次
+FINGERPRINT_CACHE = ParseCache(
+    max_entries=env_int('IMAGE_FINGERPRINT_CACHE_MAX_ENTRIES', 4096),
+    ttl_seconds=env_int('IMAGE_FINGERPRINT_TTL_SECONDS', 3600),
+    stale_seconds=0,
+)
+# 一次去重最多对多少个URL取指纹（0 表示只按平台key与URL去重）
+IMAGE_FINGERPRINT_MAX = env_int('IMAGE_FINGERPRINT_MAX', 12)
+
+
+def _image_fingerprint(url, timeout=5):
+    """用 Range 请求读前 FINGERPRINT_BYTES 字节计算内容指纹；失败时返回 None（不缓存）"""
+    cache_key = 'fp:' + _normalize_image_url_for_compare(url)
+    cached, state = FINGERPRINT_CACHE.get(cache_key)
+    if state is not None:
+        return cached
+    try:
+        headers = image_proxy_request_headers(url, '', {})
+        headers['Range'] = 'bytes=0-{}'.format(FINGERPRINT_BYTES - 1)
+        with observe_stage('fingerprint'):
+            resp = http_get(url, headers=headers, timeout=timeout, stream=True)
+            try:
+                fingerprint = content_fingerprint(resp)
+            finally:
+                resp.close()
+    except Exception as e:
+        logger.info("图片指纹获取失败: %s, url=%s", str(e), url)
+        return None
+    if fingerprint is not None:
+        FINGERPRINT_CACHE.set([cache_key], fingerprint)
+    return fingerprint
+
+
+def _image_identity_keys(urls):
+    """
+    每个URL的图片身份key：优先按平台规则（小红书文件token / 豆包对象key），
+    无法判断的URL有两个及以上时并发取内容指纹，其余按归一化URL。
+    """
+    keys = [image_identity_key(u) for u in urls]
+    ambiguous = []
+    for u, key in zip(urls, keys):
+        normalized = _normalize_image_url_for_compare(u)
+        if key is None and normalized not in ambiguous:
+            ambiguous.append(normalized)
+    fingerprints = {}
+    if 2 <= len(ambiguous) <= IMAGE_FINGERPRINT_MAX:
+        by_normalized = {_normalize_image_url_for_compare(u): u for u, key in zip(urls, keys) if key is None}
+        futures = {n: _probe_executor.submit(_image_fingerprint, by_normalized[n]) for n in ambiguous}
+        fingerprints = {n: future.result() for n, future in futures.items()}
+
+    for i, (u, key) in enumerate(zip(urls, keys)):
+        if key is not None:
+            IMAGE_DEDUPE.inc('platform')
+            continue
+        normalized = _normalize_image_url_for_compare(u)
+        if fingerprints.get(normalized):
+            keys[i] = fingerprints[normalized]
+            IMAGE_DEDUPE.inc('fingerprint')
+        else:
+            keys[i] = 'url:' + normalized
+            IMAGE_DEDUPE.inc('url')
+    return keys
+
+
+def _dedupe_images(images, cover_url, prefer=None):
+    """
+    all_images 去重：移除与封面是同一张图的全部URL，其余同一张图只保留一个URL（保持原顺序）。
+    prefer(url) 见 dedupe_images：组内优先保留客户端能加载的那个变体。
+    """
+    images = [u for u in images or [] if u]
     if not images:
         return []
-    cover_key = _normalize_image_url_for_compare(cover_url)
-    if not cover_key:
-        return list(images)
-    filtered = []
-    for u in images:
-        if _normalize_image_url_for_compare(u) == cover_key:
-            continue
-        filtered.append(u)
-    return filtered
+    if not cover_url:
+        keys = _image_identity_keys(images)
+        exclude = ()
+    else:
+        keys = _image_identity_keys([cover_url] + images)
+        exclude, keys = keys[:1], keys[1:]
+    result = dedupe_images(images, keys, exclude, prefer)
+    if len(result) < len(images):
+        IMAGE_DEDUPE.inc('removed', amount=len(images) - len(result))
+    return result
+
+
+class ParseError(Exception):
+    """解析失败（携带返回给前端的HTTP状态码）"""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+
+# 豆包解析分级统计：每一级（static 静态HTML / browser 浏览器渲染）的结果与耗时
+DOUBAO_TIERS = ('static', 'browser')
+_doubao_tier_stats = {tier: {'hit': 0, 'miss': 0, 'error': 0, 'total_ms': 0.0, 'max_ms': 0.0} for tier in DOUBAO_TIERS}
+_doubao_tier_lock = threading.Lock()
+
+
+def _record_doubao_tier(tier, outcome, started):
+    if outcome == 'hit':
+        EXTRACTION_TIER.inc('doubao', tier)
+    elif outcome == 'miss' and tier == DOUBAO_TIERS[-1]:
+        EXTRACTION_TIER.inc('doubao', 'none')
+    elapsed_ms = (time.monotonic() - started) * 1000
+    with _doubao_tier_lock:
+        entry = _doubao_tier_stats[tier]
+        entry[outcome] += 1
+        entry['total_ms'] += elapsed_ms
+        entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+    logger.info("豆包解析[%s]: %s, 耗时%.0fms", tier, outcome, elapsed_ms)
+
+
+def doubao_tier_stats():
+    with _doubao_tier_lock:
+        data = {}
+        for tier, entry in _doubao_tier_stats.items():
+            count = entry['hit'] + entry['miss'] + entry['error']
+            data[tier] = {
+                'hit': entry['hit'],
+                'miss': entry['miss'],
+                'error': entry['error'],
+                'avg_ms': round(entry['total_ms'] / count, 1) if count else 0.0,
+                'max_ms': round(entry['max_ms'], 1),
+            }
+        return data
+
+
+_DOUBAO_PROBE_HEADERS = {'User-Agent': HEADERS['User-Agent'], 'Referer': 'https://www.doubao.com/'}
+
+
+def _is_doubao_watermarked(url):
+    return 'watermark' in (url or '') or '~tplv-' in (url or '')
+
+
+def _build_doubao_result(url, images, no_wm_url, wm_url, image_url):
+    # 豆包的无水印候选是猜出来的（常见 403），小程序只展示带 ~tplv-/watermark 的URL：
+    # 封面只按URL移除（同一张图的水印变体保留），同一张图的多个变体保留水印变体
+    cover_key = _normalize_image_url_for_compare(image_url)
+    candidates = [u for u in images if _normalize_image_url_for_compare(u) != cover_key]
+    filtered_images = _dedupe_images(candidates, None, prefer=_is_doubao_watermarked)
+    logger.info(
+        "豆包解析成功，封面图与重复图片已过滤：原始%d张，过滤后%d张",
+        len(images), len(filtered_images)
+    )
+    return {
+        'image_url': image_url,
+        'all_images': filtered_images,
+        'no_watermark_image_url': no_wm_url,
+        'watermarked_image_url': wm_url,
+        'note_id': None,
+        'target_url': url,
+        'platform': 'doubao'
+    }
+
+
+def _parse_doubao_static(url, cookie=''):
+    """
+    第一级：只用静态HTML。找到真正的无水印候选且可访问时直接返回结果，
+    否则返回 (None, 静态HTML中的图片列表) 交给浏览器渲染这一级。
+    """
+    doubao_headers = dict(DOUBAO_HEADERS)
+    # 可选：允许前端透传 Cookie（部分豆包页面可能需要登录态）
+    if cookie:
+        doubao_headers['Cookie'] = cookie
+
+    fetch_started = time.perf_counter()
+    reader = PageReader(http_get(url, headers=doubao_headers, timeout=8, stream=True))
+    try:
+        html = reader.read_until(DOUBAO_STATE_MARKERS)
+        STAGE_SECONDS.observe(time.perf_counter() - fetch_started, 'fetch_html')
+        logger.info("豆包页面HTML长度: %d（%s）", len(html), '完整' if reader.complete else '读到状态脚本为止')
+        images = extract_doubao_images_from_html(html)
+        if not images and not reader.complete:
+            # 前半段没有提取到图片：继续读完页面再试一次
+            images = extract_doubao_images_from_html(reader.read_rest())
+    finally:
+        reader.close()
+    if not images:
+        return None, images
+
+    no_wm_url, wm_url = pick_best_doubao_image_url(images)
+    if _is_doubao_watermarked(no_wm_url) or not _first_accessible_url([no_wm_url], _DOUBAO_PROBE_HEADERS):
+        return None, images
+    return _build_doubao_result(url, images, no_wm_url, wm_url, no_wm_url), images
+
+
+def _parse_doubao_browser(url, cookie, images):
+    """第二级：Playwright渲染（一次导航同时拿到渲染后HTML和网络请求中的图片URL）"""
+    rendered_html, pw_urls = render_doubao_page(url, cookie=cookie if cookie else None)
+
+    # 如果静态HTML里没有图片，用渲染后的HTML再提取
+    if not images and rendered_html:
+        logger.info("豆包静态HTML未提取到图片，使用Playwright渲染结果")
+        images = extract_doubao_images_from_html(rendered_html)
+
+    # 网络请求中的图片URL优先（常见于“无水印原图”隐藏在请求中）
+    if pw_urls:
+        images = list(pw_urls) + list(images or [])
+    return images
+
+
+def parse_doubao_link(url, cookie=''):
+    """
+    解析豆包链接，返回与 /api/parse 一致的 data 字典。
+    分级解析：静态HTML能拿到可访问的无水印图时直接返回，只有这一级失败才启动浏览器渲染。
+    """
+    logger.info("开始解析豆包链接: %s", url)
+    started = time.monotonic()
+    try:
+        result, images = _parse_doubao_static(url, cookie)
+    except UpstreamRejected:
+        _record_doubao_tier('static', 'error', started)
+        raise
+    except Exception as e:
+        _record_doubao_tier('static', 'error', started)
+        logger.error("解析豆包链接失败: %s", str(e), exc_info=True)
+        raise ParseError(f'解析豆包链接失败: {str(e)}', 500)
+    if result is not None:
+        _record_doubao_tier('static', 'hit', started)
+        return result
+    _record_doubao_tier('static', 'miss', started)
+
+    started = time.monotonic()
+    try:
+        images = _parse_doubao_browser(url, cookie, images)
+    except Exception as e:
+        _record_doubao_tier('browser', 'error', started)
+        logger.error("解析豆包链接失败: %s", str(e), exc_info=True)
+        raise ParseError(f'解析豆包链接失败: {str(e)}', 500)
+
+    if not images:
+        _record_doubao_tier('browser', 'miss', started)
+        raise ParseError(
+            '未在豆包页面中找到图片，可能是页面结构变化/图片为动态加载/需要登录（可在请求体中传 cookie 字段）',
+            404,
+        )
+
+    try:
+        no_wm_url, wm_url = pick_best_doubao_image_url(images)
+
+        # 尝试“可访问性选择”：优先选择可访问的无水印URL；否则回退到可访问的水印URL
+        image_url = _first_accessible_url([no_wm_url, wm_url], _DOUBAO_PROBE_HEADERS)
+        if image_url is None:
+            image_url = no_wm_url or wm_url or images[0]
+
+        result = _build_doubao_result(url, images, no_wm_url, wm_url, image_url)
+    except UpstreamRejected:
+        _record_doubao_tier('browser', 'error', started)
+        raise
+    except Exception as e:
+        _record_doubao_tier('browser', 'error', started)
+        logger.error("解析豆包链接失败: %s", str(e), exc_info=True)
+        raise ParseError(f'解析豆包链接失败: {str(e)}', 500)
+
+    _record_doubao_tier('browser', 'hit', started)
+    return result
+
+
+def _fresh_cache_value(key):
+    cached, state = PARSE_CACHE.get(key)
+    return cached if state == FRESH else None
+
+
+def _fresh_note_cache_hit(note_id):
+    cached = _fresh_cache_value(_note_cache_key(note_id))
+    if cached is not None:
+        logger.info("笔记ID命中解析缓存: %s", note_id)
+    return cached
+
+
+def parse_xhs_link(url):
+    """解析小红书短链/笔记链接，返回与 /api/parse 一致的 data 字典"""
+    # 解析短链获取真实地址（小红书）
+    target_url = resolve_short_link(url)
+
+    # 提取笔记ID
+    note_id = extract_note_id_from_url(target_url)
+    logger.info("提取到笔记ID: %s", note_id)
+
+    # 不同短链可能指向同一篇笔记：按笔记ID再查一次缓存，省掉HTML下载与提取
+    cached = _fresh_note_cache_hit(note_id)
+    if cached is not None:
+        return cached
+
+    # 不同短链指向同一篇笔记的并发请求，只下载/提取一次页面
+    flight_key = _note_cache_key(note_id) or 'page:' + target_url
+    return NOTE_FLIGHT.do(flight_key, lambda: _fetch_xhs_note(target_url, note_id))
+
+
+def _fetch_xhs_note(target_url, note_id):
+    """下载笔记页面并提取图片"""
+    images = []
+
+    # 直接使用HTML提取（API基本都失败，跳过以提升速度）
+    try:
+        logger.info("从HTML提取图片，URL: %s", target_url)
+        fetch_started = time.perf_counter()
+        response = fetch_note_page(target_url)
+        if response.url != target_url:
+            # 笔记页自身又发生了跳转：以最终地址为准（此时正文尚未下载）
+            target_url = response.url
+            note_id = extract_note_id_from_url(target_url) or note_id
+            cached = _fresh_note_cache_hit(note_id)
+            if cached is not None:
+                response.close()
+                return cached
+        # 流式读取：__INITIAL_STATE__ 脚本读完即停止下载，其余HTML不传输也不解码
+        reader = PageReader(response)
+        try:
+            html = reader.read_until(XHS_STATE_MARKERS)
+            STAGE_SECONDS.observe(time.perf_counter() - fetch_started, 'fetch_html')
+            logger.info("获取到HTML，长度: %d（%s）", len(html), '完整' if reader.complete else '读到状态脚本为止')
+
+            images = extract_images_from_html(html)
+            if not images and not reader.complete:
+                images = extract_images_from_html(reader.read_rest())
+        finally:
+            reader.close()
+
+    except UpstreamRejected:
+        raise
+    except Exception as e:
+        logger.error("获取页面失败: %s", str(e), exc_info=True)
+
+    return build_xhs_result(images, target_url, note_id)
+
+
+def build_xhs_result(images, target_url, note_id):
+    """由提取到的图片列表组装小红书解析结果（同步/异步两种服务模式共用）"""
+    if not images:
+        raise ParseError('未找到图片，可能是笔记不存在或需要登录', 404)
+
+    # 返回第一张图片URL作为真实封面；同时为兼容旧前端“按 image_url 删封面”的逻辑，
+    # 将 image_url 设为非图片页面URL，避免前端误删 all_images 的首图。
+    real_cover_image_url = images[0]
+    image_url = target_url
+    filtered_images = _dedupe_images(images, real_cover_image_url)
+
+    logger.info(
+        "解析成功，封面图与重复图片已过滤：原始%d张，过滤后%d张，封面=%s",
+        len(images), len(filtered_images), image_url
+    )
+
+    return {
+        'image_url': image_url,
+        'cover_image_url': real_cover_image_url,
+        'all_images': filtered_images,
+        'note_id': note_id,
+        'target_url': target_url
+    }
+
+
+def upstream_unavailable(e):
+    """上游保护拒绝（熔断/限流）对应的 ParseError：503，不等超时"""
+    logger.warning("上游保护拒绝请求: %s", str(e))
+    return ParseError('上游暂时不可用，请稍后重试', 503)
+
+
+def parse_link(url, cookie=''):
+    """按平台分发解析（不经过缓存）"""
+    try:
+        if 'doubao.com' in url:
+            return parse_doubao_link(url, cookie)
+        return parse_xhs_link(url)
+    except UpstreamRejected as e:
+        raise upstream_unavailable(e)
+
+
+# ---- 解析结果缓存 ----
+PARSE_CACHE = ParseCache(
+    max_entries=env_int('PARSE_CACHE_MAX_ENTRIES', 1024),
+    ttl_seconds=env_int('PARSE_CACHE_TTL_SECONDS', 600),  # 10分钟内视为新鲜
+    stale_seconds=env_int('PARSE_CACHE_STALE_SECONDS', 1800),  # 之后30分钟内先返回旧结果再后台刷新
+    db_path=env_str('PARSE_CACHE_DB'),  # 设置后启用 SQLite 磁盘层（多worker共享、重启不丢）
+)
+
+# ---- 请求合并 ----
+# 链接级：可选跨进程（PARSE_FLIGHT_LOCK_DIR 设置锁文件目录，配合 PARSE_CACHE_DB 使用）
+PARSE_FLIGHT = SingleFlight(
+    lock_dir=env_str('PARSE_FLIGHT_LOCK_DIR'),
+    lock_timeout=env_float('PARSE_FLIGHT_LOCK_TIMEOUT', 30),
+)
+# 笔记级：只在进程内合并（与链接级的文件锁嵌套使用会有跨进程死锁风险）
+NOTE_FLIGHT = SingleFlight()
+
+# ---- 解析调度 ----
+# 小红书走 cheap 通道；豆包（可能启动浏览器渲染）走 expensive 通道，两类任务各自限制并发与排队长度
+PARSE_SCHEDULER = JobScheduler({
+    CHEAP: (env_int('PARSE_CHEAP_WORKERS', 16), env_int('PARSE_CHEAP_QUEUE', 64)),
+    EXPENSIVE: (env_int('PARSE_EXPENSIVE_WORKERS', 4), env_int('PARSE_EXPENSIVE_QUEUE', 8)),
+})
+PARSE_WAIT_SECONDS = env_float('PARSE_WAIT_SECONDS', 60)  # 同步接口等待解析结果的上限
+# 同步接口中同时等待豆包解析的请求数上限：必须小于每个进程的请求线程数（gunicorn threads），
+# 否则一批不同的豆包链接就能占满全部线程，小红书请求排在它们后面
+PARSE_EXPENSIVE_WAITERS = WaiterLimit(
+    env_int('PARSE_EXPENSIVE_SYNC_WAITERS', max(1, env_int('GUNICORN_THREADS', 8) // 2)))
+PARSE_JOBS = JobStore(
+    PARSE_SCHEDULER,
+    max_jobs=env_int('PARSE_JOB_MAX', 1000),
+    ttl_seconds=env_int('PARSE_JOB_TTL_SECONDS', 600),
+)
+PARSE_JOB_MAX_WAIT = env_float('PARSE_JOB_MAX_WAIT', 30)  # 查询异步任务时长轮询的上限（秒）
+
+
+def _canonical_link(url):
+    """短链规范化：忽略协议与host大小写、末尾斜杠"""
+    parsed = urlparse(url)
+    path = parsed.path.rstrip('/') or '/'
+    key = (parsed.hostname or '').lower() + path
+    if parsed.query:
+        key += '?' + parsed.query
+    return key
+
+
+def _note_cache_key(note_id):
+    return 'note:' + note_id if note_id else None
+
+
+def _link_cache_key(url, cookie=''):
+    if 'doubao.com' in url:
+        key = 'doubao:' + _canonical_link(url)
+        if cookie:
+            # 带登录态的结果单独缓存，避免不同用户互相看到对方 Cookie 下的结果
+            key += '#' + hashlib.sha1(cookie.encode('utf-8')).hexdigest()[:16]
+        return key
+    return 'link:' + _canonical_link(url)
+
+
+def _result_cache_keys(data):
+    """解析结果额外挂载的key（小红书按笔记ID）"""
+    return [_note_cache_key(data.get('note_id'))]
+
+
+def parse_lane(url):
+    return EXPENSIVE if 'doubao.com' in url else CHEAP
+
+
+def _parse_and_store(url, cookie, key):
+    """在调度通道中执行：解析并写入缓存"""
+    data = parse_link(url, cookie)
+    PARSE_CACHE.set([key] + _result_cache_keys(data), data)
+    return data
+
+
+def submit_parse(url, cookie, key):
+    """把解析提交到对应通道，返回 Future；排队已满时抛 503 的 ParseError"""
+    try:
+        return PARSE_SCHEDULER.submit(parse_lane(url), _parse_and_store, url, cookie, key)
+    except SchedulerBusy as e:
+        logger.warning("解析排队已满，拒绝请求: %s", str(e))
+        raise ParseError('服务繁忙，请稍后重试（或使用 /api/parse_jobs 异步解析）', 503)
+
+
+def refresh_parse(url, cookie, key):
+    """后台刷新过期结果：同样提交到调度通道，受通道并发与排队上限约束"""
+    PARSE_CACHE.refresh_async(
+        key, lambda: submit_parse(url, cookie, key).result(timeout=PARSE_WAIT_SECONDS), _result_cache_keys)
+
+
+def parse_link_cached(url, cookie='', timeout=None, waiters=PARSE_EXPENSIVE_WAITERS):
+    """
+    带缓存的解析：新鲜结果直接返回；过期结果先返回并后台刷新；未命中则同步解析后写入缓存。
+    timeout 为等待解析结果的上限（默认 PARSE_WAIT_SECONDS），超时抛 504 的 ParseError。
+    豆包链接的同步等待占用 waiters 名额，名额用完时返回 503（提示改用 /api/parse_jobs）；
+    waiters=None 表示调用方已自行限制并发（如批量解析的线程池），不占名额。
+    """
+    key = _link_cache_key(url, cookie)
+    cached, state = PARSE_CACHE.get(key)
+    if state == FRESH:
+        logger.info("解析缓存命中: %s", key)
+        return cached
+    if state == STALE:
+        logger.info("解析缓存过期，先返回旧结果并后台刷新: %s", key)
+        refresh_parse(url, cookie, key)
+        return cached
+
+    wait = timeout or PARSE_WAIT_SECONDS
+    deadline = time.monotonic() + wait
+
+    def compute():
+        try:
+            # 等待跨进程锁的时间也计入本次请求的等待上限
+            return submit_parse(url, cookie, key).result(timeout=max(0.0, deadline - time.monotonic()))
+        except FuturesTimeoutError:
+            # 任务继续执行，完成后照常写入缓存，稍后重试即可命中
+            raise ParseError('解析超时，请稍后重试', 504)
+
+    def run():
+        # 相同链接的并发请求合并为一次解析；跨进程时拿到锁后先复查缓存（其他 worker 可能刚算完）。
+        # 合并到别人的解析上时同样只等 wait 秒，不跟着对方的等待上限走
+        try:
+            return PARSE_FLIGHT.do(key, compute, recheck=lambda: _fresh_cache_value(key), timeout=wait)
+        except FlightTimeout:
+            raise ParseError('解析超时，请稍后重试', 504)
+
+    if waiters is None or parse_lane(url) != EXPENSIVE:
+        return run()
+    # 合并后等待同一结果的请求同样占着线程，因此在合并之前占用名额
+    if not waiters.try_acquire():
+        logger.warning("同步等待豆包解析的请求数已达上限，拒绝请求: %s", key)
+        raise ParseError('服务繁忙，请使用 /api/parse_jobs 异步解析或稍后重试', 503)
+    try:
+        return run()
+    finally:
+        waiters.release()
 
 
 @app.route('/api/parse', methods=['POST'])
@@ -561,210 +862,737 @@ def parse_short_link():
             }), 400
         
         # 从文本中提取URL
-        url = extract_url_from_text(short_link)
+        with observe_stage('extract_url'):
+            url = extract_url_from_text(short_link)
         if not url:
             return jsonify({
                 'success': False,
                 'error': '未找到有效的短链URL'
             }), 400
         
-        logger.info(f"提取到URL: {url}")
+        logger.info("提取到URL: %s", url)
+
+        # 可选：允许前端透传 Cookie（部分豆包页面可能需要登录态）
+        cookie = (data.get('cookie') or '').strip() if isinstance(data, dict) else ''
 
-        # 如果是豆包链接，走豆包解析逻辑（无需解析成小红书笔记）
-        if 'doubao.com' in url:
-            try:
-                logger.info(f"开始解析豆包链接: {url}")
-                doubao_headers = dict(DOUBAO_HEADERS)
-                # 可选：允许前端透传 Cookie（部分豆包页面可能需要登录态）
-                cookie = (data.get('cookie') or '').strip() if isinstance(data, dict) else ''
-                if cookie:
-                    doubao_headers['Cookie'] = cookie
-
-                resp = requests.get(url, headers=doubao_headers, timeout=8)
-                html = resp.text
-                logger.info(f"豆包页面HTML长度: {len(html)}")
-
-                images = extract_doubao_images_from_html(html)
-
-                # 兜底：如果静态HTML里没有图片，尝试用 Playwright 渲染后再提取
-                if not images:
-                    logger.info("豆包静态HTML未提取到图片，尝试Playwright渲染兜底")
-                    rendered_html = fetch_page_with_playwright(url)
-                    if rendered_html:
-                        images = extract_doubao_images_from_html(rendered_html)
-
-                # 进一步兜底：通过Playwright抓取网络请求中的图片URL（常见于“无水印原图”隐藏在请求中）
-                pw_urls = fetch_doubao_image_urls_with_playwright(url, cookie=cookie if cookie else None)
-                if pw_urls:
-                    images = list(pw_urls) + list(images or [])
-
-                if not images:
-                    return jsonify({
-                        'success': False,
-                        'error': '未在豆包页面中找到图片，可能是页面结构变化/图片为动态加载/需要登录（可在请求体中传 cookie 字段）'
-                    }), 404
-
-                no_wm_url, wm_url = pick_best_doubao_image_url(images)
-
-                # 尝试“可访问性选择”：优先选择可访问的无水印URL；否则回退到可访问的水印URL
-                image_url = None
-                if no_wm_url and _is_url_accessible(no_wm_url, headers={'User-Agent': HEADERS['User-Agent'], 'Referer': 'https://www.doubao.com/'}):
-                    image_url = no_wm_url
-                elif wm_url and _is_url_accessible(wm_url, headers={'User-Agent': HEADERS['User-Agent'], 'Referer': 'https://www.doubao.com/'}):
-                    image_url = wm_url
-                else:
-                    image_url = no_wm_url or wm_url or images[0]
-
-                filtered_images = _remove_cover_from_images(images, image_url)
-                logger.info(
-                    "豆包解析成功，封面图已过滤：原始%d张，过滤后%d张",
-                    len(images), len(filtered_images)
-                )
-
-                return jsonify({
-                    'success': True,
-                    'data': {
-                        'image_url': image_url,
-                        'all_images': filtered_images,
-                        'no_watermark_image_url': no_wm_url,
-                        'watermarked_image_url': wm_url,
-                        'note_id': None,
-                        'target_url': url,
-                        'platform': 'doubao'
-                    }
-                })
-            except Exception as e:
-                logger.error(f"解析豆包链接失败: {str(e)}", exc_info=True)
-                return jsonify({
-                    'success': False,
-                    'error': f'解析豆包链接失败: {str(e)}'
-                }), 500
-        
-        # 解析短链获取真实地址（小红书）
-        target_url = resolve_short_link(url)
-        
-        # 提取笔记ID
-        note_id = extract_note_id_from_url(target_url)
-        logger.info(f"提取到笔记ID: {note_id}")
-        
-        images = []
-        
-        # 直接使用HTML提取（API基本都失败，跳过以提升速度）
         try:
-            logger.info(f"从HTML提取图片，URL: {target_url}")
-            response = requests.get(target_url, headers=HEADERS, timeout=8)  # 减少超时时间
-            html = response.text
-            logger.info(f"获取到HTML，长度: {len(html)}")
-            
-            images = extract_images_from_html(html)
-            
-        except Exception as e:
-            logger.error(f"获取页面失败: {str(e)}", exc_info=True)
-        
-        if not images:
+            result = parse_link_cached(url, cookie)
+        except ParseError as e:
             return jsonify({
                 'success': False,
-                'error': '未找到图片，可能是笔记不存在或需要登录'
-            }), 404
-        
-        # 返回第一张图片URL作为真实封面；同时为兼容旧前端“按 image_url 删封面”的逻辑，
-        # 将 image_url 设为非图片页面URL，避免前端误删 all_images 的首图。
-        real_cover_image_url = images[0]
-        image_url = target_url
-        filtered_images = _remove_cover_from_images(images, real_cover_image_url)
-        
-        logger.info(
-            "解析成功，封面图已过滤：原始%d张，过滤后%d张，封面=%s",
-            len(images), len(filtered_images), image_url
-        )
-        
+                'error': str(e)
+            }), e.status
+
+        prefetch_images(result, cookie)
         return jsonify({
             'success': True,
-            'data': {
-                'image_url': image_url,
-                'cover_image_url': real_cover_image_url,
-                'all_images': filtered_images,
-                'note_id': note_id,
-                'target_url': target_url
-            }
+            'data': result
         })
         
     except Exception as e:
-        logger.error(f"解析失败: {str(e)}", exc_info=True)
+        logger.error("解析失败: %s", str(e), exc_info=True)
         return jsonify({
             'success': False,
             'error': f'解析失败: {str(e)}'
         }), 500
 
 
+def _run_parse_job(url, cookie, key):
+    """异步任务：排队期间可能已被其他请求解析过，先复查缓存"""
+    data = _fresh_cache_value(key)
+    if data is None:
+        data = _parse_and_store(url, cookie, key)
+    prefetch_images(data, cookie)
+    return data
+
+
+def _job_view(job):
+    view = {'job_id': job.id, 'status': job.status(), 'lane': job.lane}
+    if view['status'] == 'done':
+        view['result'] = job.future.result()
+    elif view['status'] == 'failed':
+        e = job.future.exception()
+        if isinstance(e, ParseError):
+            view.update({'error': str(e), 'error_status': e.status})
+        else:
+            view.update({'error': f'解析失败: {str(e)}', 'error_status': 500})
+    return view
+
+
+@app.route('/api/parse_jobs', methods=['POST'])
+def create_parse_job():
+    """
+    异步解析：请求体与 /api/parse 相同，立即返回任务（202）；
+    之后 GET /api/parse_jobs/<job_id>?wait=秒 查询，status 为 queued/running/done/failed。
+    解析缓存命中时直接返回已完成的任务；同一链接未完成时重复提交返回同一个任务。
+    """
+    data = request.get_json(silent=True) or {}
+    url = extract_url_from_text(str(data.get('short_link') or '').strip())
+    if not url:
+        return jsonify({'success': False, 'error': '未找到有效的短链URL'}), 400
+    cookie = (data.get('cookie') or '').strip()
+    key = _link_cache_key(url, cookie)
+
+    try:
+        cached, state = PARSE_CACHE.get(key)
+        if state == STALE:
+            refresh_parse(url, cookie, key)
+        if state in (FRESH, STALE):
+            job = PARSE_JOBS.add_completed(key, parse_lane(url), cached)
+        else:
+            job = PARSE_JOBS.submit(key, parse_lane(url), _run_parse_job, url, cookie, key)
+    except SchedulerBusy as e:
+        logger.warning("异步解析排队已满，拒绝请求: %s", str(e))
+        return jsonify({'success': False, 'error': '服务繁忙，请稍后重试'}), 503
+    return jsonify({'success': True, 'data': _job_view(job)}), 202
+
+
+@app.route('/api/parse_jobs/<job_id>', methods=['GET'])
+def get_parse_job(job_id):
+    """查询异步解析任务；wait=秒 时最多等待这么久（长轮询，上限 PARSE_JOB_MAX_WAIT）"""
+    job = PARSE_JOBS.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不存在或已过期'}), 404
+    try:
+        wait = min(max(float(request.args.get('wait') or 0), 0.0), PARSE_JOB_MAX_WAIT)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'wait 必须是数字'}), 400
+    if wait:
+        PARSE_JOBS.wait(job, wait)
+    return jsonify({'success': True, 'data': _job_view(job)})
+
+
+# ---- 批量解析 ----
+PARSE_BATCH_MAX_ITEMS = env_int('PARSE_BATCH_MAX_ITEMS', 20)
+PARSE_BATCH_WORKERS = env_int('PARSE_BATCH_WORKERS', 16)
+PARSE_BATCH_PER_HOST = env_int('PARSE_BATCH_PER_HOST', 4)  # 同一站点分组同时进行的解析数
+PARSE_BATCH_ITEM_TIMEOUT = env_float('PARSE_BATCH_ITEM_TIMEOUT', 20)
+
+_batch_executor = ThreadPoolExecutor(max_workers=PARSE_BATCH_WORKERS, thread_name_prefix='parse-batch')
+_batch_host_slots = {}  # host_group -> Semaphore
+_batch_host_slots_lock = threading.Lock()
+
+
+def _batch_host_slot(url):
+    group = host_group(url)
+    with _batch_host_slots_lock:
+        slot = _batch_host_slots.get(group)
+        if slot is None:
+            slot = threading.BoundedSemaphore(PARSE_BATCH_PER_HOST)
+            _batch_host_slots[group] = slot
+        return slot
+
+
+def _acquire_batch_slot(slot, cancelled):
+    """等待站点分组名额；批量请求已取消（客户端断开）时放弃并返回 False"""
+    while not slot.acquire(timeout=0.5):
+        if cancelled.is_set():
+            return False
+    if cancelled.is_set():
+        slot.release()
+        return False
+    return True
+
+
+def _parse_batch_item(index, text, cookie, cancelled, timeout):
+    """批量解析中的单条：提取URL -> 等待站点名额 -> 解析（带缓存），返回结果行"""
+    item = {'index': index, 'input': text}
+    url = extract_url_from_text(text)
+    if not url:
+        item.update({'success': False, 'status': 400, 'error': '未找到有效的短链URL'})
+        return item
+    slot = _batch_host_slot(url)
+    if not _acquire_batch_slot(slot, cancelled):
+        item.update({'success': False, 'status': 499, 'error': '批量请求已取消'})
+        return item
+    try:
+        # 单条超时从拿到名额开始计时：排在同站点其他条目后面等待的时间不算在内
+        item.update({'success': True, 'status': 200, 'data': parse_link_cached(url, cookie, timeout=timeout, waiters=None)})
+        prefetch_images(item['data'], cookie)
+    except ParseError as e:
+        item.update({'success': False, 'status': e.status, 'error': str(e)})
+    except Exception as e:
+        logger.error("批量解析单条失败: index=%s, error=%s", index, str(e))
+        item.update({'success': False, 'status': 500, 'error': f'解析失败: {str(e)}'})
+    finally:
+        slot.release()
+    return item
+
+
+def iter_parse_batch(texts, cookie='', timeout=PARSE_BATCH_ITEM_TIMEOUT):
+    """
+    并发解析多条链接，按完成先后依次产出结果行。每条最多等待 timeout 秒（从拿到站点名额开始），
+    超时产出 504 错误行，解析任务在调度通道中继续执行并写入缓存。
+    调用方提前关闭生成器（客户端断开）时，尚未开始的条目被取消，正在等待名额的条目直接放弃。
+    """
+    cancelled = threading.Event()
+    futures = [
+        _batch_executor.submit(_parse_batch_item, i, text, cookie, cancelled, timeout)
+        for i, text in enumerate(texts)
+    ]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        cancelled.set()
+        for future in futures:
+            future.cancel()
+
+
+@app.route('/api/parse_batch', methods=['POST'])
+def parse_batch():
+    """
+    批量解析API：请求体 {"links": [分享文本或链接, ...], "cookie": 可选, "stream": 可选}
+    stream 为 true（或 Accept: application/x-ndjson）时按完成顺序逐行返回 NDJSON，
+    否则等全部完成后按输入顺序返回 JSON 数组。
+    """
+    data = request.get_json(silent=True) or {}
+    links = data.get('links')
+    if not isinstance(links, list) or not links:
+        return jsonify({'success': False, 'error': 'links 必须是非空数组'}), 400
+    if len(links) > PARSE_BATCH_MAX_ITEMS:
+        return jsonify({'success': False, 'error': f'单次最多解析 {PARSE_BATCH_MAX_ITEMS} 条'}), 400
+
+    texts = [str(x or '').strip() for x in links]
+    cookie = (data.get('cookie') or '').strip()
+    stream = bool(data.get('stream')) or 'application/x-ndjson' in request.headers.get('Accept', '')
+    logger.info("批量解析: %d 条, stream=%s", len(texts), stream)
+
+    if stream:
+        def generate():
+            for item in iter_parse_batch(texts, cookie):
+                yield json.dumps(item, ensure_ascii=False) + '\n'
+
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    results = sorted(iter_parse_batch(texts, cookie), key=lambda item: item['index'])
+    return jsonify({'success': True, 'data': results})
+
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """运行时统计（缓存命中率等）"""
+    return jsonify({
+        'success': True,
+        'data': {
+            'parse_cache': PARSE_CACHE.stats(),
+            'redirect_cache': REDIRECT_CACHE.stats(),
+            'probe_cache': PROBE_CACHE.stats(),
+            'fingerprint_cache': FINGERPRINT_CACHE.stats(),
+            'cookie_sessions': COOKIE_SESSIONS.stats(),
+            'parse_flight': PARSE_FLIGHT.stats(),
+            'note_flight': NOTE_FLIGHT.stats(),
+            'parse_scheduler': PARSE_SCHEDULER.stats(),
+            'parse_sync_waiters': PARSE_EXPENSIVE_WAITERS.stats(),
+            'parse_jobs': PARSE_JOBS.stats(),
+            'image_cache': IMAGE_CACHE.stats() if IMAGE_CACHE is not None else None,
+            'image_prefetch': IMAGE_PREFETCHER.stats() if IMAGE_PREFETCHER is not None else None,
+            'browser_pool': browser_pool_stats(),
+            'upstream': guard_stats(),
+            'image_hedge': IMAGE_HEDGER.stats() if IMAGE_HEDGER is not None else None,
+            'doubao_tiers': doubao_tier_stats(),
+        }
+    })
+
+
+# 图片代理：按块透传，避免把整张大图读进内存后再返回
+IMAGE_PROXY_CHUNK_SIZE = 64 * 1024
+# 透传给上游的客户端请求头（支持断点续传/条件请求）
+_PROXY_FORWARD_REQUEST_HEADERS = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since')
+# 回传给客户端的上游响应头
+_PROXY_FORWARD_RESPONSE_HEADERS = (
+    'Content-Length', 'Content-Range', 'Accept-Ranges',
+    'ETag', 'Last-Modified', 'Cache-Control', 'Expires',
+)
+
+
+def _stream_upstream_body(resp, chunk_size=IMAGE_PROXY_CHUNK_SIZE):
+    """逐块转发上游响应体；结束或客户端断开时关闭上游连接"""
+    try:
+        with observe_stage('proxy_transfer'):
+            for chunk in resp.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    yield chunk
+    finally:
+        resp.close()
+
+
+def _proxy_cookie(sid, cookie_param):
+    """image_proxy 使用的 Cookie：优先按 sid 取后端保存的 Cookie（并续期），否则用 URL 里的 cookie 参数"""
+    sid = (sid or '').strip()
+    if sid:
+        cookie = COOKIE_SESSIONS.get(sid)  # 命中即续期
+        if cookie is not None:
+            return cookie.strip()
+    # 兼容旧用法（不推荐）：cookie 放URL里可能被截断
+    return _html.unescape((cookie_param or '').strip()).strip()
+
+
+def image_proxy_request_headers(url, cookie, client_headers):
+    """构造请求图片上游的请求头：按来源伪装 Referer，并透传客户端的 Range/条件请求头"""
+    # 根据来源做简单的Header伪装
+    headers = {
+        'User-Agent': HEADERS['User-Agent'],
+        'Accept': 'image/avif,image/webp,image/apng,image/*,*/*;q=0.8',
+        # 不接受压缩编码，保证转发的 Content-Length 与实际字节数一致
+        'Accept-Encoding': 'identity',
+        'Referer': 'https://www.doubao.com/' if 'byteimg.com' in url or 'doubao' in url else HEADERS.get('Referer', ''),
+    }
+    if cookie:
+        headers['Cookie'] = cookie
+    for name in _PROXY_FORWARD_REQUEST_HEADERS:
+        value = client_headers.get(name)
+        if value:
+            headers[name] = value
+    return headers
+
+
+# ---- 图片对冲请求 ----
+# 可选：IMAGE_HEDGE=1 时，小红书图片的完整下载在近期 p95 内未返回时向等价host再发一个请求，先到先用
+IMAGE_HEDGER = ImageHedger(
+    [h.strip() for h in env_str('IMAGE_HEDGE_HOSTS', 'sns-img-qc.xhscdn.com,sns-img-bd.xhscdn.com,ci.xiaohongshu.com')
+     .split(',') if h.strip()],
+    ratio=env_float('IMAGE_HEDGE_RATIO', 0.05),  # 对冲带来的额外请求比例上限
+    default_delay=env_float('IMAGE_HEDGE_DELAY', 0.3),  # 样本不足时的对冲延迟（秒）
+) if env_bool('IMAGE_HEDGE') else None
+
+
+def fetch_image(url, headers, timeout=15):
+    """请求图片上游（stream=True，只收响应头）；启用对冲时小红书图片走对冲请求"""
+    def fetch(target, target_headers):
+        return http_get(target, headers=target_headers, timeout=timeout, stream=True)
+
+    if IMAGE_HEDGER is None:
+        return fetch(url, headers)
+    return IMAGE_HEDGER.get(fetch, url, headers)
+
+
+def image_proxy_response_headers(upstream_headers):
+    """挑出需要回传给客户端的上游响应头"""
+    out_headers = {}
+    for name in _PROXY_FORWARD_RESPONSE_HEADERS:
+        value = upstream_headers.get(name)
+        if value:
+            out_headers[name] = value
+    return out_headers
+
+
+# 图片磁盘缓存：设置 IMAGE_CACHE_DIR 后启用
+IMAGE_CACHE_DIR = env_str('IMAGE_CACHE_DIR', '')
+IMAGE_CACHE = ImageCache(
+    IMAGE_CACHE_DIR,
+    max_bytes=env_int('IMAGE_CACHE_MAX_MB', 512) * 1024 * 1024,
+    max_entry_bytes=env_int('IMAGE_CACHE_MAX_ENTRY_MB', 20) * 1024 * 1024,
+    sweep_interval=env_int('IMAGE_CACHE_SWEEP_SECONDS', 30),
+) if IMAGE_CACHE_DIR else None
+
+
+def _fill_image_cache(url, cookie, writer):
+    """回源下载完整图片写入缓存；非200/非图片/超过单文件上限时返回 None（不缓存）"""
+    # 回源时不带客户端的 Range/条件请求头，缓存的始终是完整图片
+    headers = image_proxy_request_headers(url, cookie, {})
+    resp = fetch_image(url, headers)
+    try:
+        if not _cacheable_image(resp):
+            return None
+        for chunk in resp.iter_content(chunk_size=IMAGE_PROXY_CHUNK_SIZE):
+            if chunk:
+                writer.write(chunk)
+        return resp.headers.get('Content-Type', 'image/jpeg'), resp.headers.get('ETag'), resp.headers.get('Last-Modified')
+    finally:
+        resp.close()
+
+
+def _cacheable_image(resp):
+    """上游响应能否写入图片缓存：200、图片类型、声明的长度不超过单文件上限"""
+    if resp.status_code != 200 or not resp.headers.get('Content-Type', 'image/jpeg').startswith('image/'):
+        return False
+    length = resp.headers.get('Content-Length')
+    return not (length and length.isdigit() and int(length) > IMAGE_CACHE.max_entry_bytes)
+
+
+def _tee_upstream_body(resp, cache_fill, chunk_size=IMAGE_PROXY_CHUNK_SIZE):
+    """逐块转发上游响应体并同时写入图片缓存；读完整个响应才提交缓存，客户端中途断开则丢弃"""
+    try:
+        with observe_stage('proxy_transfer'):
+            for chunk in resp.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    cache_fill.write(chunk)
+                    yield chunk
+        cache_fill.commit(
+            resp.headers.get('Content-Type', 'image/jpeg'), resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+    finally:
+        cache_fill.abort()
+        resp.close()
+
+
+# ---- 后台图片预取 ----
+# 可选：IMAGE_PREFETCH=1 且启用了 IMAGE_CACHE_DIR 时，解析成功后在后台把笔记图片拉进磁盘缓存
+IMAGE_PREFETCHER = ImagePrefetcher(
+    IMAGE_CACHE,
+    _fill_image_cache,
+    load=HTTP_REQUESTS_IN_FLIGHT.value,
+    workers=env_int('IMAGE_PREFETCH_WORKERS', 4),
+    max_pending=env_int('IMAGE_PREFETCH_QUEUE', 64),
+    busy_requests=env_int('IMAGE_PREFETCH_BUSY_REQUESTS', 16),  # 正在处理的请求数达到该值时暂停预取
+    max_images=env_int('IMAGE_PREFETCH_MAX_IMAGES', 20),
+) if IMAGE_CACHE is not None and env_bool('IMAGE_PREFETCH') else None
+
+
+def prefetch_images(data, cookie=''):
+    """解析成功后调用：按展示顺序把图片提交给后台预取（未启用时什么都不做）"""
+    if IMAGE_PREFETCHER is not None:
+        IMAGE_PREFETCHER.submit(export_image_urls(data), cookie)
+
+
+def _cached_image_response(entry):
+    """从缓存文件返回图片：send_file 走 wsgi.file_wrapper（sendfile），并处理 Range/If-None-Match 等"""
+    return send_file(entry.path, mimetype=entry.content_type, conditional=True, etag=True)
+
+
+def _fetch_image_source(url, cookie, max_mb):
+    """
+    取得完整原图字节（用于转码、打包）：启用磁盘缓存时经过缓存，否则直接下载；
+    失败或超过 max_mb 上限时返回 None。
+    """
+    limit = max_mb * 1024 * 1024
+    if IMAGE_CACHE is not None:
+        entry = IMAGE_CACHE.get_or_fill(
+            image_cache_key(url, cookie),
+            lambda writer: _fill_image_cache(url, cookie, writer),
+        )
+        if entry is not None:
+            if entry.size > limit:
+                return None
+            with open(entry.path, 'rb') as f:
+                return f.read()
+
+    resp = fetch_image(url, image_proxy_request_headers(url, cookie, {}))
+    try:
+        if resp.status_code != 200:
+            return None
+        chunks = []
+        total = 0
+        for chunk in resp.iter_content(chunk_size=IMAGE_PROXY_CHUNK_SIZE):
+            total += len(chunk)
+            if total > limit:
+                return None
+            chunks.append(chunk)
+        return b''.join(chunks)
+    finally:
+        resp.close()
+
+
+def _transcode_image(url, cookie, params):
+    """下载原图并在进程池中缩放/转码，返回 (bytes, mimetype)；取不到原图时返回 None"""
+    data = _fetch_image_source(url, cookie, IMAGE_TRANSCODE_MAX_SOURCE_MB)
+    if data is None:
+        return None
+    return transcode_in_pool(data, params)
+
+
+def _transcoded_image_response(url, cookie, params):
+    """缩略图/转码响应；转码结果同样写入磁盘缓存。失败时返回 None，由调用方回退为原图透传"""
+    if IMAGE_CACHE is not None:
+        def fill(writer):
+            out = _transcode_image(url, cookie, params)
+            if out is None:
+                return None
+            writer.write(out[0])
+            return out[1], None, None
+
+        entry = IMAGE_CACHE.get_or_fill(image_cache_key(url, cookie, params.variant), fill)
+        return _cached_image_response(entry) if entry is not None else None
+
+    try:
+        out = _transcode_image(url, cookie, params)
+    except Exception as e:
+        logger.warning("图片转码失败，回退为原图: %s, url=%s", str(e), url)
+        return None
+    if out is None:
+        return None
+    resp = Response(out[0], mimetype=out[1])
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+
 @app.route('/api/image_proxy', methods=['GET'])
 def image_proxy():
     """
     简单的图片代理接口：后端代为请求目标图片URL并将二进制内容转发给小程序。
     用途：解决小程序直接请求第三方图片域名出现403/域名不在白名单的问题。
     使用方式：<image src=\"http://你的后端/api/image_proxy?url=ENCODED_URL\" />
+    响应体按块流式转发；支持 Range（206）与 ETag/Last-Modified 条件请求（304）。
+    启用 IMAGE_CACHE_DIR 后，完整图片缓存到本地磁盘，命中时直接从文件返回。
+    可选 w=宽度 / q=质量 / fmt=webp|jpeg 返回缩略图或转码结果（需要 Pillow，未安装时返回原图）。
     """
-    _cleanup_cookie_sessions()
     url = request.args.get('url', '').strip()
     if not url:
         return jsonify({'success': False, 'error': 'url 参数不能为空'}), 400
 
+    resp = None
+    cache_fill = None
     try:
         # 前端 encodeURIComponent + HTML实体可能导致签名参数被破坏，这里做一次实体反解码
         url = _html.unescape(url).strip()
-        sid = request.args.get('sid', '').strip()
-        cookie = ''
-        if sid and sid in COOKIE_SESSIONS:
-            cookie = (COOKIE_SESSIONS.get(sid, {}).get('cookie') or '').strip()
-            COOKIE_SESSIONS[sid]['ts'] = time.time()  # 续期
-        else:
-            # 兼容旧用法（不推荐）：cookie 放URL里可能被截断
-            cookie = request.args.get('cookie', '').strip()
-            cookie = _html.unescape(cookie).strip()
-
-        # 根据来源做简单的Header伪装
-        headers = {
-            'User-Agent': HEADERS['User-Agent'],
-            'Accept': 'image/avif,image/webp,image/apng,image/*,*/*;q=0.8',
-            'Referer': 'https://www.doubao.com/' if 'byteimg.com' in url or 'doubao' in url else HEADERS.get('Referer', ''),
-        }
-        if cookie:
-            headers['Cookie'] = cookie
-        resp = requests.get(url, headers=headers, timeout=15, stream=True)
+        cookie = _proxy_cookie(request.args.get('sid', ''), request.args.get('cookie', ''))
+
+        try:
+            transcode_params = parse_transcode_params(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        if transcode_params is not None and transcode_available():
+            transcoded = _transcoded_image_response(url, cookie, transcode_params)
+            if transcoded is not None:
+                return transcoded
+
+        if IMAGE_CACHE is not None:
+            key = image_cache_key(url, cookie)
+            entry = None
+            if not any(request.headers.get(name) for name in _PROXY_FORWARD_REQUEST_HEADERS):
+                # 普通 GET 未命中时自己回源，边转发边写入缓存，客户端不必等整张图下载完；
+                # 其他请求正在回源时等它写完，从文件返回
+                entry = IMAGE_CACHE.get(key)
+                if entry is None:
+                    cache_fill = IMAGE_CACHE.begin_fill(key)
+            if entry is None and cache_fill is None:
+                entry = IMAGE_CACHE.get_or_fill(key, lambda writer: _fill_image_cache(url, cookie, writer))
+            if entry is not None:
+                return _cached_image_response(entry)
+
+        headers = image_proxy_request_headers(url, cookie, request.headers)
+
+        resp = fetch_image(url, headers)
         content_type = resp.headers.get('Content-Type', 'image/jpeg')
         status = resp.status_code
+        if cache_fill is not None and not _cacheable_image(resp):
+            # 不可缓存的响应照常转发，不再为缓存另发请求
+            cache_fill.abort()
+            cache_fill = None
 
-        if status != 200:
+        if status not in (200, 206, 304):
+            resp.close()
             logger.warning("图片代理请求失败，status=%s, url=%s", status, url)
             return jsonify({'success': False, 'error': '图片请求失败，状态码 {}'.format(status)}), status
 
-        return Response(resp.content, mimetype=content_type)
+        out_headers = image_proxy_response_headers(resp.headers)
+
+        if status == 304:
+            resp.close()
+            return Response(status=304, headers=out_headers)
+
+        if cache_fill is None:
+            return Response(
+                _stream_upstream_body(resp),
+                status=status,
+                mimetype=content_type,
+                headers=out_headers,
+                direct_passthrough=True,
+            )
+        response = Response(
+            _tee_upstream_body(resp, cache_fill),
+            status=status,
+            mimetype=content_type,
+            headers=out_headers,
+            direct_passthrough=True,
+        )
+        # 响应体一块都没被读取就关闭时（生成器的 finally 不会执行），也要释放回源名额
+        response.call_on_close(cache_fill.abort)
+        return response
+    except UpstreamRejected as e:
+        if cache_fill is not None:
+            cache_fill.abort()
+        logger.warning("图片代理被上游保护拒绝: %s, url=%s", str(e), url)
+        return jsonify({'success': False, 'error': '图片上游暂时不可用，请稍后重试'}), 503
     except Exception as e:
+        if cache_fill is not None:
+            cache_fill.abort()
+        if resp is not None:
+            resp.close()
         logger.error("图片代理异常: %s", str(e), exc_info=True)
         return jsonify({'success': False, 'error': '图片代理异常: {}'.format(str(e))}), 500
 
 
+# ---- 打包下载 ----
+EXPORT_MAX_IMAGES = env_int('EXPORT_MAX_IMAGES', 50)
+_export_executor = ThreadPoolExecutor(max_workers=env_int('EXPORT_WORKERS', 16), thread_name_prefix='export')
+# 每个打包请求同时下载的图片数：内存中最多保留这么多张已下载、尚未写入归档的图片
+EXPORT_CONCURRENCY = max(1, env_int('EXPORT_CONCURRENCY', 4))
+EXPORT_MAX_IMAGE_MB = env_int('EXPORT_MAX_IMAGE_MB', 30)  # 单张图片上限，超过的写入 failed.txt
+
+
+def export_image_urls(data):
+    """解析结果中需要打包的全部图片：封面在前，其后是 all_images（已去掉封面）"""
+    cover = data.get('cover_image_url')
+    if not cover and data.get('platform') == 'doubao':
+        cover = data.get('image_url')
+    urls = []
+    for u in [cover] + list(data.get('all_images') or []):
+        if u and u not in urls:
+            urls.append(u)
+    return urls
+
+
+def _export_entries(urls, cookie):
+    """
+    并发下载图片，按下载完成的顺序产出 (文件名, bytes)；文件名保持原顺序编号，失败的URL写入 failed.txt。
+    同时最多 EXPORT_CONCURRENCY 个下载，上一张被取走写入归档后才提交下一张，已产出的图片不再被引用。
+    """
+    pending = {}  # Future -> 序号
+    next_index = 0
+    failed = []
+    try:
+        while pending or next_index < len(urls):
+            while next_index < len(urls) and len(pending) < EXPORT_CONCURRENCY:
+                pending[_export_executor.submit(
+                    _fetch_image_source, urls[next_index], cookie, EXPORT_MAX_IMAGE_MB)] = next_index
+                next_index += 1
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            future = next(iter(done))
+            done = None
+            index = pending.pop(future)
+            try:
+                data = future.result()
+            except Exception as e:
+                logger.warning("打包下载图片失败: %s, url=%s", str(e), urls[index])
+                data = None
+            future = None
+            if not data:
+                failed.append(urls[index])
+                continue
+            yield '{:02d}.{}'.format(index + 1, image_extension(data)), data
+            data = None
+    finally:
+        # 客户端中途断开时取消尚未开始的下载
+        for future in pending:
+            future.cancel()
+    if failed:
+        yield 'failed.txt', '\n'.join(failed).encode('utf-8')
+
+
+@app.route('/api/export', methods=['GET', 'POST'])
+def export_images():
+    """
+    打包下载一条笔记的全部图片（一次请求代替逐张下载）。
+    参数（GET 查询参数或 POST JSON）：short_link（分享文本/链接）、note_id（已解析过的笔记）
+    或 images（图片URL列表，仅POST）三选一；可选 format=zip|tar（默认zip）、sid / cookie。
+    图片并发下载，边下载边写入归档并流式返回。
+    """
+    params = request.get_json(silent=True) if request.method == 'POST' else None
+    if not isinstance(params, dict):
+        params = request.args
+
+    for name in ('format', 'sid', 'cookie', 'note_id', 'short_link'):
+        if params.get(name) is not None and not isinstance(params.get(name), str):
+            return jsonify({'success': False, 'error': '{} 必须是字符串'.format(name)}), 400
+
+    fmt = (params.get('format') or 'zip').strip().lower()
+    if fmt not in ARCHIVE_FORMATS:
+        return jsonify({'success': False, 'error': 'format 只支持 zip / tar'}), 400
+
+    try:
+        cookie = _proxy_cookie(params.get('sid', ''), params.get('cookie', ''))
+        images = params.get('images')
+        note_id = (params.get('note_id') or '').strip()
+        short_link = (params.get('short_link') or '').strip()
+
+        if isinstance(images, list):
+            urls = [u.strip() for u in images if isinstance(u, str) and u.strip()]
+            archive_name = 'images'
+        elif note_id:
+            data, state = PARSE_CACHE.get(_note_cache_key(note_id))
+            if state is None:
+                return jsonify({'success': False, 'error': '未找到该笔记的解析结果，请先调用 /api/parse'}), 404
+            urls = export_image_urls(data)
+            archive_name = re.sub(r'[^0-9A-Za-z_-]', '', note_id) or 'images'
+        elif short_link:
+            url = extract_url_from_text(short_link)
+            if not url:
+                return jsonify({'success': False, 'error': '未找到有效的短链URL'}), 400
+            try:
+                data = parse_link_cached(url, cookie)
+            except ParseError as e:
+                return jsonify({'success': False, 'error': str(e)}), e.status
+            urls = export_image_urls(data)
+            archive_name = data.get('note_id') or 'images'
+        else:
+            return jsonify({'success': False, 'error': 'short_link / note_id / images 不能都为空'}), 400
+    except Exception as e:
+        logger.error("打包下载失败: %s", str(e), exc_info=True)
+        return jsonify({'success': False, 'error': '打包下载失败: {}'.format(str(e))}), 500
+
+    urls = urls[:EXPORT_MAX_IMAGES]
+    if not urls:
+        return jsonify({'success': False, 'error': '没有可下载的图片'}), 404
+
+    mimetype, ext = ARCHIVE_FORMATS[fmt]
+    return Response(
+        iter_archive(fmt, _export_entries(urls, cookie)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': 'attachment; filename="{}.{}"'.format(archive_name, ext)},
+        direct_passthrough=True,
+    )
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    HTTP_REQUESTS_IN_FLIGHT.inc()
+
+
+@app.teardown_request
+def _finish_request(exc):
+    if getattr(g, 'request_started', None) is not None:
+        HTTP_REQUESTS_IN_FLIGHT.dec()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint)
+    HTTP_REQUESTS.inc(endpoint, str(response.status_code))
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 文本格式指标（各阶段耗时直方图、提取命中级别、上游状态码等）"""
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
 @app.route('/health', methods=['GET'])
 def health():
     """健康检查接口"""
     return jsonify({'status': 'ok'})
 
 
+def warm_up():
+    """
+    启动预热：执行一遍各处内联正则（写入 re 模块的编译缓存）。
+    gunicorn 预加载模式下在 fork worker 之前调用，worker 直接继承，不必各自重新编译。
+    """
+    extract_url_from_text('http://xhslink.com/a/warmup https://www.doubao.com/thread/warmup')
+    extract_note_id_from_url('https://www.xiaohongshu.com/explore/0')
+    _normalize_image_url_for_compare('https://sns-webpic-qc.xhscdn.com/0/0!nd_dft_wlteh_webp_3')
+
+
 if __name__ == '__main__':
+    # 开发服务器；生产环境请使用 gunicorn -c gunicorn_conf.py app:app（见 README “生产部署”）
     # 小程序 <image> 需要 https；开发环境可用自签证书快速启动：设置环境变量 FLASK_HTTPS=1
+    debug = env_bool('FLASK_DEBUG')
+    ssl_context = None
     use_https = os.environ.get('FLASK_HTTPS', '').strip() == '1'
     if use_https:
         # 优先使用用户提供的证书（适用于Windows/生产环境）
         cert_file = os.environ.get('FLASK_SSL_CERT', '').strip()
         key_file = os.environ.get('FLASK_SSL_KEY', '').strip()
-        if cert_file and key_file:
-            app.run(host='0.0.0.0', port=5000, debug=True, ssl_context=(cert_file, key_file))
-        else:
-            # werkzeug 的 adhoc 需要 cryptography；某些 Python 版本/环境可能无法安装该依赖
-            try:
-                app.run(host='0.0.0.0', port=5000, debug=True, ssl_context='adhoc')
-            except Exception as e:
-                logger.error("HTTPS启动失败，请提供证书：设置 FLASK_SSL_CERT/FLASK_SSL_KEY。错误: %s", str(e))
-                raise
-    else:
-        app.run(host='0.0.0.0', port=5000, debug=True)
+        # werkzeug 的 adhoc 需要 cryptography；某些 Python 版本/环境可能无法安装该依赖
+        ssl_context = (cert_file, key_file) if cert_file and key_file else 'adhoc'
+    try:
+        app.run(host='0.0.0.0', port=env_int('PORT', 5000), debug=debug, threaded=True, ssl_context=ssl_context)
+    except Exception as e:
+        if ssl_context == 'adhoc':
+            logger.error("HTTPS启动失败，请提供证书：设置 FLASK_SSL_CERT/FLASK_SSL_KEY。错误: %s", str(e))
+        raise
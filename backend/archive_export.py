@@ -0,0 +1,90 @@
+"""
+流式打包（ZIP / tar）
+逐个条目写入归档并立即产出已生成的字节，整个归档不会驻留内存；
+图片本身已经压缩，ZIP 条目使用 STORED（不再 deflate）。
+"""
+import io
+import tarfile
+import time
+import zipfile
+
+ARCHIVE_FORMATS = {
+    'zip': ('application/zip', 'zip'),
+    'tar': ('application/x-tar', 'tar'),
+}
+
+
+class _StreamBuffer:
+    """只追加的输出缓冲：zipfile/tarfile 写入，生成器取走（不支持 seek，zipfile 会自动写 data descriptor）"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(entries):
+    """entries 为 (文件名, bytes) 的可迭代对象，边写边产出 ZIP 字节"""
+    buf = _StreamBuffer()
+    with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for name, data in entries:
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            zf.writestr(info, data)
+            chunk = buf.drain()
+            if chunk:
+                yield chunk
+    chunk = buf.drain()
+    if chunk:
+        yield chunk
+
+
+def iter_tar(entries):
+    """entries 为 (文件名, bytes) 的可迭代对象，边写边产出 tar 字节"""
+    buf = _StreamBuffer()
+    with tarfile.open(fileobj=buf, mode='w|') as tf:
+        for name, data in entries:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            tf.addfile(info, io.BytesIO(data))
+            chunk = buf.drain()
+            if chunk:
+                yield chunk
+    chunk = buf.drain()
+    if chunk:
+        yield chunk
+
+
+def iter_archive(fmt, entries):
+    return iter_tar(entries) if fmt == 'tar' else iter_zip(entries)
+
+
+def image_extension(data):
+    """按文件头判断图片扩展名"""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'jpg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if data[4:12] in (b'ftypavif', b'ftypheic', b'ftypmif1'):
+        return 'avif' if data[8:12] == b'avif' else 'heic'
+    return 'jpg'
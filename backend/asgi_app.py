@@ -0,0 +1,474 @@
+"""
+异步（ASGI）服务模式
+/api/parse、/api/image_proxy、/health 基于 asyncio + aiohttp 客户端原生实现，返回的JSON格式与 app.py 完全一致；
+等待上游时不占用线程，单进程即可同时挂起大量图片代理下载。
+其余接口（/api/doubao_cookie、/api/parse_batch、/api/stats 等）转交给 Flask 应用在线程池中执行。
+
+启动（需要 pip install aiohttp uvicorn）：
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import parse_qs, urljoin
+
+import aiohttp
+from multidict import CIMultiDict
+
+import app as sync_app
+from extractors import extract_images_from_html
+from metrics import HTTP_REQUEST_SECONDS, HTTP_REQUESTS, HTTP_REQUESTS_IN_FLIGHT, STAGE_SECONDS, observe_stage
+from page_fetch import PAGE_CHUNK_SIZE, XHS_STATE_MARKERS, PageScanner, response_encoding
+from parse_cache import FRESH, STALE
+from settings import env_int
+from single_flight import AsyncSingleFlight, FlightTimeout
+from upstream import UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_GUARD_WAIT, get_guard, original_url, replay_url
+from upstream_guard import UpstreamRejected, is_failure_status
+
+try:
+    from uvicorn.middleware.wsgi import WSGIMiddleware
+except ImportError:  # 非 uvicorn 部署时，只提供原生异步接口
+    WSGIMiddleware = None
+
+logger = logging.getLogger(__name__)
+
+ASYNC_MAX_CONNECTIONS = env_int('ASYNC_MAX_CONNECTIONS', 1000)
+ASYNC_MAX_PER_HOST = env_int('ASYNC_MAX_PER_HOST', 200)
+
+_CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+
+_clients = {}  # event loop -> aiohttp.ClientSession
+
+# 与 app.PARSE_FLIGHT / app.NOTE_FLIGHT 对应的协程版（进程内合并）
+ASYNC_PARSE_FLIGHT = AsyncSingleFlight()
+ASYNC_NOTE_FLIGHT = AsyncSingleFlight()
+
+
+def _get_client():
+    """每个事件循环一个共享的 ClientSession（连接池 + keep-alive）"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.closed:
+        client = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=ASYNC_MAX_CONNECTIONS, limit_per_host=ASYNC_MAX_PER_HOST,
+                                           ttl_dns_cache=300),
+            # 与同步会话一致：不保存上游 Set-Cookie，避免不同用户的登录态串号
+            cookie_jar=aiohttp.DummyCookieJar(),
+        )
+        _clients[loop] = client
+    return client
+
+
+async def _close_clients():
+    loop = asyncio.get_running_loop()
+    client = _clients.pop(loop, None)
+    if client is not None:
+        await client.close()
+
+
+def _timeout(read_timeout):
+    """与同步模式一致：连接超时与读取超时分开计算"""
+    return aiohttp.ClientTimeout(total=None, sock_connect=min(UPSTREAM_CONNECT_TIMEOUT, read_timeout),
+                                 sock_read=read_timeout)
+
+
+class _Guarded:
+    """
+    aiohttp 请求的上游保护，与同步模式共用 upstream.get_guard 的分组状态：
+        async with _Guarded(url) as call:
+            async with client.get(...) as resp:
+                call.status = resp.status
+    能立即拿到许可时不切换线程；需要排队等令牌/名额时到线程中等待，不阻塞事件循环。
+    """
+
+    def __init__(self, url):
+        self.guard = get_guard(url)
+        self.status = None
+        self._permit = None
+
+    async def __aenter__(self):
+        self._permit = self.guard.acquire_nowait()
+        if self._permit is None:
+            future = asyncio.ensure_future(asyncio.to_thread(self.guard.acquire, UPSTREAM_GUARD_WAIT))
+            try:
+                self._permit = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # 取消不会中断线程里的 acquire：它之后拿到的许可没有人会 release，必须归还
+                future.add_done_callback(self._abandon_if_acquired)
+                raise
+        return self
+
+    def _abandon_if_acquired(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self.guard.abandon(future.result())
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is asyncio.CancelledError:
+            self.guard.abandon(self._permit)
+        else:
+            self.guard.release(self._permit, exc_type is not None or is_failure_status(self.status))
+
+
+# ---- 解析 ----
+
+async def resolve_short_link_async(short_link):
+    """异步版 resolve_short_link：HEAD 逐跳跟随短链重定向，结果写入同一个跳转缓存"""
+    cache_key = 'redirect:' + sync_app._canonical_link(short_link)
+    cached, state = sync_app.REDIRECT_CACHE.get(cache_key)
+    if state is not None:
+        return cached
+
+    with observe_stage('resolve_short_link'):
+        current = await _follow_short_link_async(short_link)
+
+    if current != short_link:
+        sync_app.REDIRECT_CACHE.set([cache_key], current)
+    logger.info("短链跳转完成: %s", current)
+    return current
+
+
+async def _follow_short_link_async(short_link):
+    client = _get_client()
+    current = short_link
+    for _ in range(sync_app.SHORT_LINK_MAX_HOPS):
+        if not sync_app._is_short_link(current):
+            break
+        async with _Guarded(current) as call, client.head(
+                replay_url(current), headers=sync_app.HEADERS, allow_redirects=False, timeout=_timeout(5)) as resp:
+            location = original_url(resp.headers.get('Location') or '')
+            status = call.status = resp.status
+        if status not in sync_app._REDIRECT_STATUS or not location:
+            break
+        current = urljoin(current, location)
+
+    if sync_app._is_short_link(current):
+        # 短链服务不支持 HEAD 时回退为 GET：只读响应头拿到最终地址，不读取正文
+        async with _Guarded(current) as call, client.get(
+                replay_url(current), headers=sync_app.HEADERS, timeout=_timeout(5)) as resp:
+            call.status = resp.status
+            current = original_url(str(resp.url))
+    return current
+
+
+async def _feed_page(resp, scanner):
+    """把响应体逐块交给 PageScanner，直到它不再需要数据；返回是否读到了响应结尾"""
+    async for chunk in resp.content.iter_chunked(PAGE_CHUNK_SIZE):
+        if scanner.feed(chunk):
+            return False
+    return True
+
+
+async def _cache_call(cache, fn, *args):
+    """带 SQLite 磁盘层的缓存读写放到线程里执行，不阻塞事件循环；纯内存缓存只持有很短的锁，直接调用"""
+    if cache.db_path:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+async def _fresh_note_cache_hit(note_id):
+    return await _cache_call(sync_app.PARSE_CACHE, sync_app._fresh_note_cache_hit, note_id)
+
+
+async def parse_xhs_link_async(url):
+    """异步版 parse_xhs_link"""
+    target_url = await resolve_short_link_async(url)
+    note_id = sync_app.extract_note_id_from_url(target_url)
+
+    cached = await _fresh_note_cache_hit(note_id)
+    if cached is not None:
+        return cached
+
+    # 不同短链指向同一篇笔记的并发请求，只下载/提取一次页面
+    flight_key = sync_app._note_cache_key(note_id) or 'page:' + target_url
+    return await ASYNC_NOTE_FLIGHT.do(flight_key, lambda: _fetch_xhs_note_async(target_url, note_id))
+
+
+async def _fetch_xhs_note_async(target_url, note_id):
+    images = []
+    try:
+        client = _get_client()
+        fetch_started = time.perf_counter()
+        async with _Guarded(target_url) as call, client.get(
+                replay_url(target_url), headers=sync_app.HEADERS, timeout=_timeout(8)) as resp:
+            call.status = resp.status
+            final_url = original_url(str(resp.url))
+            if final_url != target_url:
+                target_url = final_url
+                note_id = sync_app.extract_note_id_from_url(target_url) or note_id
+                cached = await _fresh_note_cache_hit(note_id)
+                if cached is not None:
+                    return cached
+            # 与同步版一致：__INITIAL_STATE__ 脚本读完即停止下载
+            scanner = PageScanner(XHS_STATE_MARKERS)
+            encoding = response_encoding(resp.headers.get('Content-Type'))
+            complete = await _feed_page(resp, scanner)
+            html = scanner.text(encoding)
+            STAGE_SECONDS.observe(time.perf_counter() - fetch_started, 'fetch_html')
+            logger.info("获取到HTML，长度: %d", len(html))
+            images = extract_images_from_html(html)
+            if not images and not complete:
+                scanner.markers = None
+                await _feed_page(resp, scanner)
+                images = extract_images_from_html(scanner.text(encoding))
+    except UpstreamRejected:
+        raise
+    except Exception as e:
+        logger.error("获取页面失败: %s", str(e), exc_info=True)
+
+    # all_images 去重在URL看不出身份时会发 Range 请求取指纹，放到线程里执行，不阻塞事件循环
+    return await asyncio.to_thread(sync_app.build_xhs_result, images, target_url, note_id)
+
+
+async def parse_link_cached_async(url, cookie=''):
+    """
+    异步版 parse_link_cached；小红书在事件循环中原生执行，豆包链接（Playwright 同步API）提交到 expensive 通道。
+    相同链接的并发请求合并为一次解析；等待超过 PARSE_WAIT_SECONDS 返回 504，解析在后台继续并写入缓存。
+    """
+    cache = sync_app.PARSE_CACHE
+    key = sync_app._link_cache_key(url, cookie)
+    cached, state = await _cache_call(cache, cache.get, key)
+    if state == FRESH:
+        return cached
+    if state == STALE:
+        sync_app.refresh_parse(url, cookie, key)
+        return cached
+
+    async def compute():
+        if 'doubao.com' in url:
+            # 与同步实现共用 expensive 通道（并发与排队上限），任务内写入缓存
+            return await asyncio.wrap_future(sync_app.submit_parse(url, cookie, key))
+        try:
+            data = await parse_xhs_link_async(url)
+        except UpstreamRejected as e:
+            raise sync_app.upstream_unavailable(e)
+        await _cache_call(cache, cache.set, [key] + sync_app._result_cache_keys(data), data)
+        return data
+
+    try:
+        return await ASYNC_PARSE_FLIGHT.do(key, compute, timeout=sync_app.PARSE_WAIT_SECONDS)
+    except FlightTimeout:
+        raise sync_app.ParseError('解析超时，请稍后重试', 504)
+
+
+# ---- ASGI 基础 ----
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+async def _send_json(send, payload, status=200):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('ascii')),
+        ] + _CORS_HEADERS,
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _query_args(scope):
+    """与 Flask request.args.get 一致：同名参数取第一个"""
+    qs = parse_qs(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True)
+    return {k: v[0] for k, v in qs.items()}
+
+
+# ---- 接口 ----
+
+async def health(scope, receive, send):
+    await _send_json(send, {'status': 'ok'})
+
+
+async def parse_short_link(scope, receive, send):
+    """与 app.parse_short_link 相同的请求/响应格式"""
+    try:
+        data = json.loads(await _read_body(receive) or b'null')
+        short_link = data.get('short_link', '').strip()
+
+        if not short_link:
+            return await _send_json(send, {'success': False, 'error': '短链不能为空'}, 400)
+
+        with observe_stage('extract_url'):
+            url = sync_app.extract_url_from_text(short_link)
+        if not url:
+            return await _send_json(send, {'success': False, 'error': '未找到有效的短链URL'}, 400)
+
+        cookie = (data.get('cookie') or '').strip() if isinstance(data, dict) else ''
+
+        try:
+            result = await parse_link_cached_async(url, cookie)
+        except sync_app.ParseError as e:
+            return await _send_json(send, {'success': False, 'error': str(e)}, e.status)
+
+        sync_app.prefetch_images(result, cookie)
+        await _send_json(send, {'success': True, 'data': result})
+    except Exception as e:
+        logger.error("解析失败: %s", str(e), exc_info=True)
+        await _send_json(send, {'success': False, 'error': f'解析失败: {str(e)}'}, 500)
+
+
+async def _watch_disconnect(receive, disconnected):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            disconnected.set()
+            return
+
+
+async def _fetch_image_once(url, headers):
+    async with _Guarded(url) as call:
+        resp = await _get_client().get(replay_url(url), headers=headers, timeout=_timeout(15))
+        call.status = resp.status
+    return resp
+
+
+async def _fetch_image(url, headers):
+    """与 app.fetch_image 相同：启用对冲时小红书图片走对冲请求，落败一方的响应直接释放"""
+    hedger = sync_app.IMAGE_HEDGER
+    if hedger is None:
+        return await _fetch_image_once(url, headers)
+    return await hedger.get_async(_fetch_image_once, url, headers, lambda resp: resp.release())
+
+
+async def image_proxy(scope, receive, send):
+    """与 app.image_proxy 相同的参数与行为：流式转发、Range(206)、条件请求(304)"""
+    args = _query_args(scope)
+    url = args.get('url', '').strip()
+    if not url:
+        return await _send_json(send, {'success': False, 'error': 'url 参数不能为空'}, 400)
+    if (args.get('w') or args.get('q') or args.get('fmt')) and _wsgi_fallback is not None:
+        # 缩略图/转码在同步实现中完成（进程池 + 磁盘缓存）
+        return await _delegate_to_flask(scope, receive, send)
+
+    resp = None
+    watcher = None
+    try:
+        url = sync_app._html.unescape(url).strip()
+        cookie = sync_app._proxy_cookie(args.get('sid', ''), args.get('cookie', ''))
+        image_cache = sync_app.IMAGE_CACHE
+        if (image_cache is not None and _wsgi_fallback is not None
+                and image_cache.contains(sync_app.image_cache_key(url, cookie))):
+            # 已在磁盘缓存中（例如解析后被预取）：由同步实现直接从文件返回
+            return await _delegate_to_flask(scope, receive, send)
+        client_headers = CIMultiDict((k.decode('latin-1'), v.decode('latin-1')) for k, v in scope['headers'])
+        headers = sync_app.image_proxy_request_headers(url, cookie, client_headers)
+
+        resp = await _fetch_image(url, headers)
+        status = resp.status
+
+        if status not in (200, 206, 304):
+            logger.warning("图片代理请求失败，status=%s, url=%s", status, url)
+            return await _send_json(send, {'success': False, 'error': '图片请求失败，状态码 {}'.format(status)}, status)
+
+        out_headers = sync_app.image_proxy_response_headers(resp.headers)
+        raw_headers = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in out_headers.items()]
+        if status != 304:
+            content_type = resp.headers.get('Content-Type', 'image/jpeg')
+            raw_headers.append((b'content-type', content_type.encode('latin-1')))
+        await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers + _CORS_HEADERS})
+        if status == 304:
+            return await send({'type': 'http.response.body', 'body': b''})
+
+        # 客户端断开后立即停止从上游读取
+        disconnected = asyncio.Event()
+        watcher = asyncio.ensure_future(_watch_disconnect(receive, disconnected))
+        with observe_stage('proxy_transfer'):
+            async for chunk in resp.content.iter_chunked(sync_app.IMAGE_PROXY_CHUNK_SIZE):
+                if disconnected.is_set():
+                    return
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+    except UpstreamRejected as e:
+        logger.warning("图片代理被上游保护拒绝: %s, url=%s", str(e), url)
+        await _send_json(send, {'success': False, 'error': '图片上游暂时不可用，请稍后重试'}, 503)
+    except Exception as e:
+        logger.error("图片代理异常: %s", str(e), exc_info=True)
+        await _send_json(send, {'success': False, 'error': '图片代理异常: {}'.format(str(e))}, 500)
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        if resp is not None:
+            resp.release()
+
+
+ROUTES = {
+    ('GET', '/health'): health,
+    ('POST', '/api/parse'): parse_short_link,
+    ('GET', '/api/image_proxy'): image_proxy,
+}
+
+_wsgi_fallback = WSGIMiddleware(sync_app.app) if WSGIMiddleware is not None else None
+_DELEGATED = 'waterdemo.delegated'
+
+
+async def _delegate_to_flask(scope, receive, send):
+    """原生路由中途转交给 Flask：请求计数、耗时与进行中请求数都由 Flask 的钩子记录，这里不再重复"""
+    if not scope.get(_DELEGATED):
+        scope[_DELEGATED] = True
+        HTTP_REQUESTS_IN_FLIGHT.dec()
+    return await _wsgi_fallback(scope, receive, send)
+
+
+async def _handle_native(handler, scope, receive, send):
+    """
+    执行原生路由并记录与 Flask 版相同的指标：endpoint 为路由路径，
+    耗时到响应头发出为止（与 Flask 一致，流式响应体不计入）；响应头发出前异常计为 500。
+    """
+    endpoint = scope['path']
+    started = time.perf_counter()
+    status = None
+
+    async def send_and_record(message):
+        nonlocal status
+        if message['type'] == 'http.response.start' and status is None:
+            status = message['status']
+            if not scope.get(_DELEGATED):
+                HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint)
+                HTTP_REQUESTS.inc(endpoint, str(status))
+        await send(message)
+
+    HTTP_REQUESTS_IN_FLIGHT.inc()
+    try:
+        return await handler(scope, receive, send_and_record)
+    finally:
+        if not scope.get(_DELEGATED):
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            if status is None:
+                HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint)
+                HTTP_REQUESTS.inc(endpoint, '500')
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await _close_clients()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    handler = ROUTES.get((scope['method'], scope['path']))
+    if handler is not None:
+        return await _handle_native(handler, scope, receive, send)
+    if _wsgi_fallback is not None:
+        return await _wsgi_fallback(scope, receive, send)
+    await _send_json(send, {'success': False, 'error': 'Not Found'}, 404)
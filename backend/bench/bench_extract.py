@@ -0,0 +1,103 @@
+"""
+提取引擎基准：对比旧版逐条正则实现（legacy_extract.py）与 extractors.py 的单页耗时与内存分配。
+
+用法（在 backend 目录下）：
+    python bench/bench_extract.py                      # 使用 bench/fixtures/ 下的 *.html，没有则用合成页面
+    python bench/bench_extract.py page1.html page2.html
+    python bench/bench_extract.py --repeat 50
+
+文件名包含 "doubao" 的按豆包页面处理，其余按小红书页面处理。
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import extractors  # noqa: E402
+import legacy_extract  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def _synthetic_pages():
+    """没有录制页面时使用的合成页面（体积与结构接近真实笔记页）"""
+    images = [
+        {'url': 'http://sns-webpic-qc.xhscdn.com/202601121253/%032x/1040g2sg31%06d!nd_dft_wlteh_webp_3' % (i, i),
+         'width': 1080, 'height': 1440}
+        for i in range(9)
+    ]
+    state = {'note': {'note': {'noteId': '65a1b2c3d4e5f6a7b8c9d0e1', 'imageList': images,
+                               'desc': '正文' * 2000, 'comments': [{'text': 'x' * 200}] * 400}}}
+    state_js = json.dumps(state, ensure_ascii=False).replace('/', '\\u002F')
+    filler = '<div class="feed"><a href="https://www.xiaohongshu.com/explore/abc">item</a></div>' * 3000
+    xhs_ok = ('<html><head><meta property="og:image" content="%s"></head><body>%s'
+              '<script>window.__INITIAL_STATE__=%s</script></body></html>') % (images[0]['url'], filler, state_js)
+    # 真实页面的状态里常有 undefined，JSON 解析失败后走正则兜底
+    xhs_fallback = xhs_ok.replace('"desc"', '"extra":undefined,"desc"', 1).replace('\\u002F', '/')
+
+    doubao_urls = ['https://p3-flow-imagex-sign.byteimg.com/ocean-cloud-tos/image_%d.jpeg~tplv-a9rns2rl98-downsize_watermark_1_5_b.png?rk3s=8e244e95&amp;x-expires=1760000000&amp;x-signature=%s' % (i, 'A' * 28)
+                   for i in range(4)]
+    render_data = json.dumps({'thread': {'messages': [{'image': {'url': u.replace('&amp;', '&')}} for u in doubao_urls],
+                                         'padding': 'y' * 100000}})
+    doubao = ('<html><body>%s<script id="__RENDER_DATA__" type="application/json">%s</script>%s</body></html>'
+              % ('<img src="%s">' % doubao_urls[0], render_data, filler))
+    return [('synthetic_xhs_state.html', xhs_ok), ('synthetic_xhs_regex.html', xhs_fallback),
+            ('synthetic_doubao.html', doubao)]
+
+
+def _load_pages(paths):
+    if not paths:
+        paths = sorted(glob.glob(os.path.join(FIXTURE_DIR, '*.html')))
+    if not paths:
+        return _synthetic_pages()
+    pages = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            pages.append((os.path.basename(path), f.read()))
+    return pages
+
+
+def _measure(func, html, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(html)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='提取引擎基准（旧实现 vs 新实现）')
+    parser.add_argument('pages', nargs='*', help='HTML 文件路径')
+    parser.add_argument('--repeat', type=int, default=20, help='每个页面重复次数（取最快一次）')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    print('%-32s %8s %10s %10s %11s %11s %6s' % ('page', 'KB', 'old ms', 'new ms', 'old peakKB', 'new peakKB', 'same'))
+    for name, html in _load_pages(args.pages):
+        if 'doubao' in name:
+            old_func, new_func = legacy_extract.extract_doubao_images_from_html, extractors.extract_doubao_images_from_html
+        else:
+            old_func, new_func = legacy_extract.extract_images_from_html, extractors.extract_images_from_html
+        old_result, old_t, old_peak = _measure(old_func, html, args.repeat)
+        new_result, new_t, new_peak = _measure(new_func, html, args.repeat)
+        print('%-32s %8.1f %10.3f %10.3f %11.1f %11.1f %6s' % (
+            name[:32], len(html) / 1024.0, old_t * 1000, new_t * 1000,
+            old_peak / 1024.0, new_peak / 1024.0, 'yes' if old_result == new_result else 'NO'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+状态JSON解析基准：整段解析 vs 按路径定位（小红书），逐一尝试解码 vs 先猜编码（豆包），
+以及标准库 json 与 orjson（已安装时）两种后端。
+
+用法（在 backend 目录下）：
+    python bench/bench_state.py                    # bench/fixtures/ 下录制的页面 + 合成的大状态
+    python bench/bench_state.py page1.html --repeat 50
+
+整段解析的对照实现就是本次改动前的做法：括号配平截出整个状态 -> json.loads -> 取 note.note.imageList；
+豆包为 legacy_extract 中的 _try_parse_json_loose + 递归遍历。
+"""
+import argparse
+import base64
+import glob
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from urllib.parse import quote
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import extractors  # noqa: E402
+import legacy_extract  # noqa: E402
+
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures')
+
+
+def _synthetic_xhs_state(feed_items):
+    """首页信息流在前、笔记在后的大状态（与真实页面的键顺序一致）"""
+    images = [{'url': 'http://sns-webpic-qc.xhscdn.com/202601121253/%032x/1040g2sg31%06d!nd_dft_wlteh_webp_3' % (i, i),
+               'width': 1080, 'height': 1440, 'infoList': [{'imageScene': 'WB_DFT', 'url': 'x'}]} for i in range(9)]
+    feed = [{'id': '%024x' % i, 'noteCard': {'displayTitle': '标题' * 20, 'user': {'nickname': 'u', 'avatar': 'a'},
+                                             'cover': {'url': 'http://sns-webpic-qc.xhscdn.com/c/%d' % i}}}
+            for i in range(feed_items)]
+    state = {'global': {'appSettings': {'x': 1}}, 'feed': {'feeds': feed},
+             'note': {'note': {'noteId': '65a1b2c3d4e5f6a7b8c9d0e1', 'imageList': images, 'desc': '正文' * 2000,
+                               'comments': [{'text': 'x' * 200, 'user': {'id': 'u'}}] * 400}}}
+    return json.dumps(state, ensure_ascii=False).replace('/', '\\u002F')
+
+
+def _synthetic_doubao_script(messages):
+    data = {'thread': {'messages': [
+        {'id': i, 'content': '文本' * 50, 'image': {'url': 'https://p3-flow-imagex-sign.byteimg.com/img_%d.jpeg~tplv-x.png'
+                                                          '?rk3s=8e244e95&x-signature=%s' % (i, 'A' * 28)},
+         'meta': {'tokens': list(range(20)), 'extra': {'a': {'b': {'c': 'd'}}}}} for i in range(messages)]}}
+    return json.dumps(data, ensure_ascii=False)
+
+
+def _xhs_full(html):
+    """改动前的做法：截出整个状态并完整解析"""
+    m = extractors._XHS_STATE_MARKER.search(html)
+    if not m:
+        return []
+    end = extractors.find_json_value_end(html, m.end())
+    state = json.loads(html[m.end():end])
+    note_data = state.get('note', {}).get('note', {}) or state.get('note', {})
+    return note_data.get('imageList', []) or note_data.get('images', [])
+
+
+def _xhs_targeted(html):
+    return extractors.find_xhs_image_list(html) or []
+
+
+def _doubao_old(script):
+    obj = legacy_extract._try_parse_json_loose(script)
+    return legacy_extract._extract_urls_from_json(obj, extractors.DOUBAO_IMAGE_DOMAINS) if obj is not None else []
+
+
+def _doubao_new(script):
+    obj = extractors._try_parse_json_loose(script)
+    return list(extractors.iter_urls_from_json(obj, extractors.DOUBAO_IMAGE_DOMAINS)) if obj is not None else []
+
+
+def _measure(func, arg, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def _cases(paths):
+    """(名称, 类型, 输入)：xhs 输入为整页HTML，doubao 输入为状态脚本文本"""
+    if not paths:
+        paths = sorted(glob.glob(os.path.join(FIXTURE_DIR, '*.html')))
+    cases = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            html = f.read()
+        name = os.path.basename(path)
+        if 'doubao' in name:
+            script = extractors.find_doubao_state_script(html)
+            if script:
+                cases.append((name, 'doubao', script.strip()))
+        elif extractors._XHS_STATE_MARKER.search(html):
+            cases.append((name, 'xhs', html))
+
+    for items in (200, 2000):
+        cases.append(('synthetic_xhs_feed%d' % items, 'xhs',
+                      '<script>window.__INITIAL_STATE__=%s</script>' % _synthetic_xhs_state(items)))
+    script = _synthetic_doubao_script(2000)
+    cases.append(('synthetic_doubao_json', 'doubao', script))
+    cases.append(('synthetic_doubao_urlencoded', 'doubao', quote(script)))
+    cases.append(('synthetic_doubao_base64', 'doubao', base64.b64encode(script.encode('utf-8')).decode('ascii')))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description='状态JSON解析基准')
+    parser.add_argument('pages', nargs='*', help='HTML 文件路径（文件名含 doubao 的按豆包页面处理）')
+    parser.add_argument('--repeat', type=int, default=20, help='每个用例重复次数（取最快一次）')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    orjson_module = extractors.orjson
+    backends = [('json', None)] + ([('orjson', orjson_module)] if orjson_module is not None else [])
+
+    print('%-30s %8s %10s %11s %-7s %10s %11s %6s' % (
+        'case', 'KB', 'old ms', 'old peakKB', 'backend', 'new ms', 'new peakKB', 'same'))
+    for name, kind, data in _cases(args.pages):
+        old_func, new_func = (_xhs_full, _xhs_targeted) if kind == 'xhs' else (_doubao_old, _doubao_new)
+        old_result, old_t, old_peak = _measure(old_func, data, args.repeat)
+        for backend, module in backends:
+            extractors.orjson = module
+            new_result, new_t, new_peak = _measure(new_func, data, args.repeat)
+            print('%-30s %8.1f %10.3f %11.1f %-7s %10.3f %11.1f %6s' % (
+                name[:30], len(data) / 1024.0, old_t * 1000, old_peak / 1024.0, backend,
+                new_t * 1000, new_peak / 1024.0, 'yes' if old_result == new_result else 'NO'))
+    extractors.orjson = orjson_module
+    if orjson_module is None:
+        print('\n未安装 orjson（pip install orjson），只测试了标准库 json 后端')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+缩略图/转码基准：对 test/ 下的样例图片测量各档位的单张耗时、输出体积，以及进程池吞吐。
+
+用法（在 backend 目录下，需要 pip install Pillow）：
+    python bench/bench_transcode.py
+    python bench/bench_transcode.py --repeat 10 --variants w360-q75-webp,w720-q75-webp,w360-q75-jpeg
+    python bench/bench_transcode.py img1.jpg img2.webp
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import image_transcode  # noqa: E402
+
+SAMPLE_DIR = os.path.join(os.path.dirname(BACKEND_DIR), 'test')
+DEFAULT_VARIANTS = 'w240-q75-webp,w360-q75-webp,w720-q75-webp,w360-q75-jpeg,w1080-q80-webp'
+
+
+def _parse_variant(text):
+    """'w360-q75-webp' -> (360, 75, 'webp')"""
+    w, q, fmt = text.split('-')
+    return int(w[1:]), int(q[1:]), fmt
+
+
+def _load_images(paths):
+    if not paths:
+        paths = sorted(glob.glob(os.path.join(SAMPLE_DIR, '*.webp')) + glob.glob(os.path.join(SAMPLE_DIR, '*.jpg')))
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append((os.path.basename(path), f.read()))
+    return images
+
+
+def bench_single(images, variants, repeat):
+    print('%-34s %9s %-16s %9s %9s %7s' % ('file', 'orig_kb', 'variant', 'out_kb', 'ms(p50)', 'ratio'))
+    for name, data in images:
+        for variant in variants:
+            width, quality, fmt = _parse_variant(variant)
+            times = []
+            out = b''
+            for _ in range(repeat):
+                start = time.perf_counter()
+                out, _ = image_transcode.transcode(data, width, quality, fmt)
+                times.append((time.perf_counter() - start) * 1000)
+            print('%-34s %9.1f %-16s %9.1f %9.1f %6.1f%%' % (
+                name[:34], len(data) / 1024, variant, len(out) / 1024,
+                statistics.median(times), len(out) * 100.0 / len(data)))
+
+
+def bench_pool(images, variant, workers, rounds):
+    """同一批任务：单进程串行 vs 进程池并行"""
+    width, quality, fmt = _parse_variant(variant)
+    jobs = [data for _, data in images] * rounds
+
+    start = time.perf_counter()
+    for data in jobs:
+        image_transcode.transcode(data, width, quality, fmt)
+    serial = time.perf_counter() - start
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(image_transcode.transcode, jobs[:workers], [width] * workers,
+                      [quality] * workers, [fmt] * workers))  # 预热子进程
+        start = time.perf_counter()
+        list(pool.map(image_transcode.transcode, jobs, [width] * len(jobs),
+                      [quality] * len(jobs), [fmt] * len(jobs)))
+        pooled = time.perf_counter() - start
+
+    print('\n%s x %d 张: 串行 %.2fs (%.1f 张/s)，进程池(%d) %.2fs (%.1f 张/s)' % (
+        variant, len(jobs), serial, len(jobs) / serial, workers, pooled, len(jobs) / pooled))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='缩略图/转码基准')
+    parser.add_argument('files', nargs='*', help='图片文件，默认使用 test/ 下的样例')
+    parser.add_argument('--repeat', type=int, default=5, help='单张每个档位的重复次数')
+    parser.add_argument('--variants', default=DEFAULT_VARIANTS, help='逗号分隔的档位，格式 w<宽>-q<质量>-<webp|jpeg>')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--rounds', type=int, default=4, help='进程池测试中样例重复的轮数')
+    args = parser.parse_args()
+
+    if not image_transcode.transcode_available():
+        sys.exit('需要先安装 Pillow: pip install Pillow')
+    images = _load_images(args.files)
+    if not images:
+        sys.exit('没有找到样例图片')
+    variants = [v.strip() for v in args.variants.split(',') if v.strip()]
+    bench_single(images, variants, args.repeat)
+    bench_pool(images, variants[1] if len(variants) > 1 else variants[0], args.workers, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
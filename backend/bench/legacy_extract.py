@@ -0,0 +1,271 @@
+"""
+旧版提取实现（逐条正则），仅供 bench_extract.py 对比耗时与结果一致性，不在服务中使用
+"""
+import base64
+import html as _html
+import json
+import logging
+import re
+from urllib.parse import unquote, unquote_plus
+
+logger = logging.getLogger(__name__)
+
+
+def extract_images_from_html(html):
+    """从HTML中提取图片URL"""
+    if not html:
+        return []
+    
+    images = []
+    
+    # 1. 尝试提取 __INITIAL_STATE__ 中的图片（改进版）
+    try:
+        # 尝试多种匹配模式
+        state_patterns = [
+            r'__INITIAL_STATE__\s*=\s*(\{[\s\S]*?\})\s*</script>',
+            r'window\.__INITIAL_STATE__\s*=\s*(\{[\s\S]*?\})\s*</script>',
+            r'__INITIAL_STATE__\s*=\s*(\{[\s\S]*?\});',
+        ]
+        
+        json_text = None
+        for pattern in state_patterns:
+            state_match = re.search(pattern, html, re.IGNORECASE)
+            if state_match:
+                json_text = state_match.group(1)
+                logger.info(f"找到__INITIAL_STATE__，长度: {len(json_text)}")
+                break
+        
+        if json_text:
+            # 清理JSON文本
+            json_text = json_text.replace('\\u002F', '/')
+            json_text = json_text.replace('\\/', '/')
+            
+            # 尝试解析JSON（可能需要处理不完整的JSON）
+            try:
+                state_obj = json.loads(json_text)
+                
+                # 查找图片列表（尝试多种路径）
+                note_data = state_obj.get('note', {}).get('note', {})
+                if not note_data:
+                    note_data = state_obj.get('note', {})
+                
+                image_list = note_data.get('imageList', [])
+                if not image_list:
+                    image_list = note_data.get('images', [])
+                
+                for img in image_list:
+                    url = img.get('url') or img.get('originalUrl') or img.get('originUrl') or img.get('info', {}).get('url', '')
+                    if url and url.startswith('http'):
+                        images.append(url)
+                
+                if images:
+                    logger.info(f"从__INITIAL_STATE__提取到 {len(images)} 张图片")
+                    return images
+            except json.JSONDecodeError as e:
+                logger.warning(f"JSON解析失败，尝试部分提取: {str(e)}")
+                # JSON解析失败，尝试直接从文本中提取图片URL
+                # 继续执行下面的正则匹配
+    except Exception as e:
+        logger.warning(f"解析__INITIAL_STATE__失败: {str(e)}")
+    
+    # 2. 尝试正则匹配常见的图片URL模式（优化：优先匹配最可能成功的模式）
+    # 优先匹配小红书CDN图片URL（最常见）
+    patterns = [
+        # 优先：直接匹配小红书CDN图片URL（最快最准确）
+        r'https?://sns-webpic-[^"\'<>\s]+',
+        r'https?://sns-img-[^"\'<>\s]+',
+        # JSON格式的图片URL（需要捕获组）
+        r'"url":"(https?://sns-[^"]+)"',
+        r'"originalUrl":"(https?://[^"]+)"',
+        r'"originUrl":"(https?://[^"]+)"',
+        r'"imageList":\s*\[\s*{\s*"url":"(https?://[^"]+)"',
+        # 其他图片URL模式
+        r'https?://ci\.xiaohongshu\.com/[^"\'<>\s]+',
+        r'https?://qimg\.xiaohongshu\.com/[^"\'<>\s]+',
+        r'https?://img\.xiaohongshu\.com/[^"\'<>\s]+',
+        r'"url":"(https?://[^"]+)"\s*,\s*"width"',
+        # Meta标签
+        r'property="og:image"\s+content="(https?://[^"]+)"',
+        r'name="og:image"\s+content="(https?://[^"]+)"',
+    ]
+    
+    for pattern in patterns:
+        matches = re.findall(pattern, html, re.IGNORECASE)
+        if matches:
+            # 如果pattern有捕获组，matches是元组列表，否则是字符串列表
+            if matches and isinstance(matches[0], tuple):
+                matches = [m[0] if m[0] else m for m in matches]
+            
+            # 过滤掉非图片URL
+            valid_matches = [m for m in matches if ('sns-' in m or 'xiaohongshu.com' in m or 'xhscdn.com' in m) and m.startswith('http')]
+            if valid_matches:
+                images.extend(valid_matches)
+                logger.info(f"通过正则匹配提取到 {len(valid_matches)} 个URL")
+                break  # 找到就立即返回，不再尝试其他模式
+    
+    # 保序去重并过滤（不能用 set，set 会打乱小红书原始顺序）
+    ordered_images = []
+    seen = set()
+    for img in images:
+        if not (img and img.startswith('http') and ('sns-img' in img or 'xiaohongshu.com' in img or 'xhscdn.com' in img)):
+            continue
+        # 排除纯域名根路径、样式拼接串等“非真实图片URL”
+        if re.match(r'^https?://[^/]+/?$', img.strip()) or ');background' in img:
+            continue
+        if img in seen:
+            continue
+        seen.add(img)
+        ordered_images.append(img)
+    images = ordered_images
+    
+    if images:
+        logger.info(f"总共提取到 {len(images)} 张图片")
+    
+    return images
+
+
+def _extract_urls_from_json(obj, domains):
+    """递归从JSON对象中提取指定域名的图片URL"""
+    urls = []
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if isinstance(v, str):
+                if v.startswith('http') and any(d in v for d in domains):
+                    urls.append(v)
+            else:
+                urls.extend(_extract_urls_from_json(v, domains))
+    elif isinstance(obj, list):
+        for item in obj:
+            urls.extend(_extract_urls_from_json(item, domains))
+    return urls
+
+
+def _try_parse_json_loose(text):
+    """尽可能从脚本文本中解析JSON（支持URL编码/转义/base64等常见形式）"""
+    if not text:
+        return None
+
+    candidates = [text.strip()]
+
+    # 去掉可能包裹的引号
+    if (candidates[0].startswith('"') and candidates[0].endswith('"')) or (
+        candidates[0].startswith("'") and candidates[0].endswith("'")
+    ):
+        candidates.append(candidates[0][1:-1])
+
+    # URL 编码/加号空格
+    candidates.append(unquote(candidates[0]))
+    candidates.append(unquote_plus(candidates[0]))
+
+    # 反斜杠转义（常见于内嵌字符串）
+    candidates.append(candidates[0].encode('utf-8', errors='ignore').decode('unicode_escape', errors='ignore'))
+
+    # base64（如果看起来像 base64）
+    base = re.sub(r'\s+', '', candidates[0])
+    if re.fullmatch(r'[A-Za-z0-9+/=]+', base or '') and len(base) > 100:
+        try:
+            decoded = base64.b64decode(base + '===')  # 容错 padding
+            candidates.append(decoded.decode('utf-8', errors='ignore'))
+        except Exception:
+            pass
+
+    seen = set()
+    for c in candidates:
+        if not c or c in seen:
+            continue
+        seen.add(c)
+        try:
+            return json.loads(c)
+        except Exception:
+            continue
+    return None
+
+
+def extract_doubao_images_from_html(html):
+    """从豆包thread页面HTML中提取图片URL（尽量获取无水印原图）"""
+    if not html:
+        return []
+
+    images = []
+
+    # 先把HTML实体解码（非常关键：豆包页面里常见 &amp; 会破坏签名参数）
+    try:
+        html = _html.unescape(html)
+    except Exception:
+        pass
+
+    # 1. 先尝试从页面中的 JSON 状态脚本中提取（类似小红书 __INITIAL_STATE__）
+    try:
+        script_patterns = [
+            r'<script[^>]+id="__RENDER_DATA__"[^>]*>([\s\S]*?)</script>',
+            r'<script[^>]+id="__NEXT_DATA__"[^>]*>([\s\S]*?)</script>',
+        ]
+        json_text = None
+        for pattern in script_patterns:
+            m = re.search(pattern, html, re.IGNORECASE)
+            if m:
+                json_text = m.group(1).strip()
+                logger.info(f"豆包页面找到JSON脚本，长度: {len(json_text)}")
+                break
+
+        domains = ['byteimg.com', 'byteadapters.cn', 'doubaoimg.com']
+
+        if json_text:
+            state_obj = _try_parse_json_loose(json_text)
+            if state_obj is None:
+                logger.warning("豆包JSON解析失败（多种解码方式均失败），将使用正则继续提取")
+            else:
+                images.extend(_extract_urls_from_json(state_obj, domains))
+    except Exception as e:
+        logger.warning(f"豆包JSON脚本解析异常: {str(e)}")
+
+    # 2. 直接从HTML文本中用正则匹配图片URL（兜底）
+    patterns = [
+        r'https?://[^\s"\'<>]*byteimg\.com[^\s"\'<>]*',
+        r'https?://[^\s"\'<>]*byteadapters\.cn[^\s"\'<>]*',
+        r'https?://[^\s"\'<>]*doubaoimg\.com[^\s"\'<>]*',
+    ]
+
+    for pattern in patterns:
+        matches = re.findall(pattern, html, re.IGNORECASE)
+        if matches:
+            logger.info(f"豆包页面通过正则匹配到 {len(matches)} 个候选URL")
+            images.extend(matches)
+
+    # 3. 去重、清洗（保留查询参数，避免破坏签名；仅做最小处理）
+    cleaned = []
+    for u in images:
+        if not u.startswith('http'):
+            continue
+
+        # 豆包经常返回带处理后缀的“水印/缩略图”URL，例如：
+        # ...jpeg~tplv-xxx-downsize_watermark_...png?x-signature=...
+        # 尝试生成“无水印候选”：去掉 "~tplv-..." 到 "?" 之前的部分，同时保留 query 参数（签名）。
+        q = ''
+        base = u
+        if '?' in u:
+            base, q = u.split('?', 1)
+            q = '?' + q
+
+        # 去掉处理后缀（从 ~tplv- 开始到结尾）
+        if '~tplv-' in base:
+            base_no_tplv = base.split('~tplv-', 1)[0]
+            cleaned.append(base_no_tplv + q)  # 优先加入“疑似无水印原图”
+
+        cleaned.append(u)  # 同时保留原始URL兜底
+
+    # 去重，但尽量保持顺序（先保留无水印候选）
+    seen = set()
+    ordered = []
+    for u in cleaned:
+        if u in seen:
+            continue
+        seen.add(u)
+        ordered.append(u)
+
+    cleaned = ordered
+
+    if cleaned:
+        logger.info(f"豆包页面最终提取到 {len(cleaned)} 张图片")
+
+    return cleaned
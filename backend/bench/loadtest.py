@@ -0,0 +1,336 @@
+"""
+同步（Flask/WSGI）与异步（asgi_app）服务模式压测对比，上游全部由本地桩服务提供，可离线运行。
+
+用法（在 backend 目录下，需要 pip install aiohttp uvicorn；同步模式优先使用 gunicorn）：
+    python bench/loadtest.py --endpoint image_proxy --concurrency 200 --requests 2000 --delay 0.2
+    python bench/loadtest.py --endpoint parse --mode async
+
+回放模式：上游改为 bench/record_fixtures.py 录制的真实响应（短链跳转、笔记/豆包页面、图片），
+服务端的解析/跳转/探测缓存全部关闭，每个请求都完整走一遍解析流水线：
+    python bench/loadtest.py --replay bench/fixtures/upstream --endpoint parse --concurrency 50 --verify
+
+输出每种模式的吞吐（req/s）、p50/p95/p99 延迟、错误数，以及服务进程（含子进程）的峰值 RSS 和每请求 CPU 时间
+（读取 /proc，仅 Linux）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_upstream import _sample_image_names  # noqa: E402
+
+# 回放时关闭的服务端缓存（否则只有第一轮请求会访问上游）
+_REPLAY_ENV = {
+    'BROWSER_POOL_SIZE': '0',
+    'PARSE_CACHE_TTL_SECONDS': '0',
+    'PARSE_CACHE_STALE_SECONDS': '0',
+    'REDIRECT_CACHE_TTL_SECONDS': '0',
+    'PROBE_CACHE_TTL_SECONDS': '0',
+    'UPSTREAM_RATE_LIMIT': '0',  # 本地桩服务不需要限速（熔断与并发上限照常生效）
+}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _server_command(mode, port, workers, threads):
+    bind = '127.0.0.1:%d' % port
+    if mode == 'async':
+        return [sys.executable, '-m', 'uvicorn', 'asgi_app:app', '--host', '127.0.0.1', '--port', str(port),
+                '--workers', str(workers), '--log-level', 'warning', '--no-access-log']
+    if shutil.which('gunicorn'):
+        return ['gunicorn', '-w', str(workers), '--threads', str(threads), '-b', bind, '--log-level', 'warning', 'app:app']
+    # 没有 gunicorn 时退回 werkzeug 多线程服务器
+    code = ('import logging; logging.disable(logging.INFO); from werkzeug.serving import run_simple; '
+            'from app import app; run_simple("127.0.0.1", %d, app, threaded=True)' % port)
+    return [sys.executable, '-c', code]
+
+
+def _wait_ready(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + '/health', timeout=1) as resp:
+                if resp.status == 200:
+                    return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[idx]
+
+
+def _load_replay(fixture_dir):
+    """回放用例：cases.json 中的解析输入，以及 index.json 中录制到的图片URL"""
+    with open(os.path.join(fixture_dir, 'cases.json'), 'r', encoding='utf-8') as f:
+        cases = json.load(f)
+    with open(os.path.join(fixture_dir, 'index.json'), 'r', encoding='utf-8') as f:
+        responses = json.load(f).get('responses', [])
+    images = sorted({r['url'] for r in responses if r['method'] == 'GET' and r['status'] == 200
+                     and (r.get('headers') or {}).get('Content-Type', '').startswith('image/')})
+    return {'cases': cases, 'images': images}
+
+
+def _make_request(endpoint, stub_url, i, replay=None):
+    """返回 (method, path, params, json)"""
+    if endpoint == 'health':
+        return 'GET', '/health', None, None
+    if endpoint == 'parse':
+        if replay:
+            cases = replay['cases']
+            return 'POST', '/api/parse', None, {'short_link': cases[i % len(cases)]['input']}
+        # 每次使用不同的笔记ID，避免命中解析缓存
+        return 'POST', '/api/parse', None, {'short_link': '%s/explore/%s' % (stub_url, uuid.uuid4().hex)}
+    if replay:
+        images = replay['images']
+        return 'GET', '/api/image_proxy', {'url': images[i % len(images)]}, None
+    names = _sample_image_names()
+    return 'GET', '/api/image_proxy', {'url': '%s/img/%s' % (stub_url, names[i % len(names)])}, None
+
+
+# ---- 服务进程资源占用（/proc） ----
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _process_tree(root_pid):
+    """root_pid 及其全部子孙进程"""
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % name, 'rb') as f:
+                ppid = int(f.read().rsplit(b')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, ()))
+    return pids
+
+
+def _tree_usage(root_pid):
+    """返回 (CPU秒 = utime + stime, RSS字节)，/proc 不可用时返回 None"""
+    if not os.path.isdir('/proc'):
+        return None
+    cpu = rss = 0
+    for pid in _process_tree(root_pid):
+        try:
+            with open('/proc/%d/stat' % pid, 'rb') as f:
+                fields = f.read().rsplit(b')', 1)[1].split()
+            with open('/proc/%d/statm' % pid, 'rb') as f:
+                rss += int(f.read().split()[1]) * _PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            continue
+        cpu += (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+    return cpu, rss
+
+
+class _UsageSampler:
+    """压测期间定期采样服务进程树的 RSS，记录峰值与 CPU 时间增量"""
+
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.cpu_seconds = None
+        self._start_cpu = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        usage = _tree_usage(self.pid)
+        if usage is not None:
+            self.peak_rss = max(self.peak_rss, usage[1])
+        return usage
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        usage = self._sample()
+        self._start_cpu = usage[0] if usage else None
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        usage = self._sample()
+        if usage is not None and self._start_cpu is not None:
+            self.cpu_seconds = usage[0] - self._start_cpu
+
+
+async def _drive(base_url, endpoint, stub_url, concurrency, total, replay=None):
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(base_url, connector=connector, timeout=aiohttp.ClientTimeout(total=60)) as client:
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                method, path, params, body = _make_request(endpoint, stub_url, i, replay)
+                start = time.perf_counter()
+                try:
+                    async with client.request(method, path, json=body, params=params) as resp:
+                        await resp.read()
+                        if resp.status != 200:
+                            errors += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+async def _verify(base_url, cases):
+    """逐个回放用例，对比解析结果与录制时的结果，返回不一致的用例数"""
+    mismatches = 0
+    async with aiohttp.ClientSession(base_url, timeout=aiohttp.ClientTimeout(total=60)) as client:
+        for case in cases:
+            async with client.post('/api/parse', json={'short_link': case['input']}) as resp:
+                body = await resp.json(content_type=None)
+            if body.get('data') != case['result']:
+                mismatches += 1
+                print('结果不一致: %s\n  录制: %s\n  回放: %s' % (
+                    case['input'], json.dumps(case['result'], ensure_ascii=False)[:300],
+                    json.dumps(body, ensure_ascii=False)[:300]))
+    return mismatches
+
+
+def _start_stub(delay, fixture_dir=None):
+    """桩服务放在独立进程中，避免与压测客户端争抢同一个GIL"""
+    port = _free_port()
+    cmd = [sys.executable, os.path.join(BENCH_DIR, 'stub_upstream.py'), '--port', str(port), '--delay', str(delay)]
+    if fixture_dir:
+        cmd += ['--fixtures', fixture_dir]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return proc, 'http://127.0.0.1:%d' % port
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('桩服务启动失败')
+
+
+def run_mode(mode, args, stub_url, replay=None):
+    port = _free_port()
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    if replay:
+        env.update(_REPLAY_ENV, UPSTREAM_REPLAY_URL=stub_url)
+    proc = subprocess.Popen(_server_command(mode, port, args.workers, args.threads), cwd=BACKEND_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = 'http://127.0.0.1:%d' % port
+    mismatches = None
+    try:
+        if not _wait_ready(base_url):
+            print('%s 模式服务启动失败' % mode)
+            return None
+        if replay and args.verify:
+            mismatches = asyncio.run(_verify(base_url, replay['cases']))
+        with _UsageSampler(proc.pid) as usage:
+            latencies, errors, elapsed = asyncio.run(
+                _drive(base_url, args.endpoint, stub_url, args.concurrency, args.requests, replay))
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return {
+        'mode': mode,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': _percentile(latencies, 50) * 1000,
+        'p95': _percentile(latencies, 95) * 1000,
+        'p99': _percentile(latencies, 99) * 1000,
+        'errors': errors,
+        'rss_mb': usage.peak_rss / 1048576.0 if usage.peak_rss else None,
+        'cpu_ms': usage.cpu_seconds * 1000 / len(latencies) if usage.cpu_seconds is not None and latencies else None,
+        'mismatches': mismatches,
+    }
+
+
+def _format_optional(value, fmt):
+    return fmt % value if value is not None else 'n/a'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='同步/异步服务模式压测对比')
+    parser.add_argument('--mode', choices=('sync', 'async', 'both'), default='both')
+    parser.add_argument('--endpoint', choices=('image_proxy', 'parse', 'health'), default='image_proxy')
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--delay', type=float, default=0.1, help='桩服务每个响应的延迟（秒），模拟慢上游')
+    parser.add_argument('--workers', type=int, default=1, help='服务进程数')
+    parser.add_argument('--threads', type=int, default=8, help='同步模式（gunicorn）每进程线程数')
+    parser.add_argument('--replay', metavar='DIR', help='回放 record_fixtures.py 录制的上游响应（如 bench/fixtures/upstream）')
+    parser.add_argument('--verify', action='store_true', help='回放模式下先逐个校验解析结果与录制时一致')
+    args = parser.parse_args()
+
+    replay = None
+    if args.replay:
+        replay = _load_replay(args.replay)
+        if args.endpoint == 'parse' and not replay['cases']:
+            sys.exit('录制目录中没有解析用例（cases.json）')
+        if args.endpoint == 'image_proxy' and not replay['images']:
+            sys.exit('录制目录中没有图片响应')
+
+    stub_proc, stub_url = _start_stub(args.delay, args.replay)
+    try:
+        modes = ('sync', 'async') if args.mode == 'both' else (args.mode,)
+        rows = [r for r in (run_mode(m, args, stub_url, replay) for m in modes) if r]
+    finally:
+        stub_proc.terminate()
+
+    print('endpoint=%s concurrency=%d requests=%d upstream_delay=%.3fs%s' % (
+        args.endpoint, args.concurrency, args.requests, args.delay, ' replay=%s' % args.replay if replay else ''))
+    print('%-6s %10s %10s %10s %10s %8s %10s %10s' % (
+        'mode', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors', 'peak RSS MB', 'CPU ms/req'))
+    for r in rows:
+        print('%-6s %10.1f %10.1f %10.1f %10.1f %8d %11s %10s' % (
+            r['mode'], r['rps'], r['p50'], r['p95'], r['p99'], r['errors'],
+            _format_optional(r['rss_mb'], '%11.1f'), _format_optional(r['cpu_ms'], '%10.2f')))
+    for r in rows:
+        if r['mismatches'] is not None:
+            print('%s 模式回放校验: %d/%d 个用例结果不一致' % (r['mode'], r['mismatches'], len(replay['cases'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+录制真实上游响应，供 stub_upstream.py 离线回放、loadtest.py --replay 压测使用。
+
+对每个链接执行一次完整解析（短链跳转、笔记/豆包页面、图片探测），再下载解析出的图片，
+期间所有上游响应（含中间跳转）都写入录制目录：
+    index.json      [{method, url, status, headers, body}]（只保留 Location / Content-Type / ETag 等回放需要的响应头）
+    bodies/<sha1>   响应体（按内容去重）
+    cases.json      [{input, result}]：解析输入与当时的解析结果，回放压测时用于校验
+页面 HTML 另存一份到 bench/fixtures/*.html，bench_extract.py 会直接使用。
+
+用法（在 backend 目录下，需要能访问外网）：
+    python bench/record_fixtures.py "http://xhslink.com/a/xxxx" "https://www.doubao.com/thread/xxxx"
+    python bench/record_fixtures.py --links links.txt --max-images 4
+
+Cookie（--cookie）只用于录制时的请求，不会写入录制目录；Set-Cookie 等响应头同样不保存。
+依赖浏览器渲染才能拿到图片的豆包页面无法回放（回放时浏览器渲染池关闭）。
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import app  # noqa: E402
+import upstream  # noqa: E402
+from stub_upstream import DEFAULT_FIXTURE_DIR  # noqa: E402
+
+HTML_FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures')
+RECORDED_HEADERS = ('Location', 'Content-Type', 'ETag', 'Last-Modified', 'Accept-Ranges', 'Cache-Control')
+
+
+class Recorder:
+    """upstream.set_recorder 的回调：同一个 (method, url) 只保留第一次的响应"""
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.responses = []
+        self.pages = []  # (url, body) 页面HTML
+        self._seen = set()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(out_dir, 'bodies'), exist_ok=True)
+
+    def __call__(self, method, url, resp):
+        with self._lock:
+            if (method, url) in self._seen:
+                return
+            self._seen.add((method, url))
+        # 完整读取响应体（stream=True 的调用方随后通过 iter_content 读到的是同一份内容）
+        body = resp.content if method != 'HEAD' else b''
+        digest = None
+        if body:
+            digest = hashlib.sha1(body).hexdigest()
+            path = os.path.join(self.out_dir, 'bodies', digest)
+            if not os.path.exists(path):
+                with open(path, 'wb') as f:
+                    f.write(body)
+        headers = {name: resp.headers[name] for name in RECORDED_HEADERS if name in resp.headers}
+        with self._lock:
+            self.responses.append({'method': method, 'url': url, 'status': resp.status_code,
+                                   'headers': headers, 'body': digest})
+            if resp.status_code == 200 and 'html' in headers.get('Content-Type', ''):
+                self.pages.append((url, body))
+        print('  %-4s %d %s' % (method, resp.status_code, url[:120]))
+
+    def save(self, cases):
+        """与已有录制合并：相同 (method, url) 以本次为准"""
+        index_path = os.path.join(self.out_dir, 'index.json')
+        cases_path = os.path.join(self.out_dir, 'cases.json')
+        old_responses, old_cases = [], []
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                old_responses = json.load(f).get('responses', [])
+        if os.path.exists(cases_path):
+            with open(cases_path, 'r', encoding='utf-8') as f:
+                old_cases = json.load(f)
+
+        recorded = {(r['method'], r['url']) for r in self.responses}
+        responses = [r for r in old_responses if (r['method'], r['url']) not in recorded] + self.responses
+        inputs = {c['input'] for c in cases}
+        cases = [c for c in old_cases if c['input'] not in inputs] + cases
+        with open(index_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'responses': responses}, f, ensure_ascii=False, indent=1)
+        with open(cases_path, 'w', encoding='utf-8') as f:
+            json.dump(cases, f, ensure_ascii=False, indent=1)
+        return len(responses), len(cases)
+
+    def save_pages(self, html_dir):
+        os.makedirs(html_dir, exist_ok=True)
+        for url, body in self.pages:
+            prefix = 'doubao' if 'doubao.com' in url else 'xhs'
+            name = '%s_%s.html' % (prefix, hashlib.sha1(url.encode('utf-8')).hexdigest()[:12])
+            with open(os.path.join(html_dir, name), 'wb') as f:
+                f.write(body)
+
+
+def record_link(link, cookie, max_images):
+    url = app.extract_url_from_text(link)
+    if not url:
+        print('跳过（未找到URL）: %s' % link)
+        return None
+    print('录制: %s' % url)
+    try:
+        result = app.parse_link(url, cookie)
+    except app.ParseError as e:
+        print('  解析失败（%s），只保留已录制的响应' % e)
+        return None
+
+    for image_url in app.export_image_urls(result)[:max_images]:
+        try:
+            resp = upstream.http_get(image_url, headers=app.image_proxy_request_headers(image_url, cookie, {}),
+                                     timeout=15)
+            resp.close()
+        except Exception as e:
+            print('  图片下载失败: %s (%s)' % (image_url[:80], e))
+    return {'input': link, 'result': result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='录制真实上游响应（离线回放基准用）')
+    parser.add_argument('links', nargs='*', help='短链或分享文本')
+    parser.add_argument('--links', dest='links_file', help='每行一个链接的文本文件')
+    parser.add_argument('--cookie', default='', help='豆包登录态 Cookie（不会写入录制目录）')
+    parser.add_argument('--max-images', type=int, default=9, help='每个链接下载的图片数上限')
+    parser.add_argument('--out', default=DEFAULT_FIXTURE_DIR, help='录制目录')
+    parser.add_argument('--no-html', action='store_true', help='不把页面HTML另存到 bench/fixtures/')
+    args = parser.parse_args()
+
+    links = list(args.links)
+    if args.links_file:
+        with open(args.links_file, 'r', encoding='utf-8') as f:
+            links += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    if not links:
+        parser.error('至少需要一个链接')
+
+    logging.disable(logging.WARNING)
+    recorder = Recorder(args.out)
+    upstream.set_recorder(recorder)
+    try:
+        cases = [case for case in (record_link(link, args.cookie, args.max_images) for link in links) if case]
+    finally:
+        upstream.set_recorder(None)
+
+    total, case_count = recorder.save(cases)
+    if not args.no_html:
+        recorder.save_pages(HTML_FIXTURE_DIR)
+    print('本次录制 %d 个响应、%d 个用例；录制目录 %s 共 %d 个响应、%d 个用例' % (
+        len(recorder.responses), len(cases), args.out, total, case_count))
+
+
+if __name__ == '__main__':
+    main()
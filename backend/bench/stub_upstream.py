@@ -0,0 +1,248 @@
+"""
+本地上游桩服务（asyncio 实现，支持 keep-alive 与 Range），用于离线压测，模拟：
+    /s/<id>          短链：302 跳转到 /explore/<id>
+    /explore/<id>    笔记页面（合成HTML，包含 __INITIAL_STATE__）
+    /img/<name>      图片（来自仓库 test/ 目录，支持 Range）
+    /replay/<scheme>/<host><path>
+                     回放 bench/record_fixtures.py 录制的真实上游响应（--fixtures 指定目录），
+                     服务端设置 UPSTREAM_REPLAY_URL 后所有上游请求都会改写到这里
+
+用法：
+    python bench/stub_upstream.py --port 18080 --delay 0.05
+    python bench/stub_upstream.py --port 18080 --fixtures bench/fixtures/upstream
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import re
+import threading
+from urllib.parse import unquote, urljoin, urlparse
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SAMPLE_IMAGE_DIR = os.path.join(REPO_DIR, 'test')
+
+_RANGE = re.compile(r'bytes=(\d*)-(\d*)')
+
+DEFAULT_FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'upstream')
+
+
+def _note_page(note_id, base_url):
+    images = ','.join(
+        '{"url":"%s/img/%s","width":1080}' % (base_url, name) for name in _sample_image_names()[:9]
+    ).replace('/', '\\u002F')
+    filler = '<div class="feed">filler</div>' * 2000
+    return ('<html><head><title>%s</title></head><body>%s<script>window.__INITIAL_STATE__='
+            '{"note":{"note":{"noteId":"%s","imageList":[%s]}}}</script></body></html>'
+            % (note_id, filler, note_id, images)).encode('utf-8')
+
+
+_images = None
+
+
+def _load_images():
+    global _images
+    if _images is None:
+        _images = {}
+        for path in sorted(glob.glob(os.path.join(SAMPLE_IMAGE_DIR, '*'))):
+            with open(path, 'rb') as f:
+                _images[os.path.basename(path)] = f.read()
+    return _images
+
+
+def _sample_image_names():
+    return list(_load_images().keys())
+
+
+def _apply_range(status, headers, data, range_header):
+    """对完整的 200 响应应用 Range 请求头"""
+    rng = _RANGE.match(range_header or '')
+    if status != 200 or not rng or not data:
+        return status, headers, data
+    start = int(rng.group(1) or 0)
+    end = int(rng.group(2)) if rng.group(2) else len(data) - 1
+    end = min(end, len(data) - 1)
+    headers = dict(headers, **{'Content-Range': 'bytes %d-%d/%d' % (start, end, len(data))})
+    return 206, headers, data[start:end + 1]
+
+
+class FixtureStore:
+    """
+    录制的上游响应（bench/record_fixtures.py 生成）：
+        index.json      [{method, url, status, headers, body}]，body 为响应体的 sha1（无响应体时为 null）
+        bodies/<sha1>   响应体
+    """
+
+    def __init__(self, fixture_dir):
+        self.fixture_dir = fixture_dir
+        with open(os.path.join(fixture_dir, 'index.json'), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self._entries = {}
+        self.size = len(index.get('responses', []))
+        for entry in index.get('responses', []):
+            self._entries.setdefault((entry['method'], entry['url']), entry)
+            self._entries.setdefault((entry['method'], unquote(entry['url'])), entry)
+        self._bodies = {}
+
+    def _body(self, digest):
+        if not digest:
+            return b''
+        data = self._bodies.get(digest)
+        if data is None:
+            with open(os.path.join(self.fixture_dir, 'bodies', digest), 'rb') as f:
+                data = f.read()
+            self._bodies[digest] = data
+        return data
+
+    def lookup(self, method, url):
+        """返回 (status, headers, body)，没有录制时返回 None；HEAD 没有单独录制时使用 GET 的记录"""
+        for m in ((method, 'GET') if method == 'HEAD' else (method,)):
+            entry = self._entries.get((m, url)) or self._entries.get((m, unquote(url)))
+            if entry is not None:
+                return entry['status'], dict(entry.get('headers') or {}), self._body(entry.get('body'))
+        return None
+
+
+class StubUpstream:
+    """可在线程中运行的桩服务；routes 可追加自定义处理函数 (path正则 -> handler)"""
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0.0):
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.request_count = 0
+        self.replay_misses = 0
+        self.fixtures = None
+        self.routes = [
+            (re.compile(r'^/s/([^/?]+)'), self._short_link),
+            (re.compile(r'^/explore/([^/?]+)'), self._note),
+            (re.compile(r'^/img/([^/?]+)'), self._image),
+        ]
+        self._loop = None
+        self._server = None
+        self._ready = threading.Event()
+
+    @property
+    def base_url(self):
+        return 'http://%s:%d' % (self.host, self.port)
+
+    def load_fixtures(self, fixture_dir):
+        """启用录制回放：/replay/<scheme>/<host><path> 按 (method, 原始URL) 返回录制的响应"""
+        self.fixtures = FixtureStore(fixture_dir)
+        self.routes.insert(0, (re.compile(r'^/replay/(https?)/([^/?]+)(.*)$'), self._replay))
+        return self
+
+    def replay_url(self, url):
+        parsed = urlparse(url)
+        return '%s/replay/%s/%s%s' % (self.base_url, parsed.scheme, parsed.netloc, url.split(parsed.netloc, 1)[1])
+
+    # ---- 路由 ----
+
+    def _short_link(self, m, method, headers):
+        return 302, {'Location': '/explore/' + m.group(1)}, b''
+
+    def _note(self, m, method, headers):
+        return 200, {'Content-Type': 'text/html; charset=utf-8'}, _note_page(m.group(1), self.base_url)
+
+    def _image(self, m, method, headers):
+        name = unquote(m.group(1))
+        data = _load_images().get(name)
+        if data is None:
+            return 404, {}, b'not found'
+        ctype = 'image/webp' if name.endswith('.webp') else 'image/jpeg'
+        out = {'Content-Type': ctype, 'Accept-Ranges': 'bytes', 'ETag': '"%x"' % len(data)}
+        return _apply_range(200, out, data, headers.get('range'))
+
+    def _replay(self, m, method, headers):
+        url = '%s://%s%s' % m.groups()
+        found = self.fixtures.lookup(method, url)
+        if found is None:
+            self.replay_misses += 1
+            return 404, {}, b'not recorded'
+        status, out, body = found
+        location = out.get('Location')
+        if location:
+            # 跳转目标同样指回桩服务，客户端跟随跳转时不会访问真实上游
+            out['Location'] = self.replay_url(urljoin(url, location))
+        return _apply_range(status, out, body, headers.get('range'))
+
+    # ---- HTTP ----
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    k, _, v = line.decode('latin-1').partition(':')
+                    headers[k.strip().lower()] = v.strip()
+                length = int(headers.get('content-length') or 0)
+                if length:
+                    await reader.readexactly(length)
+
+                self.request_count += 1
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                status, out_headers, body = 404, {}, b'not found'
+                for pattern, handler in self.routes:
+                    m = pattern.match(path)
+                    if m:
+                        status, out_headers, body = handler(m, method, headers)
+                        break
+
+                out_headers.setdefault('Content-Type', 'text/plain')
+                out_headers['Content-Length'] = str(len(body))
+                head = 'HTTP/1.1 %d X\r\n' % status + ''.join('%s: %s\r\n' % kv for kv in out_headers.items()) + '\r\n'
+                writer.write(head.encode('latin-1'))
+                if method != 'HEAD':
+                    writer.write(body)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start_in_thread(self):
+        """在后台线程中启动，返回 self（port 已确定）"""
+        def _run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._serve())
+
+        threading.Thread(target=_run, daemon=True, name='stub-upstream').start()
+        self._ready.wait(10)
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地上游桩服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--delay', type=float, default=0.0, help='每个响应的人为延迟（秒）')
+    parser.add_argument('--fixtures', help='录制的上游响应目录（启用 /replay/ 回放）')
+    args = parser.parse_args()
+    stub = StubUpstream(args.host, args.port, args.delay)
+    if args.fixtures:
+        stub.load_fixtures(args.fixtures)
+        print('replaying %d recorded responses from %s' % (stub.fixtures.size, args.fixtures))
+    print('stub upstream on %s:%d' % (args.host, args.port))
+    asyncio.run(stub._serve())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+"""
+常驻 Playwright 浏览器池
+每个工作线程持有一个已启动的 Chromium（Playwright 同步API的对象只能在创建它的线程中使用），
+渲染任务通过有界队列分发；同一 Cookie 复用同一个浏览器上下文，不同 Cookie 的上下文互相隔离；
+每个浏览器渲染满 N 个页面后自动重启，避免内存持续增长。
+
+一次导航同时得到：渲染后的 HTML + 加载过程中出现的图片请求URL。
+不再固定 sleep：图片请求出现后，只要一段时间内没有新的图片请求就立即结束等待。
+"""
+import atexit
+import hashlib
+import importlib.util
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+
+from settings import env_int
+
+logger = logging.getLogger(__name__)
+
+BROWSER_POOL_SIZE = env_int('BROWSER_POOL_SIZE', 2)  # 常驻浏览器个数（= 工作线程数），0 表示禁用浏览器渲染
+BROWSER_POOL_QUEUE = env_int('BROWSER_POOL_QUEUE', 16)  # 排队中的渲染任务上限，超过直接拒绝
+BROWSER_MAX_PAGES = env_int('BROWSER_MAX_PAGES', 50)  # 单个浏览器渲染多少页面后重启
+BROWSER_CONTEXT_CACHE = env_int('BROWSER_CONTEXT_CACHE', 4)  # 每个浏览器缓存的上下文（按Cookie区分）个数
+PLAYWRIGHT_NAV_TIMEOUT_MS = env_int('PLAYWRIGHT_NAV_TIMEOUT_MS', 30000)
+PLAYWRIGHT_SETTLE_MS = env_int('PLAYWRIGHT_SETTLE_MS', 8000)  # 导航完成后最多再等多久图片请求
+PLAYWRIGHT_QUIET_MS = env_int('PLAYWRIGHT_QUIET_MS', 500)  # 已看到图片请求后，多久没有新请求就结束
+_POLL_MS = 100
+
+RenderResult = namedtuple('RenderResult', ['html', 'image_urls'])
+
+
+class BrowserPoolBusy(RuntimeError):
+    """渲染队列已满"""
+
+
+class _RenderJob:
+    __slots__ = ('url', 'cookie', 'url_filter', 'min_images', 'future')
+
+    def __init__(self, url, cookie, url_filter, min_images):
+        self.url = url
+        self.cookie = cookie
+        self.url_filter = url_filter
+        self.min_images = min_images
+        self.future = Future()
+
+
+class _BrowserWorker(threading.Thread):
+    """持有一个 Chromium 实例，串行处理渲染任务"""
+
+    def __init__(self, pool, index):
+        super().__init__(name='browser-pool-%d' % index, daemon=True)
+        self.pool = pool
+        self.browser = None
+        self.contexts = OrderedDict()  # cookie摘要 -> BrowserContext
+        self.pages_rendered = 0
+
+    def run(self):
+        from playwright.sync_api import sync_playwright
+
+        playwright = sync_playwright().start()
+        try:
+            while True:
+                job = self.pool._jobs.get()
+                if job is None:
+                    break
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    job.future.set_result(self._render(playwright, job))
+                except Exception as e:
+                    job.future.set_exception(e)
+                    # 浏览器可能已崩溃，下次任务重新启动
+                    self._close_browser()
+                    continue
+                self.pages_rendered += 1
+                if self.pages_rendered >= self.pool.max_pages:
+                    logger.info("浏览器已渲染%d个页面，重启: %s", self.pages_rendered, self.name)
+                    self._close_browser()
+        finally:
+            self._close_browser()
+            playwright.stop()
+
+    def _close_browser(self):
+        for context in self.contexts.values():
+            try:
+                context.close()
+            except Exception:
+                pass
+        self.contexts.clear()
+        if self.browser is not None:
+            try:
+                self.browser.close()
+            except Exception:
+                pass
+        self.browser = None
+        self.pages_rendered = 0
+
+    def _context(self, playwright, cookie):
+        if self.browser is None or not self.browser.is_connected():
+            self._close_browser()
+            self.browser = playwright.chromium.launch(headless=True)
+            self.pool._count('launches')
+        key = hashlib.sha1(cookie.encode('utf-8')).hexdigest() if cookie else ''
+        context = self.contexts.get(key)
+        if context is not None:
+            self.contexts.move_to_end(key)
+            return context
+        context = self.browser.new_context()
+        if cookie:
+            # cookie 字符串透传时，我们不做结构化拆分；只在请求头层面更可靠
+            context.set_extra_http_headers({"Cookie": cookie})
+        self.contexts[key] = context
+        while len(self.contexts) > self.pool.context_cache:
+            _, old = self.contexts.popitem(last=False)
+            try:
+                old.close()
+            except Exception:
+                pass
+        return context
+
+    def _render(self, playwright, job):
+        context = self._context(playwright, job.cookie)
+        page = context.new_page()
+        collected = []
+        seen = set()
+
+        def on_request(req):
+            try:
+                u = req.url
+                if u not in seen and (job.url_filter is None or job.url_filter(u)):
+                    seen.add(u)
+                    collected.append(u)
+            except Exception:
+                pass
+
+        try:
+            page.on("request", on_request)
+            page.goto(job.url, wait_until='domcontentloaded', timeout=self.pool.nav_timeout_ms)
+
+            # 事件驱动等待：已看到足够的图片请求且安静一段时间后立即结束，而不是固定 sleep
+            start = time.monotonic()
+            last_count = len(collected)
+            last_change = start
+            while True:
+                now = time.monotonic()
+                if (now - start) * 1000 >= self.pool.settle_ms:
+                    break
+                if len(collected) != last_count:
+                    last_count = len(collected)
+                    last_change = now
+                elif last_count >= job.min_images and (now - last_change) * 1000 >= self.pool.quiet_ms:
+                    break
+                page.wait_for_timeout(_POLL_MS)  # 期间 Playwright 会继续派发 request 事件
+
+            return RenderResult(page.content(), list(collected))
+        finally:
+            try:
+                page.close()
+            except Exception:
+                pass
+
+
+class BrowserPool:
+    def __init__(self, size=BROWSER_POOL_SIZE, queue_size=BROWSER_POOL_QUEUE, max_pages=BROWSER_MAX_PAGES,
+                 context_cache=BROWSER_CONTEXT_CACHE, nav_timeout_ms=PLAYWRIGHT_NAV_TIMEOUT_MS,
+                 settle_ms=PLAYWRIGHT_SETTLE_MS, quiet_ms=PLAYWRIGHT_QUIET_MS):
+        self.size = size
+        self.max_pages = max_pages
+        self.context_cache = context_cache
+        self.nav_timeout_ms = nav_timeout_ms
+        self.settle_ms = settle_ms
+        self.quiet_ms = quiet_ms
+        self._jobs = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._counters = {'renders': 0, 'rejected': 0, 'launches': 0}
+        self._workers = [_BrowserWorker(self, i) for i in range(size)]
+        for worker in self._workers:
+            worker.start()
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def submit(self, url, cookie='', url_filter=None, min_images=1):
+        """提交渲染任务，返回 Future[RenderResult]；队列已满时抛 BrowserPoolBusy"""
+        job = _RenderJob(url, cookie or '', url_filter, min_images)
+        try:
+            self._jobs.put_nowait(job)
+        except queue.Full:
+            self._count('rejected')
+            raise BrowserPoolBusy('浏览器渲染队列已满')
+        self._count('renders')
+        return job.future
+
+    def render(self, url, cookie='', url_filter=None, min_images=1, timeout=None):
+        """同步等待渲染结果"""
+        if timeout is None:
+            timeout = (self.nav_timeout_ms + self.settle_ms) / 1000.0 + 5
+        return self.submit(url, cookie, url_filter, min_images).result(timeout=timeout)
+
+    def shutdown(self):
+        for _ in self._workers:
+            try:
+                self._jobs.put_nowait(None)
+            except queue.Full:
+                break
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+        data['size'] = self.size
+        data['queued'] = self._jobs.qsize()
+        return data
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_unavailable = False
+
+
+def get_browser_pool():
+    """懒创建全局浏览器池；Playwright 未安装或 BROWSER_POOL_SIZE=0 时返回 None"""
+    global _pool, _pool_unavailable
+    if _pool is not None or _pool_unavailable:
+        return _pool
+    with _pool_lock:
+        if _pool is None and not _pool_unavailable:
+            if BROWSER_POOL_SIZE <= 0 or importlib.util.find_spec('playwright') is None:
+                _pool_unavailable = True
+                return None
+            _pool = BrowserPool()
+            atexit.register(_pool.shutdown)
+            logger.info("Playwright浏览器池已启动: size=%d", _pool.size)
+    return _pool
+
+
+def browser_pool_stats():
+    """浏览器池统计；尚未启动时返回 None（不会因为查询统计而启动浏览器）"""
+    return _pool.stats() if _pool is not None else None
@@ -0,0 +1,159 @@
+"""
+豆包 Cookie 会话存储（sid -> cookie）
+- 内存版：OrderedDict，按最近访问排序。所有会话的TTL相同且访问即续期，
+  所以“最久未访问”就是“最早过期”，过期清理只需从队头弹出，不再每次请求全量扫描；
+  超过容量时同样从队头淘汰（LRU）。
+- SQLite版：多个 worker 共享同一个文件，任一进程创建的 sid 在其他进程中都有效。
+"""
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryCookieStore:
+    def __init__(self, ttl_seconds=1800, max_entries=10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # sid -> (cookie, expires_at)，队头最早过期
+        self._lock = threading.Lock()
+        self._counters = {'created': 0, 'expired': 0, 'evicted': 0}
+
+    def _expire(self, now):
+        """弹出队头已过期的会话（调用方持有锁），均摊 O(1)"""
+        while self._entries:
+            sid, (_, expires_at) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            del self._entries[sid]
+            self._counters['expired'] += 1
+
+    def create(self, cookie):
+        sid = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            self._entries[sid] = (cookie, now + self.ttl_seconds)
+            self._counters['created'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evicted'] += 1
+        return sid
+
+    def get(self, sid):
+        """返回 sid 对应的 Cookie 并续期；不存在或已过期时返回 None"""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            self._entries[sid] = (entry[0], now + self.ttl_seconds)
+            self._entries.move_to_end(sid)
+            return entry[0]
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.time())
+            data = dict(self._counters)
+            data['size'] = len(self._entries)
+        data['backend'] = 'memory'
+        data['max_entries'] = self.max_entries
+        return data
+
+
+class SqliteCookieStore:
+    # 过期/超容量清理最多每隔多少秒执行一次（按 expires_at 索引删除，不逐行扫描）
+    CLEANUP_INTERVAL = 30
+
+    def __init__(self, db_path, ttl_seconds=1800, max_entries=10000):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+        self._counters = {'created': 0, 'expired': 0, 'evicted': 0}
+        conn = self._db()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cookie_sessions ('
+            'sid TEXT PRIMARY KEY, cookie TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS cookie_sessions_expires ON cookie_sessions (expires_at)')
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _maybe_cleanup(self, now):
+        with self._lock:
+            if now - self._last_cleanup < self.CLEANUP_INTERVAL:
+                return
+            self._last_cleanup = now
+        conn = self._db()
+        expired = conn.execute('DELETE FROM cookie_sessions WHERE expires_at <= ?', (now,)).rowcount
+        # 超出容量时淘汰最早过期（即最久未访问）的会话
+        evicted = conn.execute(
+            'DELETE FROM cookie_sessions WHERE sid IN ('
+            'SELECT sid FROM cookie_sessions ORDER BY expires_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,),
+        ).rowcount
+        with self._lock:
+            self._counters['expired'] += max(expired, 0)
+            self._counters['evicted'] += max(evicted, 0)
+
+    def create(self, cookie):
+        sid = uuid.uuid4().hex
+        now = time.time()
+        self._maybe_cleanup(now)
+        self._db().execute(
+            'INSERT INTO cookie_sessions (sid, cookie, expires_at) VALUES (?, ?, ?)',
+            (sid, cookie, now + self.ttl_seconds),
+        )
+        with self._lock:
+            self._counters['created'] += 1
+        return sid
+
+    def get(self, sid):
+        now = time.time()
+        self._maybe_cleanup(now)
+        conn = self._db()
+        row = conn.execute(
+            'SELECT cookie FROM cookie_sessions WHERE sid = ? AND expires_at > ?', (sid, now)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE cookie_sessions SET expires_at = ? WHERE sid = ?', (now + self.ttl_seconds, sid))
+        return row[0]
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+        try:
+            data['size'] = self._db().execute(
+                'SELECT COUNT(*) FROM cookie_sessions WHERE expires_at > ?', (time.time(),)
+            ).fetchone()[0]
+        except sqlite3.Error:
+            data['size'] = None
+        data['backend'] = 'sqlite'
+        data['max_entries'] = self.max_entries
+        return data
+
+
+def create_cookie_store(ttl_seconds=1800, max_entries=10000, db_path=None):
+    """db_path 为空时使用内存存储；SQLite 初始化失败时回退到内存存储"""
+    if db_path:
+        try:
+            return SqliteCookieStore(db_path, ttl_seconds=ttl_seconds, max_entries=max_entries)
+        except sqlite3.Error as e:
+            logger.warning("Cookie会话SQLite存储初始化失败，使用内存存储: %s", str(e))
+    return MemoryCookieStore(ttl_seconds=ttl_seconds, max_entries=max_entries)
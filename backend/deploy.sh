@@ -43,7 +43,8 @@ Type=simple
 User=root
 WorkingDirectory=${PROJECT_DIR}
 Environment="PATH=/usr/local/bin:/usr/bin:/bin"
-ExecStart=$(which gunicorn) -w 4 -b 0.0.0.0:5000 app:app
+ExecStart=$(which gunicorn) -c gunicorn_conf.py app:app
+ExecReload=/bin/kill -HUP \$MAINPID
 Restart=always
 RestartSec=10
 StandardOutput=journal
@@ -0,0 +1,528 @@
+"""
+页面图片提取引擎（小红书 / 豆包）
+所有正则在导入时预编译；状态JSON用“定位标记 + 括号配平”截取，避免 [\\s\\S]*? 回溯；
+小红书状态只按 key 路径定位图片列表并解析这一小段，不再 json.loads 整个状态；
+候选URL只扫描一遍HTML，一次性归入各个URL族，再按原有优先级取用。
+安装了 orjson 时用它解析JSON（可选，未安装时使用标准库 json）。
+"""
+import base64
+import html as _html
+import json
+import logging
+import re
+from urllib.parse import unquote, unquote_plus
+
+from metrics import EXTRACTION_TIER, observe_stage
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# 状态JSON最多扫描的字符数（防止异常页面导致长时间扫描）
+STATE_SCAN_LIMIT = 8 * 1024 * 1024
+
+# JSON 片段扫描：整段字符串作为一个token跳过，只对字符串外的对象/数组括号计数
+_JSON_PATH_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]]')
+_JSON_COLON = re.compile(r'\s*:\s*')
+_JSON_EMPTY_OBJECT = re.compile(r'\{\s*\}')
+_scan_json_value = json.JSONDecoder().scan_once  # C 实现：从指定下标解析一个值，返回 (值, 结束下标)
+
+_XHS_STATE_MARKER = re.compile(r'__INITIAL_STATE__\s*=\s*', re.IGNORECASE)
+
+# 只命中可能属于某个候选族的URL起点：以字面量 "http" 开头，让正则引擎走快速前缀查找，
+# host 前缀与 "xxx":" / content=" 上下文都在C层判断，无关链接不会进入Python逻辑。
+# （协议头按小写匹配；host 前缀不区分大小写）
+_XHS_CANDIDATE_START = re.compile(
+    r'https?://(?:'
+    r'(?i:(?=sns-webpic-|sns-img-|ci\.xiaohongshu\.com/|qimg\.xiaohongshu\.com/|img\.xiaohongshu\.com/))'
+    r'|(?<=:"https://)|(?<=:"http://)|(?<=t="https://)|(?<=t="http://))'
+)
+_URL_TOKEN = re.compile(r'[^"\'<>\s]+')
+_IMAGE_LIST_PREFIX = re.compile(r'"imageList":\s*\[\s*{\s*$', re.IGNORECASE)
+_WIDTH_SUFFIX = re.compile(r'"\s*,\s*"width"', re.IGNORECASE)
+_OG_PROPERTY_PREFIX = re.compile(r'property="og:image"\s+content="$', re.IGNORECASE)
+_OG_NAME_PREFIX = re.compile(r'name="og:image"\s+content="$', re.IGNORECASE)
+_ROOT_URL = re.compile(r'^https?://[^/]+/?$')
+# 上下文前缀最多回看的字符数
+_CONTEXT_WINDOW = 256
+
+# 小红书候选URL族（按优先级排列；名称用于日志与统计）
+XHS_URL_FAMILIES = (
+    'sns_webpic',          # https?://sns-webpic-...
+    'sns_img',             # https?://sns-img-...
+    'json_url_sns',        # "url":"https?://sns-..."
+    'json_original_url',   # "originalUrl":"..."
+    'json_origin_url',     # "originUrl":"..."
+    'json_image_list',     # "imageList":[{"url":"..."
+    'ci_xiaohongshu',      # https?://ci.xiaohongshu.com/...
+    'qimg_xiaohongshu',    # https?://qimg.xiaohongshu.com/...
+    'img_xiaohongshu',     # https?://img.xiaohongshu.com/...
+    'json_url_width',      # "url":"...","width"
+    'og_image_property',   # property="og:image" content="..."
+    'og_image_name',       # name="og:image" content="..."
+)
+
+# host 前缀族：(族下标, 协议之后的前缀)
+_XHS_HOST_FAMILIES = (
+    (0, 'sns-webpic-'),
+    (1, 'sns-img-'),
+    (6, 'ci.xiaohongshu.com/'),
+    (7, 'qimg.xiaohongshu.com/'),
+    (8, 'img.xiaohongshu.com/'),
+)
+
+_DOUBAO_SCRIPT_OPENERS = (
+    re.compile(r'<script[^>]+id="__RENDER_DATA__"[^>]*>', re.IGNORECASE),
+    re.compile(r'<script[^>]+id="__NEXT_DATA__"[^>]*>', re.IGNORECASE),
+)
+_SCRIPT_CLOSE = re.compile(r'</script>', re.IGNORECASE)
+_DOUBAO_URL_TOKEN = re.compile(r'https?://[^\s"\'<>]*', re.IGNORECASE)
+DOUBAO_IMAGE_DOMAINS = ('byteimg.com', 'byteadapters.cn', 'doubaoimg.com')
+
+_BASE64_TEXT = re.compile(r'[A-Za-z0-9+/=]+')
+_WHITESPACE = re.compile(r'\s+')
+
+# 小红书状态中图片列表可能所在的路径（与原先 state.note.note / state.note 下 imageList / images 的取用顺序一致）
+_XHS_IMAGE_LIST_PATHS = (
+    ('note', 'note'),
+    ('note', 'note', 'imageList'),
+    ('note', 'note', 'images'),
+    ('note', 'imageList'),
+    ('note', 'images'),
+)
+
+
+def json_loads(text):
+    """解析JSON：优先 orjson（失败时抛出的 orjson.JSONDecodeError 同样是 ValueError 的子类）"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def find_json_value_end(text, start, limit=STATE_SCAN_LIMIT):
+    """从 text[start] 处的 '{' 或 '[' 做括号配平，返回值结束位置（不含）；不完整/超限返回 -1"""
+    if start >= len(text) or text[start] not in '{[':
+        return -1
+    end_bound = min(len(text), start + limit)
+    depth = 0
+    for m in _JSON_PATH_TOKEN.finditer(text, start, end_bound):
+        c = text[m.start()]
+        if c == '{' or c == '[':
+            depth += 1
+        elif c == '}' or c == ']':
+            depth -= 1
+            if depth == 0:
+                return m.end()
+    return -1
+
+
+def _skip_json_value(text, start, end_bound):
+    """跳过 text[start] 处的整个对象/数组，返回结束位置；优先用标准库的C解析器，遇到非法JSON时退回逐token配平"""
+    try:
+        return _scan_json_value(text, start)[1]
+    except (StopIteration, ValueError):
+        return find_json_value_end(text, start, end_bound - start)
+
+
+def locate_json_paths(text, start, paths, limit=STATE_SCAN_LIMIT):
+    """
+    在 text[start] 处的JSON对象中，一次扫描定位多个 key 路径（只经过对象，不进入数组），
+    返回 {路径元组: 值的起始下标}。不在路径上的对象/数组整体跳过；
+    所有路径共同前缀所在的对象结束后立即停止，不会扫完整个状态。
+    """
+    found = {}
+    if start >= len(text) or text[start] != '{':
+        return found
+    trie = {}
+    for path in paths:
+        node = trie
+        for key in path:
+            node = node.setdefault(key, {})
+
+    stack = []  # 路径上每层对象对应的 (trie节点, 路径)
+    pending = None  # 刚匹配到的 key：(值起始下标, trie子节点, 路径)
+    end_bound = min(len(text), start + limit)
+    pos = start
+    while True:
+        m = _JSON_PATH_TOKEN.search(text, pos, end_bound)
+        if m is None:
+            break
+        pos = m.end()
+        c = text[m.start()]
+        if c == '{' or c == '[':
+            if not stack:
+                stack.append((trie, ()))
+            elif c == '{' and pending is not None and pending[0] == m.start():
+                stack.append(pending[1:])
+            else:
+                pos = _skip_json_value(text, m.start(), end_bound)
+                if pos == -1:
+                    break
+            pending = None
+        elif c == '}' or c == ']':
+            node, path = stack.pop()
+            if not stack or (len(path) == 1 and len(trie) == 1):
+                break
+        else:
+            node, path = stack[-1]
+            key = m.group()[1:-1]
+            child = node.get(key)
+            if child is None:
+                continue
+            colon = _JSON_COLON.match(text, m.end())
+            if colon is None:
+                continue  # 不是 key（值恰好与 key 同名）
+            key_path = path + (key,)
+            found.setdefault(key_path, colon.end())
+            pending = (colon.end(), child, key_path) if child else None
+    return found
+
+
+def _json_slice(text, start):
+    """解析 text[start:] 处的一个对象/数组；失败返回 None"""
+    end = find_json_value_end(text, start)
+    if end == -1:
+        return None
+    try:
+        return json_loads(text[start:end])
+    except ValueError:
+        return None
+
+
+def find_xhs_image_list(html):
+    """
+    定位 __INITIAL_STATE__ 中笔记的图片列表并只解析这一段（不解析整个状态）。
+    找到状态对象时返回列表（可能为空），没有状态对象返回 None。
+    """
+    pos = 0
+    while True:
+        m = _XHS_STATE_MARKER.search(html, pos)
+        if not m:
+            return None
+        pos = m.end()
+        if not html.startswith('{', pos):
+            continue
+        found = locate_json_paths(html, pos, _XHS_IMAGE_LIST_PATHS)
+        note_note = found.get(('note', 'note'))
+        if note_note is not None and html.startswith('{', note_note) and not _JSON_EMPTY_OBJECT.match(html, note_note):
+            prefix = ('note', 'note')
+        else:
+            prefix = ('note',)
+        for key in ('imageList', 'images'):
+            start = found.get(prefix + (key,))
+            if start is not None and html.startswith('[', start):
+                image_list = _json_slice(html, start)
+                if image_list:
+                    return image_list
+        return []
+
+
+def _xhs_urls_from_image_list(image_list):
+    images = []
+    for img in image_list:
+        url = img.get('url') or img.get('originalUrl') or img.get('originUrl') or img.get('info', {}).get('url', '')
+        if url and url.startswith('http'):
+            images.append(url)
+    return images
+
+
+def scan_xhs_url_families(html):
+    """一次扫描HTML，把每个URL出现位置归入所有匹配的候选族，返回与 XHS_URL_FAMILIES 对齐的列表"""
+    buckets = [[] for _ in XHS_URL_FAMILIES]
+    for m in _XHS_CANDIDATE_START.finditer(html):
+        s = m.start()
+        rest_start = m.end()
+        rest = html[rest_start:rest_start + 24].lower()
+
+        token = None
+        for idx, prefix in _XHS_HOST_FAMILIES:
+            if rest.startswith(prefix):
+                if token is None:
+                    token = html[s:_URL_TOKEN.match(html, s).end()]
+                if len(token) > rest_start - s + len(prefix):
+                    buckets[idx].append(token)
+
+        # 带引号的JSON/属性值：捕获到下一个双引号为止
+        q = html.find('"', rest_start)
+        if q <= rest_start:
+            continue
+        quoted = None
+        prev = html[max(0, s - 16):s].lower()
+        if prev.endswith('"url":"'):
+            quoted = html[s:q]
+            if rest.startswith('sns-') and q > rest_start + 4:
+                buckets[2].append(quoted)
+            if _IMAGE_LIST_PREFIX.search(html, max(0, s - 7 - _CONTEXT_WINDOW), s - 7):
+                buckets[5].append(quoted)
+            if _WIDTH_SUFFIX.match(html, q):
+                buckets[9].append(quoted)
+        elif prev.endswith('"originalurl":"'):
+            buckets[3].append(html[s:q])
+        elif prev.endswith('"originurl":"'):
+            buckets[4].append(html[s:q])
+        elif prev.endswith('content="'):
+            window = max(0, s - _CONTEXT_WINDOW)
+            if _OG_PROPERTY_PREFIX.search(html, window, s):
+                buckets[10].append(html[s:q])
+            if _OG_NAME_PREFIX.search(html, window, s):
+                buckets[11].append(html[s:q])
+    return buckets
+
+
+def _is_xhs_image_url(m):
+    return ('sns-' in m or 'xiaohongshu.com' in m or 'xhscdn.com' in m) and m.startswith('http')
+
+
+def extract_images_from_html(html):
+    """从HTML中提取图片URL"""
+    if not html:
+        return []
+
+    images = []
+
+    # 1. 尝试提取 __INITIAL_STATE__ 中的图片（标记定位 + 按路径截取图片列表，只解析这一段）
+    #    页面里的 \u002F、\/ 都是合法的JSON转义，解析时直接还原为 '/'
+    try:
+        with observe_stage('state_json_parse'):
+            image_list = find_xhs_image_list(html)
+            if image_list:
+                images = _xhs_urls_from_image_list(image_list)
+            elif image_list is not None:
+                logger.warning("__INITIAL_STATE__中未找到图片列表，尝试正则提取")
+        if images:
+            logger.info("从__INITIAL_STATE__提取到 %d 张图片", len(images))
+            EXTRACTION_TIER.inc('xhs', 'initial_state')
+            return images
+    except Exception as e:
+        logger.warning("解析__INITIAL_STATE__失败: %s", str(e))
+
+    # 2. 一次扫描收集所有候选族，按优先级取第一个有效的族
+    tier = 'none'
+    with observe_stage('regex_fallback'):
+        for name, matches in zip(XHS_URL_FAMILIES, scan_xhs_url_families(html)):
+            # 过滤掉非图片URL
+            valid_matches = [m for m in matches if _is_xhs_image_url(m)]
+            if valid_matches:
+                images.extend(valid_matches)
+                tier = 'regex:' + name
+                logger.info("通过正则匹配(%s)提取到 %d 个URL", name, len(valid_matches))
+                break
+
+    # 保序去重并过滤（不能用 set，set 会打乱小红书原始顺序）
+    ordered_images = []
+    seen = set()
+    for img in images:
+        if not (img and img.startswith('http') and ('sns-img' in img or 'xiaohongshu.com' in img or 'xhscdn.com' in img)):
+            continue
+        # 排除纯域名根路径、样式拼接串等“非真实图片URL”
+        if _ROOT_URL.match(img.strip()) or ');background' in img:
+            continue
+        if img in seen:
+            continue
+        seen.add(img)
+        ordered_images.append(img)
+    images = ordered_images
+
+    if images:
+        logger.info("总共提取到 %d 张图片", len(images))
+    else:
+        tier = 'none'
+    EXTRACTION_TIER.inc('xhs', tier)
+
+    return images
+
+
+def iter_urls_from_json(obj, domains):
+    """
+    迭代遍历JSON对象（显式栈，不递归），按深度优先顺序产出对象字段中指定域名的图片URL。
+    与原递归实现一致：只看对象字段的字符串值，数组里直接放的字符串不算。
+    """
+    if not isinstance(obj, (dict, list)):
+        return
+    stack = [(iter(obj.values()) if isinstance(obj, dict) else iter(obj), isinstance(obj, dict))]
+    while stack:
+        values, in_dict = stack[-1]
+        for v in values:
+            if isinstance(v, str):
+                if in_dict and v.startswith('http') and any(d in v for d in domains):
+                    yield v
+            elif isinstance(v, dict):
+                stack.append((iter(v.values()), True))
+                break
+            elif isinstance(v, list):
+                stack.append((iter(v), False))
+                break
+        else:
+            stack.pop()
+
+
+def _strip_quotes(text):
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in '"\'':
+        return text[1:-1]
+    return None
+
+
+def _decode_base64(text):
+    base = _WHITESPACE.sub('', text)
+    if len(base) <= 100 or not _BASE64_TEXT.fullmatch(base):
+        return None
+    try:
+        return base64.b64decode(base + '===').decode('utf-8', errors='ignore')  # 容错 padding
+    except Exception:
+        return None
+
+
+# 宽松解码方式（原有的尝试顺序）
+_LOOSE_DECODERS = (
+    ('raw', lambda t: t),
+    ('unquoted', _strip_quotes),  # 去掉可能包裹的引号
+    ('url', unquote),  # URL 编码
+    ('url_plus', unquote_plus),  # URL 编码（加号表示空格）
+    ('escape', lambda t: t.encode('utf-8', errors='ignore').decode('unicode_escape', errors='ignore')),  # 反斜杠转义
+    ('base64', _decode_base64),
+)
+
+
+def _guess_loose_encoding(text):
+    """按开头字符猜最可能的编码方式"""
+    head = text[:1]
+    if head in ('{', '['):
+        return 'raw'
+    if head == '%':
+        return 'url'
+    if head in ('"', "'"):
+        return 'escape' if '\\"' in text[:64] else 'unquoted'
+    if _BASE64_TEXT.match(text[:64]) and _decode_base64(text[:128]) is not None:
+        return 'base64'
+    return 'raw'
+
+
+def _try_parse_json_loose(text):
+    """
+    尽可能从脚本文本中解析JSON（支持URL编码/转义/base64等常见形式）。
+    先只用猜出的那一种方式解码；失败时才按原顺序依次尝试其余方式（每种方式用到时才解码）。
+    """
+    if not text:
+        return None
+    text = text.strip()
+    guess = _guess_loose_encoding(text)
+    decoders = sorted(_LOOSE_DECODERS, key=lambda item: item[0] != guess)
+
+    seen = set()
+    for _, decode in decoders:
+        candidate = decode(text)
+        if not candidate or candidate in seen:
+            continue
+        seen.add(candidate)
+        try:
+            return json_loads(candidate)
+        except Exception:
+            continue
+    return None
+
+
+def find_doubao_state_script(html):
+    """按优先级定位 __RENDER_DATA__ / __NEXT_DATA__ 脚本内容；找不到返回 None"""
+    for opener in _DOUBAO_SCRIPT_OPENERS:
+        m = opener.search(html)
+        if not m:
+            continue
+        close = _SCRIPT_CLOSE.search(html, m.end())
+        if close:
+            return html[m.end():close.start()]
+    return None
+
+
+def _unescaped_url_tokens(token):
+    """对单个URL片段做HTML实体解码（&amp; 会破坏签名参数）；解码出的引号/尖括号处重新切分"""
+    if '&' not in token:
+        return (token,)
+    return _DOUBAO_URL_TOKEN.findall(_html.unescape(token))
+
+
+def scan_doubao_urls(html):
+    """
+    一次扫描HTML，按 DOUBAO_IMAGE_DOMAINS 顺序返回各域名的候选URL列表。
+    只对命中的URL片段做实体解码，不再整页 unescape 复制一份HTML。
+    """
+    buckets = [[] for _ in DOUBAO_IMAGE_DOMAINS]
+    for m in _DOUBAO_URL_TOKEN.finditer(html):
+        for token in _unescaped_url_tokens(m.group()):
+            lower = token.lower()
+            for idx, domain in enumerate(DOUBAO_IMAGE_DOMAINS):
+                if domain in lower:
+                    buckets[idx].append(token)
+    return buckets
+
+
+def extract_doubao_images_from_html(html):
+    """从豆包thread页面HTML中提取图片URL（尽量获取无水印原图）"""
+    if not html:
+        return []
+
+    images = []
+
+    # HTML实体解码非常关键（豆包页面里常见 &amp; 会破坏签名参数），但只对状态脚本和命中的URL片段做，不整页解码
+
+    # 1. 先尝试从页面中的 JSON 状态脚本中提取（类似小红书 __INITIAL_STATE__）
+    try:
+        json_text = find_doubao_state_script(html)
+        if json_text is not None:
+            json_text = _html.unescape(json_text).strip()
+            logger.info("豆包页面找到JSON脚本，长度: %d", len(json_text))
+
+        if json_text:
+            state_obj = _try_parse_json_loose(json_text)
+            if state_obj is None:
+                logger.warning("豆包JSON解析失败（多种解码方式均失败），将使用正则继续提取")
+            else:
+                images.extend(iter_urls_from_json(state_obj, DOUBAO_IMAGE_DOMAINS))
+    except Exception as e:
+        logger.warning("豆包JSON脚本解析异常: %s", str(e))
+
+    # 2. 直接从HTML文本中匹配图片URL（兜底，一次扫描覆盖所有域名）
+    for domain, matches in zip(DOUBAO_IMAGE_DOMAINS, scan_doubao_urls(html)):
+        if matches:
+            logger.info("豆包页面通过正则匹配到 %d 个候选URL（%s）", len(matches), domain)
+            images.extend(matches)
+
+    # 3. 去重、清洗（保留查询参数，避免破坏签名；仅做最小处理）
+    cleaned = []
+    for u in images:
+        if not u.startswith('http'):
+            continue
+
+        # 豆包经常返回带处理后缀的“水印/缩略图”URL，例如：
+        # ...jpeg~tplv-xxx-downsize_watermark_...png?x-signature=...
+        # 尝试生成“无水印候选”：去掉 "~tplv-..." 到 "?" 之前的部分，同时保留 query 参数（签名）。
+        q = ''
+        base = u
+        if '?' in u:
+            base, q = u.split('?', 1)
+            q = '?' + q
+
+        # 去掉处理后缀（从 ~tplv- 开始到结尾）
+        if '~tplv-' in base:
+            base_no_tplv = base.split('~tplv-', 1)[0]
+            cleaned.append(base_no_tplv + q)  # 优先加入“疑似无水印原图”
+
+        cleaned.append(u)  # 同时保留原始URL兜底
+
+    # 去重，但尽量保持顺序（先保留无水印候选）
+    seen = set()
+    ordered = []
+    for u in cleaned:
+        if u in seen:
+            continue
+        seen.add(u)
+        ordered.append(u)
+
+    cleaned = ordered
+
+    if cleaned:
+        logger.info("豆包页面最终提取到 %d 张图片", len(cleaned))
+
+    return cleaned
@@ -0,0 +1,66 @@
+"""
+gunicorn 生产配置（替代 python app.py 的 werkzeug 开发服务器）
+
+启动（在 backend 目录下，需要 pip install gunicorn，仅 Linux/macOS）：
+    gunicorn -c gunicorn_conf.py app:app
+
+- 进程 × 线程：默认每个 CPU 核一个 worker 进程，每个进程 8 个线程（gthread），等待上游时不占用 CPU
+- 预加载：master 进程先导入应用并预热正则，再 fork 出 worker（代码段与只读数据写时复制共享）
+- fork 之后：每个 worker 丢弃继承的上游会话和转码进程池，重新建立自己的会话池
+- 回收：每个 worker 处理 GUNICORN_MAX_REQUESTS 个请求后平滑退出并由 master 补齐，
+  Playwright 浏览器和内存碎片随进程一起释放
+- 平滑重启：kill -HUP <master pid>，旧 worker 处理完手上的请求再退出（预加载模式下 HUP 不会重新加载代码，
+  更新代码后请重启，或设置 GUNICORN_PRELOAD=0）
+- HTTPS：沿用 FLASK_HTTPS / FLASK_SSL_CERT / FLASK_SSL_KEY（gunicorn 不支持自签的 adhoc 证书，必须提供证书文件）
+"""
+import os
+
+from settings import env_bool, env_int, env_str
+
+_cpus = os.cpu_count() or 2
+
+bind = env_str('GUNICORN_BIND') or '0.0.0.0:%d' % env_int('PORT', 5000)
+workers = env_int('GUNICORN_WORKERS', _cpus)
+worker_class = 'gthread'
+threads = env_int('GUNICORN_THREADS', 8)
+# 单个请求的上限：豆包浏览器渲染最长约 30 秒，留出余量
+timeout = env_int('GUNICORN_TIMEOUT', 90)
+graceful_timeout = env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = env_int('GUNICORN_KEEPALIVE', 5)
+max_requests = env_int('GUNICORN_MAX_REQUESTS', 2000)
+max_requests_jitter = env_int('GUNICORN_MAX_REQUESTS_JITTER', 200)  # 错开各 worker 的回收时间
+preload_app = env_bool('GUNICORN_PRELOAD', True)
+
+accesslog = env_str('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = env_str('GUNICORN_LOG_LEVEL') or 'info'
+
+# 进程池/浏览器池按 worker 数均摊，避免 workers × CPU 个转码进程、workers × 2 个浏览器
+os.environ.setdefault('IMAGE_TRANSCODE_WORKERS', str(max(1, _cpus // max(1, workers))))
+if workers > 1:
+    os.environ.setdefault('BROWSER_POOL_SIZE', '1')
+# 同步等待豆包解析的请求最多占一半线程，其余线程留给小红书与图片代理
+os.environ.setdefault('PARSE_EXPENSIVE_SYNC_WAITERS', str(max(1, threads // 2)))
+
+if env_str('FLASK_HTTPS') == '1':
+    certfile = env_str('FLASK_SSL_CERT')
+    keyfile = env_str('FLASK_SSL_KEY')
+    if not (certfile and keyfile):
+        raise SystemExit('FLASK_HTTPS=1 时需要设置 FLASK_SSL_CERT/FLASK_SSL_KEY（gunicorn 不支持 adhoc 证书）')
+
+
+def when_ready(server):
+    """master 就绪、fork worker 之前：预热（预加载模式下 worker 直接继承结果）"""
+    if preload_app:
+        import app
+        app.warm_up()
+    server.log.info("workers=%d threads=%d max_requests=%d", workers, threads, max_requests)
+
+
+def post_fork(server, worker):
+    """worker 进程中执行：不沿用 master 的连接与进程池"""
+    import image_transcode
+    import upstream
+    upstream.reset_sessions()
+    image_transcode.shutdown_pool()
+    upstream.warm_sessions()
@@ -0,0 +1,408 @@
+"""
+图片代理的本地磁盘缓存
+热门图片（预览 -> 保存 -> 重试下载）只向CDN请求一次：完整的 200 响应写入本地目录，
+之后由 send_file 直接从文件返回（gunicorn 下走 sendfile 零拷贝，Range/条件请求由 Flask 处理）。
+总大小超过上限时按最近最少使用淘汰；同一图片的并发未命中合并为一次上游请求。
+回源既可以交给 get_or_fill（下载完整图片后返回），也可以用 begin_fill 由调用方边转发给客户端边写入。
+多个 worker 进程共享同一目录：每个进程的内存索引只看得到自己写入/加载的文件，
+因此另有按目录的定期清扫（文件锁保证同一时刻只有一个进程清扫），按文件修改时间淘汰，
+命中时刷新修改时间，使整个目录的总大小不超过上限。
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+try:
+    import fcntl
+except ImportError:  # Windows 上只按进程内索引淘汰
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_DATA_SUFFIX = '.img'
+_META_SUFFIX = '.json'
+_SWEEP_LOCK_NAME = '.sweep.lock'
+_TOUCH_INTERVAL = 60  # 命中时最多每隔这么久刷新一次文件修改时间（秒）
+
+
+def image_cache_key(url, cookie='', variant=''):
+    """
+    缓存key：host + path（签名/过期时间等查询参数不参与，同一张图的不同签名共用缓存），
+    带 Cookie 的请求按 Cookie 摘要隔离，避免登录态才能看到的图片被其他用户命中；
+    缩略图/转码结果按 variant 区分。
+    """
+    parsed = urlparse(url)
+    base = '{}{}'.format((parsed.hostname or '').lower(), parsed.path)
+    if cookie:
+        base += '#' + hashlib.sha1(cookie.encode('utf-8')).hexdigest()[:16]
+    if variant:
+        base += '|' + variant
+    return hashlib.sha256(base.encode('utf-8')).hexdigest()
+
+
+class CachedImage:
+    __slots__ = ('path', 'size', 'content_type', 'etag', 'last_modified', 'touched_at')
+
+    def __init__(self, path, size, content_type, etag=None, last_modified=None, touched_at=None):
+        self.path = path
+        self.size = size
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.touched_at = touched_at if touched_at is not None else time.time()
+
+
+class ImageCache:
+    """
+    磁盘 LRU 缓存；索引在内存中，启动时按文件修改时间重建。
+    max_bytes 是整个目录的上限：写入后最多每 sweep_interval 秒清扫一次目录（多进程共享目录时生效）。
+    """
+
+    def __init__(self, root, max_bytes=512 * 1024 * 1024, max_entry_bytes=20 * 1024 * 1024, sweep_interval=30):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.sweep_interval = sweep_interval
+        self._entries = OrderedDict()  # key -> CachedImage
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> threading.Event，正在回源的key
+        self._last_sweep = time.monotonic()
+        self._counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'fills': 0, 'fill_errors': 0, 'evictions': 0,
+                          'sweeps': 0, 'sweep_evictions': 0}
+        os.makedirs(root, exist_ok=True)
+        self._load_index()
+
+    # ---- 索引 ----
+
+    def _paths(self, key):
+        base = os.path.join(self.root, key)
+        return base + _DATA_SUFFIX, base + _META_SUFFIX
+
+    def _load_index(self):
+        found = []
+        for name in os.listdir(self.root):
+            if not name.endswith(_META_SUFFIX):
+                continue
+            key = name[:-len(_META_SUFFIX)]
+            data_path, meta_path = self._paths(key)
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                st = os.stat(data_path)
+            except (OSError, ValueError):
+                self._remove_files(key)
+                continue
+            found.append((st.st_mtime, key, CachedImage(
+                data_path, st.st_size, meta.get('content_type') or 'image/jpeg',
+                meta.get('etag'), meta.get('last_modified'), st.st_mtime,
+            )))
+        found.sort(key=lambda item: item[0])
+        for _, key, entry in found:
+            self._entries[key] = entry
+            self._total_bytes += entry.size
+        self._evict()
+        if found:
+            logger.info("图片缓存索引已加载: %d个文件, %.1fMB", len(self._entries), self._total_bytes / 1048576)
+
+    def _remove_files(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict(self):
+        """超出总大小上限时淘汰最久未使用的条目（调用方持有锁或处于初始化阶段）"""
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            self._total_bytes -= entry.size
+            self._counters['evictions'] += 1
+            self._remove_files(key)
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not os.path.exists(entry.path):
+                # 多 worker 共享目录时可能已被其他进程淘汰
+                del self._entries[key]
+                self._total_bytes -= entry.size
+                return None
+            self._entries.move_to_end(key)
+            touch = time.time() - entry.touched_at > _TOUCH_INTERVAL
+            if touch:
+                entry.touched_at = time.time()
+        if touch:
+            # 目录清扫按修改时间淘汰：命中刷新修改时间，其他进程清扫时也能看到这次使用
+            try:
+                os.utime(entry.path)
+            except OSError:
+                pass
+        return entry
+
+    def _maybe_sweep(self):
+        """距上次清扫超过 sweep_interval 时清扫目录；其他进程正在清扫时跳过"""
+        if fcntl is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+        try:
+            lock_file = open(os.path.join(self.root, _SWEEP_LOCK_NAME), 'a+')
+        except OSError:
+            return
+        try:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            try:
+                self._sweep()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            lock_file.close()
+
+    def _sweep(self):
+        """统计整个目录（包括其他进程写入的文件），超过 max_bytes 时按修改时间从旧到新删除"""
+        files = []
+        total = 0
+        for name in os.listdir(self.root):
+            if not name.endswith(_DATA_SUFFIX):
+                continue
+            try:
+                st = os.stat(os.path.join(self.root, name))
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, name[:-len(_DATA_SUFFIX)]))
+            total += st.st_size
+        removed = 0
+        if total > self.max_bytes:
+            files.sort()
+            for _, size, key in files:
+                if total <= self.max_bytes:
+                    break
+                self._remove_files(key)
+                total -= size
+                removed += 1
+                with self._lock:
+                    entry = self._entries.pop(key, None)
+                    if entry is not None:
+                        self._total_bytes -= entry.size
+        with self._lock:
+            self._counters['sweeps'] += 1
+            self._counters['sweep_evictions'] += removed
+        if removed:
+            logger.info("图片缓存目录清扫: 删除%d个文件, 剩余%.1fMB", removed, total / 1048576)
+
+    # ---- 对外接口 ----
+
+    def get(self, key):
+        entry = self._lookup(key)
+        with self._lock:
+            self._counters['hits' if entry is not None else 'misses'] += 1
+        return entry
+
+    def contains(self, key):
+        """是否已缓存（不计入命中/未命中统计，供后台预取判断）"""
+        return self._lookup(key) is not None
+
+    def get_or_fill(self, key, fill, wait_timeout=20):
+        """
+        命中直接返回；未命中时只有一个线程调用 fill(writer) 回源写入，其余线程等待结果。
+        fill 返回 (content_type, etag, last_modified)，返回 None 表示不缓存（例如非200响应）。
+        回源失败 / 不可缓存时返回 None，调用方自行直连上游。
+        """
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+
+        with self._lock:
+            event = self._inflight.get(key)
+            leader = event is None
+            if leader:
+                event = threading.Event()
+                self._inflight[key] = event
+            else:
+                self._counters['coalesced'] += 1
+
+        if not leader:
+            event.wait(wait_timeout)
+            return self._lookup(key)
+
+        try:
+            return self._fill(key, fill)
+        finally:
+            self._end_fill(key, event)
+
+    def begin_fill(self, key):
+        """
+        由调用方自己回源写入（边转发给客户端边缓存）：返回 CacheFill；同一key已在回源时返回 None。
+        调用方读完响应后 commit()，不可缓存或中途失败时 abort()；两者都会唤醒在 get_or_fill 中等待的线程。
+        """
+        with self._lock:
+            if key in self._inflight:
+                return None
+            event = threading.Event()
+            self._inflight[key] = event
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        except OSError as e:
+            self._end_fill(key, event)
+            logger.warning("图片缓存创建临时文件失败: %s", str(e))
+            return None
+        return CacheFill(self, key, event, os.fdopen(fd, 'wb'), tmp_path)
+
+    def _end_fill(self, key, event):
+        with self._lock:
+            self._inflight.pop(key, None)
+        event.set()
+
+    def _fill(self, key, fill):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                meta = fill(_LimitedWriter(f, self.max_entry_bytes))
+            if meta is None:
+                return None
+            entry = self._commit(key, tmp_path, *meta)
+            tmp_path = None
+            return entry
+        except EntryTooLarge:
+            return None
+        except Exception as e:
+            with self._lock:
+                self._counters['fill_errors'] += 1
+            logger.warning("图片缓存回源失败: %s", str(e))
+            return None
+        finally:
+            if tmp_path is not None:
+                _remove_quietly(tmp_path)
+
+    def _commit(self, key, tmp_path, content_type, etag, last_modified):
+        """把写完的临时文件放到 key 的位置并加入索引；返回 CachedImage，被立即淘汰时返回 None"""
+        data_path, meta_path = self._paths(key)
+        size = os.path.getsize(tmp_path)
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'content_type': content_type, 'etag': etag, 'last_modified': last_modified,
+                       'stored_at': time.time()}, f)
+        os.replace(tmp_path, data_path)
+
+        entry = CachedImage(data_path, size, content_type, etag, last_modified)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old.size
+            self._entries[key] = entry
+            self._total_bytes += size
+            self._counters['fills'] += 1
+            self._evict()
+            if key not in self._entries:
+                return None  # 单个文件超过总上限时立即被淘汰
+        self._maybe_sweep()
+        return entry
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._entries)
+            self._entries.clear()
+            self._total_bytes = 0
+        for key in keys:
+            self._remove_files(key)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            data['entries'] = len(self._entries)
+            data['bytes'] = self._total_bytes
+            data['inflight'] = len(self._inflight)
+        data['max_bytes'] = self.max_bytes
+        data['sweep_interval'] = self.sweep_interval
+        return data
+
+
+class CacheFill:
+    """ImageCache.begin_fill 返回的写入句柄，只在一个线程中使用；commit / abort 之后的调用都被忽略"""
+
+    def __init__(self, cache, key, event, f, tmp_path):
+        self._cache = cache
+        self._key = key
+        self._event = event
+        self._f = f
+        self._writer = _LimitedWriter(f, cache.max_entry_bytes)
+        self._tmp_path = tmp_path
+
+    def write(self, chunk):
+        """写入一块；超过单文件上限或磁盘出错时放弃缓存（不影响调用方继续转发）"""
+        if self._tmp_path is None:
+            return
+        try:
+            self._writer.write(chunk)
+        except EntryTooLarge:
+            self.abort()
+        except OSError as e:
+            logger.warning("图片缓存写入失败: %s", str(e))
+            self.abort()
+
+    def commit(self, content_type, etag=None, last_modified=None):
+        """响应体已完整写入：加入缓存，返回 CachedImage（失败或被立即淘汰时返回 None）"""
+        if self._tmp_path is None:
+            return None
+        tmp_path = self._tmp_path
+        try:
+            self._f.close()
+            entry = self._cache._commit(self._key, tmp_path, content_type, etag, last_modified)
+            self._tmp_path = None
+            return entry
+        except Exception as e:
+            with self._cache._lock:
+                self._cache._counters['fill_errors'] += 1
+            logger.warning("图片缓存写入失败: %s", str(e))
+            return None
+        finally:
+            self.abort()
+
+    def abort(self):
+        """丢弃已写入的内容（commit 之后调用无副作用）"""
+        if self._event is None:
+            return
+        self._f.close()
+        if self._tmp_path is not None:
+            _remove_quietly(self._tmp_path)
+            self._tmp_path = None
+        self._cache._end_fill(self._key, self._event)
+        self._event = None
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class EntryTooLarge(Exception):
+    """单个图片超过 max_entry_bytes，不写入缓存"""
+
+
+class _LimitedWriter:
+    def __init__(self, f, limit):
+        self._f = f
+        self._limit = limit
+        self.written = 0
+
+    def write(self, chunk):
+        self.written += len(chunk)
+        if self.written > self._limit:
+            raise EntryTooLarge()
+        self._f.write(chunk)
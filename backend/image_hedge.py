@@ -0,0 +1,205 @@
+"""
+小红书图片的对冲请求（hedged requests）
+同一张图片可以从多个等价的CDN host取到（sns-webpic-* / sns-img-* / ci.xiaohongshu.com），
+个别慢节点决定了图片代理的尾延迟。对冲：主请求在“近期首字节耗时 p95”内没有返回时，
+用同一个图片key（保留样式后缀）拼出等价host的URL再发一个请求，先返回200的胜出，其余响应全部关闭。
+- 预算：每个请求积累 ratio 个额度，发一次对冲消耗 1 个，额外请求数不超过 ratio（默认 5%）
+- 只对冲完整的 GET：带 Range / 条件请求头时各host返回的字节或 ETag 可能不同，不对冲
+- 同步（requests，线程池）与异步（aiohttp，asyncio 任务）两种调用方式共用延迟统计与预算
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+from image_identity import xhs_image_key
+from metrics import IMAGE_HEDGE
+
+logger = logging.getLogger(__name__)
+
+# 出现在请求头中时不对冲
+_NO_HEDGE_HEADERS = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since')
+
+
+def equivalent_image_urls(url, hosts):
+    """
+    同一张图片在其他等价host上的URL（按 hosts 顺序，不含原host）。
+    保留 !样式后缀 与查询参数：样式决定返回哪个版本（webp缩放图 / 原图），
+    对冲请求必须取同一个版本，否则客户端拿到什么取决于哪个请求胜出（且会按主请求的key写入磁盘缓存）。
+    不支持该样式的host返回非200，不会胜出。
+    """
+    key = xhs_image_key(url)
+    if key is None:
+        return []
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    suffix = '!' + parsed.path.split('!', 1)[1] if '!' in parsed.path else ''
+    if parsed.query:
+        suffix += '?' + parsed.query
+    return ['https://{}/{}{}'.format(h, key, suffix) for h in hosts if h != host]
+
+
+class LatencyTracker:
+    """最近 window 个首字节耗时样本，按需计算分位数"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q, min_samples=20):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+class HedgeBudget:
+    """每个请求积累 ratio 个额度（最多 burst 个），一次对冲消耗 1 个"""
+
+    def __init__(self, ratio=0.05, burst=10):
+        self.ratio = ratio
+        self.burst = burst
+        self._credits = 0.0
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._credits = min(self.burst, self._credits + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            if self._credits < 1:
+                return False
+            self._credits -= 1
+            return True
+
+
+class ImageHedger:
+    """
+    hosts: 对冲时可用的等价host（按优先级）；对冲延迟取近期 p95，样本不足时用 default_delay，
+    并限制在 [min_delay, max_delay] 之内。
+    """
+
+    def __init__(self, hosts, ratio=0.05, default_delay=0.3, min_delay=0.05, max_delay=2.0, workers=32):
+        self.hosts = tuple(hosts)
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.latency = LatencyTracker()
+        self.budget = HedgeBudget(ratio)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-hedge')
+
+    def delay(self):
+        p95 = self.latency.quantile(0.95)
+        return min(self.max_delay, max(self.min_delay, p95 if p95 is not None else self.default_delay))
+
+    def _alternate(self, url, headers):
+        """本次请求可用的对冲URL；不满足对冲条件时返回 None"""
+        if any(name in headers for name in _NO_HEDGE_HEADERS):
+            return None
+        alternates = equivalent_image_urls(url, self.hosts)
+        return alternates[0] if alternates else None
+
+    def _timed(self, fetch, url, headers):
+        started = time.perf_counter()
+        resp = fetch(url, headers)
+        self.latency.observe(time.perf_counter() - started)
+        return resp
+
+    # ---- 同步（requests） ----
+
+    def get(self, fetch, url, headers):
+        """
+        fetch(url, headers) 发出请求并返回已收到响应头的响应（stream=True）。
+        返回胜出的响应；两个请求都失败时以主请求的结果为准。
+        """
+        alternate = self._alternate(url, headers)
+        if alternate is None:
+            return fetch(url, headers)
+        self.budget.deposit()
+        primary = self._executor.submit(self._timed, fetch, url, headers)
+        done, _ = wait([primary], timeout=self.delay())
+        if done or not self.budget.try_spend():
+            return primary.result()
+
+        IMAGE_HEDGE.inc('hedged')
+        hedge = self._executor.submit(fetch, alternate, headers)
+        pending = {primary, hedge}
+        finished = []  # 已返回但没有胜出的请求（例如先返回了非200的主请求）
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((f for f in done if f.exception() is None and f.result().status_code == 200), None)
+            finished.extend(f for f in done if f is not winner)
+            if winner is not None:
+                for loser in pending:
+                    loser.add_done_callback(_close_response)
+                for loser in finished:
+                    _close_response(loser)
+                IMAGE_HEDGE.inc('won' if winner is hedge else 'lost')
+                return winner.result()
+        # 都没有成功：返回主请求的结果（或抛出主请求的异常），对冲请求的响应直接关闭
+        IMAGE_HEDGE.inc('failed')
+        _close_response(hedge)
+        return primary.result()
+
+    # ---- 异步（aiohttp） ----
+
+    async def get_async(self, fetch, url, headers, close):
+        """与 get 相同，fetch 为协程函数，close(resp) 释放失败方的响应"""
+        alternate = self._alternate(url, headers)
+        if alternate is None:
+            return await fetch(url, headers)
+        self.budget.deposit()
+        loop = asyncio.get_running_loop()
+
+        async def timed():
+            started = loop.time()
+            resp = await fetch(url, headers)
+            self.latency.observe(loop.time() - started)
+            return resp
+
+        primary = asyncio.ensure_future(timed())
+        done, _ = await asyncio.wait([primary], timeout=self.delay())
+        if done or not self.budget.try_spend():
+            return await primary
+
+        IMAGE_HEDGE.inc('hedged')
+        hedge = asyncio.ensure_future(fetch(alternate, headers))
+        pending = {primary, hedge}
+        finished = []
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = next((t for t in done if t.exception() is None and t.result().status == 200), None)
+            finished.extend(t for t in done if t is not winner)
+            if winner is not None:
+                for loser in pending:
+                    loser.cancel()
+                for loser in finished:
+                    if loser.exception() is None:
+                        close(loser.result())
+                IMAGE_HEDGE.inc('won' if winner is hedge else 'lost')
+                return winner.result()
+        IMAGE_HEDGE.inc('failed')
+        if hedge.exception() is None:
+            close(hedge.result())
+        return primary.result()
+
+    def stats(self):
+        data = {outcome: IMAGE_HEDGE.value(outcome) for outcome in ('hedged', 'won', 'lost', 'failed')}
+        data['delay_ms'] = round(self.delay() * 1000, 1)
+        data['hosts'] = list(self.hosts)
+        return data
+
+
+def _close_response(future):
+    """对冲中失败一方的响应到达后立即关闭（不读取正文）"""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
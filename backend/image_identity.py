@@ -0,0 +1,97 @@
+"""
+图片身份：判断两个URL是不是同一张图片
+同一张图常以不同host、不同 ! 样式后缀、带或不带 ~tplv- 处理后缀出现，按字符串去重会让客户端重复下载。
+- 小红书：图片文件token（路径最后一段，去掉 !样式 与查询参数）
+- 豆包（byteimg 等）：对象key（路径中 ~tplv- 之前的部分，签名参数不参与）
+- 无法从URL判断时（image_identity_key 返回 None），由调用方用一次小的 Range 请求取内容指纹
+"""
+import hashlib
+from urllib.parse import urlparse
+
+# 小红书图片CDN：sns-webpic-*.xhscdn.com 的路径是 /<时间戳>/<签名>/<图片key>!<样式>，
+# 其他host直接是 /<图片key>
+_XHS_IMAGE_HOST_PREFIXES = ('sns-webpic-', 'sns-img-')
+_XHS_IMAGE_HOSTS = ('ci.xiaohongshu.com',)
+_DOUBAO_IMAGE_SUFFIXES = ('byteimg.com', 'byteadapters.cn', 'doubaoimg.com')
+_MIN_KEY_LENGTH = 16
+
+# 内容指纹读取的字节数（Range: bytes=0-N）
+FINGERPRINT_BYTES = 4096
+
+
+def _host_matches(host, suffixes):
+    return any(host == s or host.endswith('.' + s) for s in suffixes)
+
+
+def xhs_image_key(url):
+    """小红书图片URL中的图片key（不含样式后缀与查询参数）；不是小红书图片CDN时返回 None"""
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    if not (host.startswith(_XHS_IMAGE_HOST_PREFIXES) or host in _XHS_IMAGE_HOSTS):
+        return None
+    segments = [s for s in parsed.path.split('!', 1)[0].split('/') if s]
+    if host.startswith('sns-webpic-') and len(segments) >= 3 and segments[0].isdigit():
+        segments = segments[2:]
+    key = '/'.join(segments)
+    return key if len(key) >= _MIN_KEY_LENGTH else None
+
+
+def image_identity_key(url):
+    """按平台规范化的图片身份；无法判断时返回 None"""
+    parsed = urlparse(url or '')
+    host = (parsed.hostname or '').lower()
+    if _host_matches(host, ('xhscdn.com', 'xiaohongshu.com')):
+        key = xhs_image_key(url)
+        if key is None and host.endswith('xhscdn.com'):
+            key = parsed.path.split('!', 1)[0].strip('/')
+        # spectrum/<token> 与 <token> 是同一个文件
+        token = (key or '').rsplit('/', 1)[-1]
+        return 'xhs:' + token if len(token) >= _MIN_KEY_LENGTH else None
+    if _host_matches(host, _DOUBAO_IMAGE_SUFFIXES):
+        key = parsed.path.split('~', 1)[0].strip('/')
+        return 'doubao:' + key if '/' in key and len(key) >= _MIN_KEY_LENGTH else None
+    return None
+
+
+def content_fingerprint(resp, max_bytes=FINGERPRINT_BYTES):
+    """
+    由 Range 请求（bytes=0-N）的响应计算内容指纹：前 N 字节的摘要 + 总大小。
+    上游忽略 Range 返回 200 时同样只读前 N 字节。非 200/206 时返回 None。
+    """
+    if resp.status_code not in (200, 206):
+        return None
+    total = None
+    content_range = resp.headers.get('Content-Range', '')
+    if '/' in content_range:
+        total = content_range.rsplit('/', 1)[1].strip()
+    elif resp.status_code == 200:
+        total = resp.headers.get('Content-Length')
+    digest = hashlib.sha1()
+    read = 0
+    for chunk in resp.iter_content(chunk_size=max_bytes):
+        chunk = chunk[:max_bytes - read]
+        digest.update(chunk)
+        read += len(chunk)
+        if read >= max_bytes:
+            break
+    return 'fp:{}:{}'.format(digest.hexdigest(), total or read)
+
+
+def dedupe_images(urls, keys, exclude_keys=(), prefer=None):
+    """
+    按身份key保序去重，并去掉 key 在 exclude_keys 中的图片；keys 与 urls 一一对应。
+    每组默认保留第一个；给出 prefer(url) 时，组内第一个满足 prefer 的URL替换掉已保留的（位置不变）。
+    """
+    excluded = set(exclude_keys)
+    kept = {}  # key -> result 中的下标
+    result = []
+    for url, key in zip(urls, keys):
+        if key in excluded:
+            continue
+        index = kept.get(key)
+        if index is None:
+            kept[key] = len(result)
+            result.append(url)
+        elif prefer is not None and prefer(url) and not prefer(result[index]):
+            result[index] = url
+    return result
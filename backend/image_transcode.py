@@ -0,0 +1,140 @@
+"""
+图片缩放/转码（image_proxy 的 w= / q= / fmt= 参数）
+依赖 Pillow（可选）：未安装时 image_proxy 忽略这些参数，直接返回原图。
+编码是CPU密集型操作，放到进程池中执行，不阻塞请求线程（也不受GIL限制）。
+"""
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from settings import env_int
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow 未安装时不提供转码
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_TRANSCODE_WORKERS = env_int('IMAGE_TRANSCODE_WORKERS', os.cpu_count() or 2)
+IMAGE_TRANSCODE_TIMEOUT = env_int('IMAGE_TRANSCODE_TIMEOUT', 15)
+IMAGE_TRANSCODE_MAX_SOURCE_MB = env_int('IMAGE_TRANSCODE_MAX_SOURCE_MB', 20)
+
+# 宽度向上取整到固定档位，避免任意宽度产生大量缓存变体
+TRANSCODE_WIDTHS = (120, 240, 360, 480, 720, 1080, 1440, 2048)
+TRANSCODE_FORMATS = {'webp': ('WEBP', 'image/webp'), 'jpeg': ('JPEG', 'image/jpeg'), 'jpg': ('JPEG', 'image/jpeg')}
+DEFAULT_QUALITY = 75
+
+
+class TranscodeParams:
+    __slots__ = ('width', 'quality', 'fmt')
+
+    def __init__(self, width, quality, fmt):
+        self.width = width
+        self.quality = quality
+        self.fmt = fmt
+
+    @property
+    def variant(self):
+        """用作缓存key的变体标识"""
+        return 'w{}-q{}-{}'.format(self.width or 0, self.quality, self.fmt)
+
+
+def transcode_available():
+    return Image is not None
+
+
+def parse_transcode_params(args):
+    """
+    解析 w / q / fmt 参数；都没有时返回 None（原图透传）。
+    参数非法时抛 ValueError（由调用方返回400）。
+    """
+    w = (args.get('w') or '').strip()
+    q = (args.get('q') or '').strip()
+    fmt = (args.get('fmt') or '').strip().lower()
+    if not (w or q or fmt):
+        return None
+
+    width = None
+    if w:
+        if not w.isdigit() or int(w) <= 0:
+            raise ValueError('w 参数必须是正整数')
+        width = next((bucket for bucket in TRANSCODE_WIDTHS if bucket >= int(w)), TRANSCODE_WIDTHS[-1])
+
+    quality = DEFAULT_QUALITY
+    if q:
+        if not q.isdigit() or not 1 <= int(q) <= 100:
+            raise ValueError('q 参数必须是 1-100 的整数')
+        quality = min(95, max(30, int(q) // 5 * 5))
+
+    fmt = fmt or 'webp'
+    if fmt not in TRANSCODE_FORMATS:
+        raise ValueError('fmt 参数只支持 webp / jpeg')
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    return TranscodeParams(width, quality, fmt)
+
+
+def transcode(data, width, quality, fmt):
+    """
+    缩放并重新编码，返回 (bytes, mimetype)。
+    模块级函数，可直接提交到进程池（参数与返回值都可 pickle）。
+    """
+    pil_format, mimetype = TRANSCODE_FORMATS[fmt]
+    img = Image.open(io.BytesIO(data))
+    source_format = img.format
+    resized = bool(width and img.width > width)
+    if resized:
+        height = max(1, round(img.height * width / img.width))
+        # JPEG 可以在解码阶段直接按 1/2、1/4、1/8 缩小，省掉大部分解码开销
+        img.draft('RGB', (width, height))
+        img.thumbnail((width, height), Image.LANCZOS, reducing_gap=2.0)
+
+    if pil_format == 'JPEG' and img.mode != 'RGB':
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        else:
+            img = img.convert('RGB')
+
+    out = io.BytesIO()
+    if pil_format == 'JPEG':
+        img.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        img.save(out, 'WEBP', quality=quality, method=4)
+    if not resized and source_format == pil_format and out.tell() >= len(data):
+        # 原图已经够小且格式相同，重新编码只会更大
+        return data, mimetype
+    return out.getvalue(), mimetype
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=IMAGE_TRANSCODE_WORKERS)
+    return _pool
+
+
+def transcode_in_pool(data, params, timeout=IMAGE_TRANSCODE_TIMEOUT):
+    """在进程池中转码，返回 (bytes, mimetype)"""
+    future = _get_pool().submit(transcode, data, params.width, params.quality, params.fmt)
+    return future.result(timeout=timeout)
+
+
+def shutdown_pool():
+    """关闭进程池（fork 出的 worker 进程中调用，避免沿用父进程的池）"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
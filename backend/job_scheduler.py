@@ -0,0 +1,204 @@
+"""
+解析任务调度：按代价分道执行
+小红书解析（短链跳转 + 页面 + 正则）几百毫秒，豆包解析可能要启动浏览器渲染、等待几十秒。
+两类任务放在各自的线程池（通道）中执行，各自限制并发数与排队长度：
+- 豆包突发只会占满 expensive 通道，cheap 通道照常处理小红书，p99 不受影响
+- 准入控制：通道排队已满时立即拒绝（SchedulerBusy），不让请求线程挂在长队列后面
+- 同步接口提交后等待结果；JobStore 提供异步任务（提交后轮询/等待），慢解析不占用请求线程
+"""
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+from metrics import SCHEDULER_QUEUE_SECONDS, SCHEDULER_REJECTED
+
+CHEAP = 'cheap'
+EXPENSIVE = 'expensive'
+
+
+class SchedulerBusy(RuntimeError):
+    """通道排队已满"""
+
+
+class _Lane:
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='parse-' + name)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._counters = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+
+    def submit(self, fn, *args):
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self._counters['rejected'] += 1
+                SCHEDULER_REJECTED.inc(self.name)
+                raise SchedulerBusy('{} 通道排队已满'.format(self.name))
+            self._queued += 1
+            self._counters['submitted'] += 1
+        return self._executor.submit(self._run, time.perf_counter(), fn, args)
+
+    def _run(self, submitted_at, fn, args):
+        SCHEDULER_QUEUE_SECONDS.observe(time.perf_counter() - submitted_at, self.name)
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        ok = False
+        try:
+            result = fn(*args)
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._counters['completed' if ok else 'failed'] += 1
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            data['queued'] = self._queued
+            data['running'] = self._running
+        data['workers'] = self.workers
+        data['max_queue'] = self.max_queue
+        return data
+
+
+class JobScheduler:
+    """lanes: {通道名: (线程数, 排队上限)}"""
+
+    def __init__(self, lanes):
+        self._lanes = {name: _Lane(name, workers, max_queue) for name, (workers, max_queue) in lanes.items()}
+
+    def submit(self, lane, fn, *args):
+        """提交到指定通道，返回 Future；排队已满时抛 SchedulerBusy"""
+        return self._lanes[lane].submit(fn, *args)
+
+    def run(self, lane, fn, *args, timeout=None):
+        """提交并等待结果；超时抛 concurrent.futures.TimeoutError（任务本身继续执行）"""
+        return self.submit(lane, fn, *args).result(timeout=timeout)
+
+    def stats(self):
+        return {name: lane.stats() for name, lane in self._lanes.items()}
+
+
+class WaiterLimit:
+    """
+    同步等待名额：每个占用名额的调用方都挂着一个请求线程等结果。
+    名额用完时 try_acquire 立即返回 False，由调用方拒绝或改走异步任务，而不是再占一个线程。
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._active = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self._active >= self.limit:
+                self._rejected += 1
+                return False
+            self._active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+
+    def stats(self):
+        with self._lock:
+            return {'active': self._active, 'limit': self.limit, 'rejected': self._rejected}
+
+
+class Job:
+    __slots__ = ('id', 'key', 'lane', 'created', 'finished', 'future')
+
+    def __init__(self, key, lane, future):
+        self.id = secrets.token_urlsafe(12)
+        self.key = key
+        self.lane = lane
+        self.created = time.time()
+        self.finished = None
+        self.future = future
+
+    def status(self):
+        if not self.future.done():
+            return 'running' if self.future.running() else 'queued'
+        return 'failed' if self.future.exception() is not None else 'done'
+
+
+class JobStore:
+    """
+    异步任务表：按随机 job_id 查询（不可猜测，结果只对提交者可见）。
+    同一个key（解析缓存key）未完成时重复提交返回同一个任务；完成的任务保留 ttl_seconds 秒，
+    总数超过 max_jobs 时淘汰最早完成的任务，全部未完成时拒绝新任务。
+    """
+
+    def __init__(self, scheduler, max_jobs=1000, ttl_seconds=600):
+        self.scheduler = scheduler
+        self.max_jobs = max_jobs
+        self.ttl_seconds = ttl_seconds
+        self._jobs = OrderedDict()  # job_id -> Job
+        self._active = {}  # key -> Job（未完成）
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        for job_id, job in list(self._jobs.items()):
+            if job.finished is not None and now - job.finished > self.ttl_seconds:
+                del self._jobs[job_id]
+        while len(self._jobs) >= self.max_jobs:
+            victim = next((job_id for job_id, job in self._jobs.items() if job.finished is not None), None)
+            if victim is None:
+                raise SchedulerBusy('异步任务数已达上限')
+            del self._jobs[victim]
+
+    def submit(self, key, lane, fn, *args):
+        with self._lock:
+            job = self._active.get(key)
+            if job is not None:
+                return job
+            self._expire(time.time())
+            job = Job(key, lane, self.scheduler.submit(lane, fn, *args))
+            self._jobs[job.id] = job
+            self._active[key] = job
+        job.future.add_done_callback(lambda _: self._finish(job))
+        return job
+
+    def add_completed(self, key, lane, result):
+        """直接登记一个已完成的任务（例如解析缓存命中）"""
+        future = Future()
+        future.set_result(result)
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            job = Job(key, lane, future)
+            job.finished = now
+            self._jobs[job.id] = job
+        return job
+
+    def _finish(self, job):
+        with self._lock:
+            job.finished = time.time()
+            if self._active.get(job.key) is job:
+                del self._active[job.key]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job, timeout):
+        """最多等待 timeout 秒（长轮询），返回时任务不一定已完成"""
+        try:
+            job.future.exception(timeout=timeout)
+        except FuturesTimeoutError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {'jobs': len(self._jobs), 'active': len(self._active), 'max_jobs': self.max_jobs}
@@ -0,0 +1,226 @@
+"""
+轻量指标（Prometheus 文本格式，/metrics 接口输出）
+只依赖标准库：计数器 + 仪表 + 直方图，每次记录只做一次 bisect 和一次加锁累加，可以常开。
+指标按进程统计；多 worker 部署时由 Prometheus 分别抓取各 worker 或在前面聚合。
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 默认桶（秒）：覆盖从正则提取的毫秒级到浏览器渲染的十秒级
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['{}="{}"'.format(n, _escape(v)) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _header(self):
+        return ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.kind)]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}  # label值元组 -> 计数
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues):
+        with self._lock:
+            return self._values.get(labelvalues, 0)
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            lines.append('{}{} {}'.format(self.name, _format_labels(self.labelnames, labelvalues), _format_value(value)))
+        return lines
+
+
+class Gauge(_Metric):
+    """可增可减的当前值（进行中的请求数等）"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, value, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def value(self, *labelvalues):
+        with self._lock:
+            return self._values.get(labelvalues, 0)
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            lines.append('{}{} {}'.format(self.name, _format_labels(self.labelnames, labelvalues), _format_value(value)))
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label值元组 -> [各桶计数(非累积)..., +Inf桶, sum]
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = [0] * (len(self.buckets) + 1) + [0.0]
+                self._series[labelvalues] = series
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        """with HIST.time('stage'): ... 记录代码块耗时（异常时同样记录）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        bounds = self.buckets + (float('inf'),)
+        for labelvalues, series in items:
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                le = 'le="{}"'.format(_format_value(float(bound)))
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, _format_labels(self.labelnames, labelvalues, le), cumulative))
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append('{}_sum{} {}'.format(self.name, labels, _format_value(series[-1])))
+            lines.append('{}_count{} {}'.format(self.name, labels, cumulative))
+        return lines
+
+
+def render_all():
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# ---- 本服务的指标 ----
+
+# 解析/代理流水线各阶段耗时
+STAGE_SECONDS = Histogram(
+    'waterdemo_stage_seconds', 'Latency of each pipeline stage in seconds', ('stage',),
+)
+# 哪一级提取成功：小红书 initial_state / regex:<候选族> / none，豆包 static / browser / none
+EXTRACTION_TIER = Counter(
+    'waterdemo_extraction_tier_total', 'Which extraction tier produced the images', ('platform', 'tier'),
+)
+# 上游响应状态码（error 表示连接失败/超时等异常）
+UPSTREAM_RESPONSES = Counter(
+    'waterdemo_upstream_responses_total', 'Upstream responses by host group, method and status',
+    ('group', 'method', 'status'),
+)
+# 上游保护（upstream_guard.py）：被拒绝的请求、当前并发上限、熔断器是否打开（半开也记为1）
+UPSTREAM_REJECTED = Counter(
+    'waterdemo_upstream_rejected_total', 'Outbound requests rejected before sending, by host group and reason',
+    ('group', 'reason'),
+)
+UPSTREAM_CONCURRENCY_LIMIT = Gauge(
+    'waterdemo_upstream_concurrency_limit', 'Current adaptive concurrency limit per host group', ('group',),
+)
+UPSTREAM_BREAKER_OPEN = Gauge(
+    'waterdemo_upstream_circuit_open', 'Whether the circuit breaker of a host group is open (1) or closed (0)',
+    ('group',),
+)
+# 本服务各接口的请求数与耗时
+HTTP_REQUESTS = Counter(
+    'waterdemo_http_requests_total', 'HTTP requests served by endpoint and status', ('endpoint', 'status'),
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    'waterdemo_http_request_seconds', 'Time to produce the response (streamed bodies excluded)', ('endpoint',),
+)
+# 图片对冲请求：hedged 发出的对冲次数，won/lost 对冲请求胜出/主请求胜出，failed 两个都失败
+IMAGE_HEDGE = Counter(
+    'waterdemo_image_hedge_total', 'Hedged image fetches by outcome', ('outcome',),
+)
+# 解析调度：各通道的排队等待时间与因排队已满被拒绝的次数
+SCHEDULER_QUEUE_SECONDS = Histogram(
+    'waterdemo_scheduler_queue_seconds', 'Time a parse job waited in its lane queue', ('lane',),
+)
+SCHEDULER_REJECTED = Counter(
+    'waterdemo_scheduler_rejected_total', 'Parse jobs rejected because the lane queue was full', ('lane',),
+)
+# 正在处理的请求数（后台预取据此判断是否让路）
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    'waterdemo_http_requests_in_flight', 'Requests currently being handled by this process',
+)
+# 后台图片预取：scheduled / fetched / cached / failed / dropped_full / skipped_busy
+IMAGE_PREFETCH = Counter(
+    'waterdemo_image_prefetch_total', 'Background image prefetch jobs by outcome', ('outcome',),
+)
+# all_images 去重：按 resolution（platform / fingerprint / url）统计身份key的来源，removed 为去掉的重复图片数
+IMAGE_DEDUPE = Counter(
+    'waterdemo_image_dedupe_total', 'Image identity keys by resolution and duplicates removed from all_images',
+    ('resolution',),
+)
+
+
+def observe_stage(stage):
+    """阶段计时：with observe_stage('fetch_html'): ..."""
+    return STAGE_SECONDS.time(stage)
@@ -0,0 +1,112 @@
+"""
+笔记 / 豆包页面的流式下载
+按块读取响应体，页面状态脚本（__INITIAL_STATE__ / __RENDER_DATA__）完整读到后立即停止下载，
+后面的HTML不再传输、也不再解码；同时限制页面总大小，异常大页面不会占满内存。
+PageScanner 与IO无关（只负责累积字节、判断何时可以停止），同步（requests）与异步（aiohttp）下载共用。
+"""
+import logging
+import re
+
+from settings import env_int
+
+logger = logging.getLogger(__name__)
+
+PAGE_MAX_BYTES = env_int('PAGE_MAX_MB', 8) * 1024 * 1024
+PAGE_CHUNK_SIZE = 64 * 1024
+
+_SCRIPT_CLOSE = re.compile(rb'</script\s*>', re.IGNORECASE)
+# 开始标记可能跨两个块：新块到达时从上一块末尾往前回看这么多字节重新查找
+_MARKER_OVERLAP = 512
+
+# (状态脚本的开始标记, 结束标记)
+XHS_STATE_MARKERS = (re.compile(rb'__INITIAL_STATE__\s*=\s*\{', re.IGNORECASE), _SCRIPT_CLOSE)
+DOUBAO_STATE_MARKERS = (re.compile(rb'<script[^>]+id="__RENDER_DATA__"[^>]*>', re.IGNORECASE), _SCRIPT_CLOSE)
+
+
+def response_encoding(content_type):
+    """Content-Type 中声明的字符集；未声明时按 UTF-8（两个站点的页面都是 UTF-8）"""
+    for param in (content_type or '').split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        if name.lower() == 'charset' and value:
+            return value.strip('"\' ')
+    return 'utf-8'
+
+
+class PageScanner:
+    """累积页面字节；markers 为 (开始正则, 结束正则)，结束标记出现在开始标记之后即可停止读取"""
+
+    def __init__(self, markers=None, max_bytes=PAGE_MAX_BYTES):
+        self.markers = markers
+        self.max_bytes = max_bytes
+        self.buf = bytearray()
+        self.captured = False  # 状态脚本已完整读取
+        self.truncated = False  # 超过 max_bytes 被截断
+        self._state_start = -1
+        self._scanned = 0
+
+    def feed(self, chunk):
+        """追加一块数据，返回 True 表示不需要再读"""
+        room = self.max_bytes - len(self.buf)
+        if len(chunk) > room:
+            chunk = chunk[:room]
+            self.truncated = True
+        self.buf += chunk
+        if self.markers is not None and not self.captured:
+            self._scan()
+        self._scanned = len(self.buf)
+        if self.truncated:
+            logger.warning("页面超过 %dMB，只读取前面部分", self.max_bytes // 1048576)
+        return self.truncated or (self.markers is not None and self.captured)
+
+    def _scan(self):
+        start_re, end_re = self.markers
+        if self._state_start < 0:
+            m = start_re.search(self.buf, max(0, self._scanned - _MARKER_OVERLAP))
+            if not m:
+                return
+            self._state_start = m.end()
+        if end_re.search(self.buf, max(self._state_start, self._scanned - 16)):
+            self.captured = True
+
+    def text(self, encoding='utf-8'):
+        return self.buf.decode(encoding, errors='replace')
+
+
+class PageReader:
+    """
+    requests 流式响应（stream=True）的读取器：
+        reader.read_until(XHS_STATE_MARKERS)  读到状态脚本结束为止，返回已读部分的文本
+        reader.read_rest()                    需要时继续读完整个页面（到大小上限为止）
+    用完必须 close()（提前停止时直接关闭连接，剩余正文不再下载）。
+    """
+
+    def __init__(self, resp, max_bytes=PAGE_MAX_BYTES, chunk_size=PAGE_CHUNK_SIZE):
+        self._resp = resp
+        self._chunks = resp.iter_content(chunk_size)
+        self._scanner = PageScanner(max_bytes=max_bytes)
+        self.encoding = response_encoding(resp.headers.get('Content-Type'))
+        self.complete = False  # 已读到响应结尾
+
+    @property
+    def size(self):
+        return len(self._scanner.buf)
+
+    def _pump(self):
+        for chunk in self._chunks:
+            if self._scanner.feed(chunk):
+                return
+        self.complete = True
+
+    def read_until(self, markers):
+        self._scanner.markers = markers
+        self._pump()
+        return self._scanner.text(self.encoding)
+
+    def read_rest(self):
+        if not (self.complete or self._scanner.truncated):
+            self._scanner.markers = None
+            self._pump()
+        return self._scanner.text(self.encoding)
+
+    def close(self):
+        self._resp.close()
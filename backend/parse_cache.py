@@ -0,0 +1,193 @@
+"""
+解析结果缓存
+两级缓存：进程内 LRU + TTL（第一级），可选 SQLite 文件（第二级，重启后仍有效，多个 gunicorn worker 共享）。
+过期但仍在 stale 窗口内的结果会先返回给调用方，同时在后台线程刷新。
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+FRESH = 'fresh'
+STALE = 'stale'
+
+
+class ParseCache:
+    """LRU + TTL 缓存，值必须可 JSON 序列化（解析结果 dict）"""
+
+    def __init__(self, max_entries=1024, ttl_seconds=600, stale_seconds=1800, db_path=None, refresh_workers=2):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.db_path = db_path or None
+        self._entries = OrderedDict()  # key -> (value, stored_at)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._refreshing = set()
+        self._refresh_pool = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix='parse-cache-refresh')
+        self._counters = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'disk_hits': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+        }
+        if self.db_path:
+            try:
+                self._db().execute(
+                    'CREATE TABLE IF NOT EXISTS parse_cache ('
+                    'key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)'
+                )
+            except sqlite3.Error as e:
+                logger.warning("解析缓存磁盘层初始化失败，仅使用内存缓存: %s", str(e))
+                self.db_path = None
+
+    # ---- 磁盘层 ----
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _disk_get(self, key):
+        if not self.db_path:
+            return None
+        try:
+            row = self._db().execute('SELECT value, stored_at FROM parse_cache WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("读取解析缓存磁盘层失败: %s", str(e))
+            return None
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0]), row[1]
+        except ValueError:
+            return None
+
+    def _disk_set(self, keys, value, stored_at):
+        if not self.db_path:
+            return
+        try:
+            payload = json.dumps(value, ensure_ascii=False)
+            conn = self._db()
+            conn.executemany(
+                'INSERT OR REPLACE INTO parse_cache (key, value, stored_at) VALUES (?, ?, ?)',
+                [(k, payload, stored_at) for k in keys],
+            )
+            conn.execute(
+                'DELETE FROM parse_cache WHERE stored_at < ?',
+                (stored_at - self.ttl_seconds - self.stale_seconds,),
+            )
+        except sqlite3.Error as e:
+            logger.warning("写入解析缓存磁盘层失败: %s", str(e))
+
+    # ---- 对外接口 ----
+
+    def _state(self, stored_at, now):
+        age = now - stored_at
+        if age < self.ttl_seconds:
+            return FRESH
+        if age < self.ttl_seconds + self.stale_seconds:
+            return STALE
+        return None
+
+    def _memory_put(self, key, value, stored_at):
+        """写入内存层（调用方持有锁）"""
+        self._entries[key] = (value, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    def get(self, key):
+        """返回 (value, state)；state 为 'fresh' / 'stale'，未命中时为 (None, None)"""
+        if not key:
+            return None, None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                state = self._state(entry[1], now)
+                if state is None:
+                    del self._entries[key]
+                    self._counters['expirations'] += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self._counters['hits' if state == FRESH else 'stale_hits'] += 1
+                    return entry[0], state
+
+        disk_entry = self._disk_get(key)
+        if disk_entry is not None:
+            value, stored_at = disk_entry
+            state = self._state(stored_at, now)
+            if state is not None:
+                with self._lock:
+                    self._memory_put(key, value, stored_at)
+                    self._counters['disk_hits'] += 1
+                    self._counters['hits' if state == FRESH else 'stale_hits'] += 1
+                return value, state
+
+        with self._lock:
+            self._counters['misses'] += 1
+        return None, None
+
+    def set(self, keys, value):
+        """同一结果可以挂在多个key下（短链 / 笔记ID / 豆包URL）"""
+        keys = [k for k in keys if k]
+        if not keys:
+            return
+        stored_at = time.time()
+        with self._lock:
+            for key in keys:
+                self._memory_put(key, value, stored_at)
+        self._disk_set(keys, value, stored_at)
+
+    def refresh_async(self, key, compute, keys_of):
+        """后台刷新过期结果；同一个key同时只刷新一次。keys_of(value) 返回新结果要写入的全部key"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def _run():
+            try:
+                value = compute()
+                self.set([key] + list(keys_of(value)), value)
+                with self._lock:
+                    self._counters['refreshes'] += 1
+            except Exception as e:
+                with self._lock:
+                    self._counters['refresh_errors'] += 1
+                logger.warning("后台刷新解析缓存失败: key=%s, error=%s", key, str(e))
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._refresh_pool.submit(_run)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            data['size'] = len(self._entries)
+            data['refreshing'] = len(self._refreshing)
+        data['max_entries'] = self.max_entries
+        data['ttl_seconds'] = self.ttl_seconds
+        data['stale_seconds'] = self.stale_seconds
+        data['disk_enabled'] = bool(self.db_path)
+        return data
@@ -0,0 +1,81 @@
+"""
+解析成功后的后台图片预取（可选）
+小程序拿到解析结果后紧接着会逐张请求 /api/image_proxy；预取在解析返回的同时用一个有界线程池
+把这些图片回源写入本地图片缓存（ImageCache），客户端到达时代理直接从磁盘返回。
+- 与代理共用 ImageCache.get_or_fill：客户端与预取同时请求同一张图时只回源一次
+- 有界：固定线程数 + 排队上限，排不下的图片直接放弃（预取只是优化，放弃不影响正确性）
+- 让路：进程内正在处理的请求数达到 busy_requests 时不再提交新任务，已排队的任务开始前也会复查并放弃
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from image_cache import image_cache_key
+from metrics import IMAGE_PREFETCH
+
+logger = logging.getLogger(__name__)
+
+OUTCOMES = ('scheduled', 'fetched', 'cached', 'failed', 'dropped_full', 'skipped_busy')
+
+
+class ImagePrefetcher:
+    """
+    cache: ImageCache；fill(url, cookie, writer) 与代理回源写缓存使用同一个函数；
+    load() 返回当前正在处理的请求数。
+    """
+
+    def __init__(self, cache, fill, load, workers=4, max_pending=64, busy_requests=16, max_images=20):
+        self.cache = cache
+        self.fill = fill
+        self.load = load
+        self.max_pending = max_pending
+        self.busy_requests = busy_requests
+        self.max_images = max_images
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-prefetch')
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def busy(self):
+        return self.load() >= self.busy_requests
+
+    def submit(self, urls, cookie=''):
+        """提交一条笔记的图片（按展示顺序，前面的先下载），返回实际排队的张数"""
+        urls = urls[:self.max_images]
+        for i, url in enumerate(urls):
+            if self.busy():
+                IMAGE_PREFETCH.inc('skipped_busy', amount=len(urls) - i)
+                return i
+            with self._lock:
+                if self._pending >= self.max_pending:
+                    IMAGE_PREFETCH.inc('dropped_full', amount=len(urls) - i)
+                    return i
+                self._pending += 1
+            IMAGE_PREFETCH.inc('scheduled')
+            self._executor.submit(self._run, url, cookie)
+        return len(urls)
+
+    def _run(self, url, cookie):
+        try:
+            if self.busy():
+                IMAGE_PREFETCH.inc('skipped_busy')
+                return
+            key = image_cache_key(url, cookie)
+            if self.cache.contains(key):
+                IMAGE_PREFETCH.inc('cached')
+                return
+            entry = self.cache.get_or_fill(key, lambda writer: self.fill(url, cookie, writer))
+            IMAGE_PREFETCH.inc('fetched' if entry is not None else 'failed')
+        except Exception as e:
+            IMAGE_PREFETCH.inc('failed')
+            logger.warning("图片预取失败: %s, url=%s", str(e), url)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self):
+        data = {outcome: IMAGE_PREFETCH.value(outcome) for outcome in OUTCOMES}
+        with self._lock:
+            data['pending'] = self._pending
+        data['max_pending'] = self.max_pending
+        data['busy_requests'] = self.busy_requests
+        return data
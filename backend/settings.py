@@ -0,0 +1,33 @@
+"""
+环境变量读取工具
+各模块的可调参数统一通过环境变量覆盖，这里负责容错解析（非法值回退到默认值）
+"""
+import os
+
+
+def env_str(name, default=''):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip()
+
+
+def env_int(name, default):
+    try:
+        return int(env_str(name) or default)
+    except ValueError:
+        return default
+
+
+def env_float(name, default):
+    try:
+        return float(env_str(name) or default)
+    except ValueError:
+        return default
+
+
+def env_bool(name, default=False):
+    value = env_str(name).lower()
+    if not value:
+        return default
+    return value in ('1', 'true', 'yes', 'on')
@@ -0,0 +1,170 @@
+"""
+请求合并（single-flight）
+同一个key同时只执行一次计算，并发到达的相同请求等待这一次的结果（或异常）。
+群聊里同一条笔记被几十人同时解析时，只会向上游发一次请求、只启动一次浏览器。
+
+AsyncSingleFlight 是事件循环中的版本（异步服务模式），只做进程内合并。
+
+可选跨进程：设置 lock_dir 后，持有计算权的线程还要先拿到文件锁（fcntl.flock），
+拿到锁后调用 recheck() 再看一次共享缓存（例如 SQLite 磁盘层），其他 worker 刚算完的结果可直接复用。
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows 上只做进程内合并
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LOCK_BUCKETS = 1024  # 锁文件按key哈希分桶，文件数量有上限
+
+
+class FlightTimeout(TimeoutError):
+    """等待同key的计算结果超过 timeout（计算本身继续进行）"""
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, lock_dir=None, lock_timeout=30):
+        self.lock_dir = lock_dir if lock_dir and fcntl is not None else None
+        self.lock_timeout = lock_timeout
+        self._calls = {}  # key -> _Call
+        self._lock = threading.Lock()
+        self._counters = {'leaders': 0, 'shared': 0, 'rechecked': 0, 'lock_timeouts': 0}
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def do(self, key, fn, recheck=None, timeout=None):
+        """
+        执行 fn() 并返回结果；相同key正在执行时等待并共享其结果。
+        recheck() 在拿到跨进程锁后调用，返回非 None 时直接使用该值，不再执行 fn。
+        timeout：等待其他线程的结果最多这么久（超时抛 FlightTimeout），等待跨进程锁也不超过它；
+        fn 自身的耗时由 fn 负责限制。
+        """
+        if not key:
+            return fn()
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._counters['shared'] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._counters['leaders'] += 1
+                leader = True
+
+        if not leader:
+            if not call.event.wait(timeout):
+                raise FlightTimeout(key)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(key, fn, recheck, timeout)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def _run(self, key, fn, recheck, timeout):
+        if not self.lock_dir:
+            return fn()
+        lock_file = self._acquire_file_lock(key, timeout)
+        try:
+            if recheck is not None:
+                value = recheck()
+                if value is not None:
+                    with self._lock:
+                        self._counters['rechecked'] += 1
+                    return value
+            return fn()
+        finally:
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+    def _acquire_file_lock(self, key, timeout=None):
+        """拿到 key 所在分桶的文件锁；超时返回 None（直接计算，不再等待其他进程）"""
+        bucket = int(hashlib.sha1(key.encode('utf-8')).hexdigest(), 16) % LOCK_BUCKETS
+        lock_file = open(os.path.join(self.lock_dir, '{:04d}.lock'.format(bucket)), 'a+')
+        deadline = time.monotonic() + min(self.lock_timeout, timeout if timeout is not None else self.lock_timeout)
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_file
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    lock_file.close()
+                    with self._lock:
+                        self._counters['lock_timeouts'] += 1
+                    logger.warning("等待跨进程解析锁超时，直接解析: %s", key)
+                    return None
+                time.sleep(0.05)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            data['inflight'] = len(self._calls)
+        data['cross_process'] = bool(self.lock_dir)
+        return data
+
+
+class AsyncSingleFlight:
+    """
+    协程版：同一key的计算作为一个任务执行，并发到达的协程等待同一个任务。
+    等待方超时或被取消都不会取消任务，任务完成后照常写入缓存。
+    """
+
+    def __init__(self):
+        self._tasks = {}  # (事件循环, key) -> Task
+        self._counters = {'leaders': 0, 'shared': 0}
+
+    async def do(self, key, fn, timeout=None):
+        """等待 fn() 协程的结果，相同key正在执行时共享；timeout 秒内未完成时抛 FlightTimeout"""
+        slot = (asyncio.get_running_loop(), key)
+        task = self._tasks.get(slot) if key else None
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            if key:
+                self._tasks[slot] = task
+            task.add_done_callback(lambda t: self._finish(slot, t))
+            self._counters['leaders'] += 1
+        else:
+            self._counters['shared'] += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            if task.done():  # fn 自身抛出的超时（例如上游请求超时）原样抛出
+                raise
+            raise FlightTimeout(key)
+
+    def _finish(self, slot, task):
+        if self._tasks.get(slot) is task:
+            del self._tasks[slot]
+        if not task.cancelled():
+            task.exception()  # 所有等待方都已超时离开时，避免 "exception was never retrieved" 日志
+
+    def stats(self):
+        data = dict(self._counters)
+        data['inflight'] = len(self._tasks)
+        return data
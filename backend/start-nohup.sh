@@ -22,15 +22,24 @@ if [ -f "$PID_FILE" ]; then
     fi
 fi
 
-# 启动应用
-echo "启动Flask应用..."
-nohup python3 app.py > $LOG_FILE 2>&1 &
+# 启动应用：优先使用 gunicorn（多进程 + 线程、worker 定期回收，配置见 gunicorn_conf.py）
+# HTTPS 沿用 FLASK_HTTPS=1 + FLASK_SSL_CERT/FLASK_SSL_KEY
+if command -v gunicorn > /dev/null 2>&1; then
+    echo "启动Flask应用（gunicorn）..."
+    nohup gunicorn -c gunicorn_conf.py app:app > $LOG_FILE 2>&1 &
+    RELOAD_HINT="平滑重启: kill -HUP \$(cat $PID_FILE)"
+else
+    echo "未安装gunicorn（pip3 install gunicorn），使用开发服务器启动..."
+    nohup python3 app.py > $LOG_FILE 2>&1 &
+    RELOAD_HINT="安装gunicorn后可平滑重启"
+fi
 PID=$!
 
-# 保存PID
+# 保存PID（gunicorn 时为 master 进程）
 echo $PID > $PID_FILE
 
 echo "应用已启动，PID: $PID"
 echo "日志文件: $LOG_FILE"
 echo "查看日志: tail -f $LOG_FILE"
 echo "停止应用: kill $PID 或运行 ./stop-nohup.sh"
+echo "$RELOAD_HINT"
@@ -15,8 +15,11 @@ if ps -p $PID > /dev/null 2>&1; then
     echo "停止应用，PID: $PID"
     kill $PID
     
-    # 等待进程结束
-    sleep 2
+    # 等待进程结束（gunicorn 会等 worker 处理完手上的请求，最长 GUNICORN_GRACEFUL_TIMEOUT 秒）
+    for i in $(seq 1 ${GUNICORN_GRACEFUL_TIMEOUT:-30}); do
+        ps -p $PID > /dev/null 2>&1 || break
+        sleep 1
+    done
     
     # 如果还在运行，强制杀死
     if ps -p $PID > /dev/null 2>&1; then
@@ -0,0 +1,292 @@
+"""
+上游HTTP会话池
+按目标站点分组复用 requests.Session（连接池 + keep-alive），避免每次请求都重新做 TCP/TLS 握手。
+所有对小红书/豆包/CDN 的请求都应通过本模块的 http_get / http_head 发出。
+每个分组另有熔断器 + 自适应并发上限 + 令牌桶（upstream_guard.py），上游异常时快速失败。
+"""
+import logging
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+from metrics import UPSTREAM_RESPONSES
+from settings import env_bool, env_float, env_int, env_str
+from upstream_guard import AIMDLimiter, CircuitBreaker, TokenBucket, UpstreamGuard, is_failure_status
+
+logger = logging.getLogger(__name__)
+
+
+# 连接池配置（可通过环境变量覆盖；UPSTREAM_POOL_MAXSIZE_<分组名大写> 可单独调整某个分组）
+UPSTREAM_POOL_CONNECTIONS = env_int('UPSTREAM_POOL_CONNECTIONS', 16)  # 每个分组缓存的 host 连接池个数
+UPSTREAM_POOL_MAXSIZE = env_int('UPSTREAM_POOL_MAXSIZE', 32)  # 每个 host 保持的最大连接数
+UPSTREAM_RETRIES = env_int('UPSTREAM_RETRIES', 2)  # 仅连接失败与 5xx 重试，读取超时不重试
+UPSTREAM_BACKOFF_FACTOR = env_float('UPSTREAM_BACKOFF_FACTOR', 0.3)
+UPSTREAM_CONNECT_TIMEOUT = env_float('UPSTREAM_CONNECT_TIMEOUT', 3.05)
+
+# 站点分组：同一分组共用一个 Session（adapter 内部再按 host 分池）
+HOST_GROUPS = (
+    ('xhslink', ('xhslink.com',)),
+    ('xhs_cdn', ('xhscdn.com', 'ci.xiaohongshu.com')),  # sns-webpic-* / sns-img-* / ci 等图片CDN（先于主站匹配）
+    ('xiaohongshu', ('xiaohongshu.com',)),
+    ('doubao', ('doubao.com',)),
+    ('byteimg', ('byteimg.com', 'byteadapters.cn', 'doubaoimg.com')),
+)
+DEFAULT_GROUP = 'default'
+
+_RETRY_STATUS = (500, 502, 503, 504)
+
+_sessions = {}  # group -> requests.Session
+_sessions_lock = threading.Lock()
+
+# ---- 上游保护（分组级，UPSTREAM_<参数>_<分组名大写> 可单独覆盖） ----
+UPSTREAM_BREAKER_FAILURES = env_int('UPSTREAM_BREAKER_FAILURES', 5)  # 连续失败多少次后熔断
+UPSTREAM_BREAKER_OPEN_SECONDS = env_float('UPSTREAM_BREAKER_OPEN_SECONDS', 10)  # 熔断后多久放行探测请求
+UPSTREAM_LIMIT_INITIAL = env_int('UPSTREAM_LIMIT_INITIAL', 16)
+UPSTREAM_LIMIT_MAX = env_int('UPSTREAM_LIMIT_MAX', 64)
+UPSTREAM_SLOW_SECONDS = env_float('UPSTREAM_SLOW_SECONDS', 3.0)  # 首字节超过该时间视为拥塞，并发上限减半
+UPSTREAM_GUARD_WAIT = env_float('UPSTREAM_GUARD_WAIT', 1.0)  # 等待并发名额/令牌的上限（秒），超过即拒绝
+UPSTREAM_RATE_LIMIT = env_bool('UPSTREAM_RATE_LIMIT', True)
+# 每秒请求数（0 表示不限速）：页面与短链按反爬阈值保守限制，图片CDN不限
+_DEFAULT_RATES = {'xhslink': 20, 'xiaohongshu': 10, 'doubao': 10}
+
+_guards = {}  # group -> UpstreamGuard
+_guards_lock = threading.Lock()
+
+
+def host_group(url):
+    """根据URL的host返回所属分组名"""
+    host = (urlparse(url).hostname or '').lower()
+    for group, suffixes in HOST_GROUPS:
+        for suffix in suffixes:
+            if host == suffix or host.endswith('.' + suffix):
+                return group
+    return DEFAULT_GROUP
+
+
+def _build_session(group):
+    maxsize = env_int('UPSTREAM_POOL_MAXSIZE_' + group.upper(), UPSTREAM_POOL_MAXSIZE)
+    # 重试由 _request 在调用方的超时预算内完成（每次尝试都经过上游保护），连接池本身不重试
+    adapter = HTTPAdapter(
+        pool_connections=UPSTREAM_POOL_CONNECTIONS,
+        pool_maxsize=maxsize,
+        max_retries=0,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # 会话在所有用户请求之间共享：禁止写入/回放上游 Set-Cookie，避免不同用户的登录态串号
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    # 请求头由调用方完整提供，不叠加 requests 默认头
+    session.headers.clear()
+    return session
+
+
+def get_session(url):
+    """获取URL对应分组的共享 Session（线程安全，懒创建）"""
+    group = host_group(url)
+    session = _sessions.get(group)
+    if session is not None:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(group)
+        if session is None:
+            session = _build_session(group)
+            _sessions[group] = session
+            logger.info("创建上游会话池: group=%s", group)
+        return session
+
+
+def reset_sessions():
+    """关闭并清空所有会话（fork 子进程后调用，避免父子进程共用同一批socket）"""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        try:
+            session.close()
+        except Exception:
+            pass
+
+
+def warm_sessions():
+    """预先为所有分组创建会话（worker 进程启动后调用，首个请求不再承担建池开销）"""
+    for group in [g for g, _ in HOST_GROUPS] + [DEFAULT_GROUP]:
+        with _sessions_lock:
+            if group not in _sessions:
+                _sessions[group] = _build_session(group)
+
+
+def _group_env_int(name, group, default):
+    return env_int('{}_{}'.format(name, group.upper()), default)
+
+
+def _build_guard(group):
+    rate = env_float('UPSTREAM_RATE_' + group.upper(), _DEFAULT_RATES.get(group, 0)) if UPSTREAM_RATE_LIMIT else 0
+    bucket = TokenBucket(rate, max(1.0, rate * 2)) if rate > 0 else None
+    return UpstreamGuard(
+        group,
+        CircuitBreaker(
+            failure_threshold=_group_env_int('UPSTREAM_BREAKER_FAILURES', group, UPSTREAM_BREAKER_FAILURES),
+            open_seconds=UPSTREAM_BREAKER_OPEN_SECONDS,
+        ),
+        AIMDLimiter(
+            initial=_group_env_int('UPSTREAM_LIMIT_INITIAL', group, UPSTREAM_LIMIT_INITIAL),
+            max_limit=_group_env_int('UPSTREAM_LIMIT_MAX', group, UPSTREAM_LIMIT_MAX),
+            slow_seconds=UPSTREAM_SLOW_SECONDS,
+        ),
+        bucket,
+    )
+
+
+def get_guard(url):
+    """URL所属分组的上游保护（懒创建）"""
+    group = host_group(url)
+    guard = _guards.get(group)
+    if guard is not None:
+        return guard
+    with _guards_lock:
+        guard = _guards.get(group)
+        if guard is None:
+            guard = _build_guard(group)
+            _guards[group] = guard
+        return guard
+
+
+def guard_stats():
+    """各分组的熔断状态、并发上限、限速与拒绝次数（/api/stats 使用）"""
+    with _guards_lock:
+        guards = dict(_guards)
+    return {group: guard.stats() for group, guard in sorted(guards.items())}
+
+
+def _timeout(timeout):
+    """把单个超时值拆成 (连接超时, 读取超时)"""
+    if isinstance(timeout, tuple):
+        return timeout
+    return (min(UPSTREAM_CONNECT_TIMEOUT, timeout), timeout)
+
+
+# ---- 离线回放 / 录制（bench/ 基准使用） ----
+# 设置 UPSTREAM_REPLAY_URL 后，所有上游请求改发到本地桩服务：
+#     https://www.xiaohongshu.com/explore/x  ->  <UPSTREAM_REPLAY_URL>/replay/https/www.xiaohongshu.com/explore/x
+# 响应的 url 再映射回原地址，调用方看到的结果与直连一致。
+UPSTREAM_REPLAY_URL = env_str('UPSTREAM_REPLAY_URL').rstrip('/')
+
+_recorder = None
+
+
+def replay_url(url):
+    """把上游URL改写为回放地址（未启用回放时原样返回）"""
+    if not UPSTREAM_REPLAY_URL:
+        return url
+    parsed = urlparse(url)
+    if not parsed.hostname or url.startswith(UPSTREAM_REPLAY_URL + '/'):
+        return url
+    rest = url.split(parsed.netloc, 1)[1]
+    return '{}/replay/{}/{}{}'.format(UPSTREAM_REPLAY_URL, parsed.scheme, parsed.netloc, rest)
+
+
+def original_url(url):
+    """replay_url 的逆映射"""
+    prefix = UPSTREAM_REPLAY_URL + '/replay/'
+    if not UPSTREAM_REPLAY_URL or not url.startswith(prefix):
+        return url
+    scheme, _, rest = url[len(prefix):].partition('/')
+    return '{}://{}'.format(scheme, rest)
+
+
+def set_recorder(callback):
+    """
+    录制上游响应：callback(method, url, response) 在每个响应（含中间跳转）返回给调用方之前调用；传 None 关闭。
+    stream=True 的响应若在回调里读取 .content，调用方之后的 iter_content 会直接复用已读取的内容。
+    """
+    global _recorder
+    _recorder = callback
+
+
+def _is_connect_error(e):
+    """请求尚未发出（连接超时/拒绝/DNS失败）：重试是安全的；读取阶段的错误与超时不重试"""
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(e, requests.exceptions.ConnectionError):
+        return False
+    reason = getattr(e.args[0], 'reason', None) if e.args else None
+    return isinstance(reason, ConnectTimeoutError)  # NewConnectionError / NameResolutionError 也是其子类
+
+
+def _request(method, url, headers, timeout, **kwargs):
+    """
+    发起请求并按分组记录上游状态码。
+    每次尝试先向分组的上游保护申请许可（熔断/并发/限速不满足时抛 UpstreamRejected，不发出请求），
+    并各自计入成功/失败样本；stream=True 时以收到响应头为一次完整的样本，正文传输不占用并发名额。
+    连接失败与 5xx 最多重试 UPSTREAM_RETRIES 次，全部尝试（含退避）都在 timeout 秒的预算之内。
+    """
+    group = host_group(url)
+    guard = get_guard(url)
+    connect_timeout, read_timeout = _timeout(timeout)
+    deadline = time.monotonic() + read_timeout
+    session = get_session(url)
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        permit = guard.acquire(min(UPSTREAM_GUARD_WAIT, max(remaining, 0.0)))
+        failed = True
+        try:
+            resp = session.request(
+                method, replay_url(url), headers=headers,
+                timeout=(min(connect_timeout, remaining), remaining) if attempt else (connect_timeout, read_timeout),
+                **kwargs)
+            failed = is_failure_status(resp.status_code)
+        except Exception as e:
+            UPSTREAM_RESPONSES.inc(group, method, 'error')
+            if not (_is_connect_error(e) and _retry_wait(attempt, deadline)):
+                raise
+            attempt += 1
+            continue
+        finally:
+            guard.release(permit, failed)
+        UPSTREAM_RESPONSES.inc(group, method, str(resp.status_code))
+        if resp.status_code in _RETRY_STATUS and _retry_wait(attempt, deadline):
+            resp.close()
+            attempt += 1
+            continue
+        break
+
+    if UPSTREAM_REPLAY_URL:
+        for r in resp.history + [resp]:
+            r.url = original_url(r.url)
+            if 'Location' in r.headers:
+                r.headers['Location'] = original_url(r.headers['Location'])
+    if _recorder is not None:
+        for r in resp.history + [resp]:
+            _recorder(r.request.method, r.url, r)
+    return resp
+
+
+def _retry_wait(attempt, deadline):
+    """还有重试次数且退避后仍在预算内时退避并返回 True"""
+    if attempt >= UPSTREAM_RETRIES:
+        return False
+    backoff = UPSTREAM_BACKOFF_FACTOR * (2 ** attempt)
+    # 退避之后至少还要留出一次连接超时的时间，否则这次重试注定超时
+    if time.monotonic() + backoff + min(UPSTREAM_CONNECT_TIMEOUT, 1.0) >= deadline:
+        return False
+    time.sleep(backoff)
+    return True
+
+
+def http_get(url, headers=None, timeout=8, **kwargs):
+    """通过共享连接池发起 GET 请求（参数同 requests.get，timeout 为读取超时）"""
+    kwargs.setdefault('allow_redirects', True)
+    return _request('GET', url, headers, timeout, **kwargs)
+
+
+def http_head(url, headers=None, timeout=5, **kwargs):
+    """通过共享连接池发起 HEAD 请求（默认不跟随重定向）"""
+    kwargs.setdefault('allow_redirects', False)
+    return _request('HEAD', url, headers, timeout, **kwargs)
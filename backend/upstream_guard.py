@@ -0,0 +1,264 @@
+"""
+上游保护：按站点分组的熔断器 + 自适应并发上限（AIMD）+ 令牌桶限速
+小红书开始限流或某个CDN变慢时，不让每个请求都等满超时、线程越堆越多：
+- 熔断器：连续失败（超时/连接错误/429/5xx）达到阈值后打开，冷却期内直接拒绝；
+  冷却结束后放行一个探测请求（半开），只有这个探测请求的结果决定恢复或重新打开；
+  熔断之前发出、之后才结束的请求不改变状态
+- AIMD：每个成功且不慢的响应把并发上限 +1/上限（约每一轮 +1），失败或变慢时减半；
+  减半之前已发出的请求再失败不会重复减半
+- 令牌桶：限制每秒请求数，避开上游的反爬阈值
+三者都在请求发出前检查，拿不到许可时抛 UpstreamRejected（最多等待 wait 秒）。
+"""
+import threading
+import time
+
+from metrics import UPSTREAM_BREAKER_OPEN, UPSTREAM_CONCURRENCY_LIMIT, UPSTREAM_REJECTED
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# 计为失败的上游状态码（限流与服务端错误；403/404 等属于正常业务结果）
+FAILURE_STATUS = frozenset((429, 500, 502, 503, 504))
+
+
+class UpstreamRejected(RuntimeError):
+    """上游保护拒绝了本次请求（reason: circuit_open / concurrency / rate_limited）"""
+
+    def __init__(self, group, reason):
+        super().__init__('上游 {} 暂不可用: {}'.format(group, reason))
+        self.group = group
+        self.reason = reason
+
+
+def is_failure_status(status):
+    return status in FAILURE_STATUS
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, open_seconds=10):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opens = 0
+
+    def is_open(self):
+        """快速检查（不占用半开探测名额）：打开且仍在冷却期内"""
+        return self.state == OPEN and time.monotonic() < self._opened_at + self.open_seconds
+
+    def allow(self):
+        """放行时返回 (True, 是否为半开探测请求)，拒绝时返回 (False, False)"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True, False
+            if self.state == OPEN:
+                if time.monotonic() < self._opened_at + self.open_seconds:
+                    return False, False
+                self.state = HALF_OPEN
+            if self._probing:
+                return False, False
+            self._probing = True
+            return True, True
+
+    def _open(self):
+        if self.state != OPEN:
+            self.opens += 1
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+
+    def record(self, failed, probe=False):
+        with self._lock:
+            if probe:
+                # 只有半开探测请求的结果决定恢复还是重新打开
+                self._probing = False
+                if failed:
+                    self._open()
+                else:
+                    self._failures = 0
+                    self.state = CLOSED
+                return
+            if self.state != CLOSED:
+                return  # 熔断之前发出的请求：结果已经过时
+            if not failed:
+                self._failures = 0
+                return
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._open()
+
+    def abandon(self, probe=False):
+        """请求被调用方取消、没有结论：探测请求归还半开探测名额"""
+        if probe:
+            with self._lock:
+                self._probing = False
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'consecutive_failures': self._failures, 'opens': self.opens}
+
+
+class AIMDLimiter:
+    def __init__(self, initial=16, min_limit=1, max_limit=64, slow_seconds=3.0, backoff=0.5):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.slow_seconds = slow_seconds
+        self.backoff = backoff
+        self._limit = float(min(max(initial, min_limit), max_limit))
+        self._inflight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self, wait):
+        with self._cond:
+            deadline = time.monotonic() + wait
+            while self._inflight >= int(self._limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self._inflight += 1
+            return True
+
+    def cancel(self):
+        """归还名额但不计入样本（请求未发出）"""
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify()
+
+    def release(self, started, failed):
+        now = time.monotonic()
+        with self._cond:
+            self._inflight -= 1
+            if failed or now - started > self.slow_seconds:
+                if started >= self._last_decrease:
+                    self._limit = max(self.min_limit, self._limit * self.backoff)
+                    self._last_decrease = now
+            else:
+                self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {'limit': int(self._limit), 'inflight': self._inflight, 'max_limit': self.max_limit}
+
+
+class TokenBucket:
+    """rate 个/秒，最多积累 burst 个；令牌不足时预留并等待（等待超过 wait 秒则放弃）"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, wait):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            if delay > wait:
+                self._tokens += 1
+                return False
+        if delay:
+            time.sleep(delay)
+        return True
+
+    def refund(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+    def stats(self):
+        with self._lock:
+            return {'rate': self.rate, 'burst': self.burst, 'tokens': round(self._tokens, 2)}
+
+
+class Permit:
+    """一次许可：started 为拿到许可的时间，probe 表示这是熔断器半开时的探测请求"""
+    __slots__ = ('started', 'probe')
+
+    def __init__(self, probe):
+        self.started = time.monotonic()
+        self.probe = probe
+
+
+class UpstreamGuard:
+    """
+    一个站点分组的保护：
+        permit = guard.acquire(wait)       # 拿不到许可时抛 UpstreamRejected
+        ...发请求...
+        guard.release(permit, failed)      # 无论成功失败都必须调用（取消时调用 abandon(permit)）
+    """
+
+    REJECT_REASONS = ('circuit_open', 'concurrency', 'rate_limited')
+
+    def __init__(self, group, breaker, limiter, bucket=None):
+        self.group = group
+        self.breaker = breaker
+        self.limiter = limiter
+        self.bucket = bucket
+        UPSTREAM_CONCURRENCY_LIMIT.set(limiter.limit, group)
+        UPSTREAM_BREAKER_OPEN.set(0, group)
+
+    def _reject(self, reason):
+        UPSTREAM_REJECTED.inc(self.group, reason)
+        raise UpstreamRejected(self.group, reason)
+
+    def _take(self, wait):
+        """申请许可：成功返回 (Permit, None)，否则返回 (None, 拒绝原因)（已归还中途拿到的令牌/名额）"""
+        if self.breaker.is_open():
+            return None, 'circuit_open'
+        if self.bucket is not None and not self.bucket.acquire(wait):
+            return None, 'rate_limited'
+        if not self.limiter.acquire(wait):
+            if self.bucket is not None:
+                self.bucket.refund()
+            return None, 'concurrency'
+        # 半开探测名额最后申请：拿到之后不会再因为令牌/名额不足而放弃
+        allowed, probe = self.breaker.allow()
+        if not allowed:
+            self.limiter.cancel()
+            if self.bucket is not None:
+                self.bucket.refund()
+            return None, 'circuit_open'
+        return Permit(probe), None
+
+    def acquire(self, wait=0.0):
+        permit, reason = self._take(wait)
+        if reason is not None:
+            self._reject(reason)
+        return permit
+
+    def acquire_nowait(self):
+        """不等待：需要排队等令牌/名额时返回 None（异步调用方再到线程里调用 acquire），熔断打开时照常抛出"""
+        permit, reason = self._take(0.0)
+        if reason == 'circuit_open':
+            self._reject(reason)
+        return permit
+
+    def release(self, permit, failed):
+        self.limiter.release(permit.started, failed)
+        self.breaker.record(failed, permit.probe)
+        UPSTREAM_CONCURRENCY_LIMIT.set(self.limiter.limit, self.group)
+        UPSTREAM_BREAKER_OPEN.set(0 if self.breaker.state == CLOSED else 1, self.group)
+
+    def abandon(self, permit):
+        """请求被调用方取消（例如对冲请求落败）：归还名额，不计入成功/失败样本"""
+        self.limiter.cancel()
+        self.breaker.abandon(permit.probe)
+
+    def stats(self):
+        data = {'breaker': self.breaker.stats(), 'concurrency': self.limiter.stats(),
+                'rate': self.bucket.stats() if self.bucket is not None else None}
+        data['rejected'] = {reason: UPSTREAM_REJECTED.value(self.group, reason) for reason in self.REJECT_REASONS}
+        return data